@@ -3,7 +3,7 @@ import random
 import sys
 import os
 import numpy as np
-from typing import Dict, Any, List, Tuple, Optional, Union
+from typing import Dict, Any, List, Tuple, Optional
 sys.path.append(os.path.dirname(os.path.dirname(__file__)))
 from utils.shared_utils import (
     initialize_player_roles,
@@ -45,6 +45,7 @@ class Subsession(BaseSubsession):
     allocation_details = models.LongStringField(initial='[]')  # 儲存分配詳細資訊
     executed_trades = models.LongStringField(initial='[]')  # 新增：記錄成交的訂單
     allocation_method = models.StringField()
+    closed_groups = models.IntegerField(initial=0)  # 已結束交易的組別數（全部結束後釋放常駐的成交日誌）
 
 def initialize_roles(subsession: Subsession, allocation_method) -> None:
     """使用共享工具庫和配置文件初始化角色"""
@@ -304,6 +305,7 @@ class Group(BaseGroup):
     E_tax = models.IntegerField(initial=0)
     buy_orders = models.LongStringField(initial='[]')
     sell_orders = models.LongStringField(initial='[]')
+    book_snapshot = models.LongStringField(initial='')  # 訂單簿精簡快照（含 order_id 與日誌序號）
 
 class Player(BasePlayer):
     # 企業特性
@@ -355,6 +357,48 @@ class Player(BasePlayer):
     e_mkt = models.IntegerField(initial=0)
     e_tax = models.IntegerField(initial=0)
 
+class Trade(ExtraModel):
+    """成交紀錄（每筆成交一列，只追加）"""
+    subsession = models.Link(Subsession)
+    seq = models.IntegerField()
+    timestamp = models.StringField()
+    buyer_id = models.IntegerField()
+    seller_id = models.IntegerField()
+    price = models.IntegerField()
+    quantity = models.IntegerField()
+
+register_trade_model(__name__, Trade)
+
+class BookEvent(ExtraModel):
+    """訂單簿預寫日誌（每次掛單變動一列，只追加；欄位見 utils.order_book.BOOK_EVENT_FIELDS）"""
+    group = models.Link(Group)
+    seq = models.IntegerField()
+    op = models.StringField()
+    order_id = models.IntegerField()
+    player_id = models.IntegerField()
+    direction = models.StringField()
+    price = models.IntegerField()
+    quantity = models.IntegerField()
+
+register_book_event_model(__name__, BookEvent)
+
+def _trade_history_for(player: Player) -> List[Dict[str, Any]]:
+    """
+    全體玩家的交易記錄（附上顯示用時間與是否為買方）
+
+    成交日誌中的紀錄為共用物件，這裡回傳複本。
+    """
+    my_trades = []
+    for trade in get_trade_journal(player.subsession):
+        trade = dict(trade)
+        if 'timestamp' in trade and isinstance(trade['timestamp'], str):
+            trade['time'] = trade['timestamp']  # 已經是 MM:SS 格式
+        elif 'timestamp' in trade:
+            trade['time'] = time.strftime('%H:%M:%S', time.localtime(trade['timestamp']))
+        trade['is_buyer'] = (trade['buyer_id'] == player.id_in_group)
+        my_trades.append(trade)
+    return my_trades
+
 class Introduction(Page):
     @staticmethod
     def is_displayed(player):
@@ -419,10 +463,39 @@ class TradingMarket(Page):
     @staticmethod
     def live_method(player: Player, data: Dict[str, Any]) -> Dict[int, Dict[str, Any]]:
         """處理即時交易請求"""
-        # 初次連線或 ping
-        if data is None or data.get('type') == 'ping':
-            return {p.id_in_group: TradingMarket.market_state(p) for p in player.group.get_players()}
+        group = player.group
+        
+        # 超量訊息在處理前擋下：ping 直接丟棄、交易指令立即拒絕
+        limited = check_rate_limit(group, player, data)
+        if limited is not None:
+            return limited
+        
+        is_ping = data is None or data.get('type') == 'ping'
+        
+        # 往前翻頁的成交紀錄只回給發出請求的玩家，不影響市場
+        if not is_ping and data.get('type') == 'trade_history':
+            return {player.id_in_group: trade_history_page(group.subsession, data.get('before'))}
+        
+        # 交易指令排入組別佇列，依序執行佇列中所有指令（集合競價到期時一併撮合）後只產生一次合併的市場更新
+        if not is_ping:
+            enqueue_command(group, player, data)
+        result = process_commands(group, TradingMarket.apply_command, TradingMarket.clear_auction)
         
+        # 初次連線或 ping：發出請求的玩家收到快照；市場沒有變動時只回傳 unchanged
+        if is_ping:
+            return TradingMarket.market_updates(
+                group, result, player, snapshot=True, client_version=ping_version(data)
+            )
+        return TradingMarket.market_updates(group, result, player)
+
+    @staticmethod
+    def clear_auction(group: Group) -> Optional[Dict[str, Any]]:
+        """集合競價模式下本期結束時撮合（由 process_commands 在佇列處理完後呼叫）"""
+        return run_batch_auction(group, "碳權", 'current_permits')
+
+    @staticmethod
+    def apply_command(player: Player, data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """執行單一交易指令（由 process_commands 依序呼叫）"""
         group = player.group
         
         # 處理新訂單提交
@@ -436,31 +509,58 @@ class TradingMarket(Page):
             
             print(f"玩家 {player.id_in_group} 提交{direction}單: "
                   f"價格={price}, 數量={quantity}, "
-                  f"現金={player.current_cash}, 碳權={player.current_permits}")
+                  f"現金={settled_value(player, 'current_cash')}, 碳權={settled_value(player, 'current_permits')}")
             
             # 修改：使用統一的 process_new_order 函數
             result = process_new_order(
                 player, group, direction, price, quantity, 
                 "碳權", 'current_permits'  # 使用碳權相關參數
             )
+            return result
+        
+        # 一次送出多筆掛單：整批驗證，撮合後只產生一次更新
+        elif data.get('type') == 'submit_batch':
+            orders = data.get('orders') or []
+            print(f"玩家 {player.id_in_group} 批次提交 {len(orders)} 筆掛單")
             
-            # 處理通知
-            if result.get('notifications'):
-                market_states = {}
-                for p in group.get_players():
-                    state = TradingMarket.market_state(p)
-                    if p.id_in_group in result['notifications']:
-                        # 修改：根據 result.type 決定通知類型
-                        notification_type = 'success'
-                        if result.get('type') == 'fail':
-                            notification_type = 'error'  # 前端會轉換為 danger
-                        
-                        state['notification'] = {
-                            'type': notification_type,
-                            'message': result['notifications'][p.id_in_group]
-                        }
-                    market_states[p.id_in_group] = state
-                return market_states
+            result = process_order_batch(player, group, orders, "碳權", 'current_permits')
+            # 只記錄實際掛出或成交的訂單（略過的訂單不進入訂單簿）
+            for direction, price, quantity in result.get('placed', []):
+                record_submitted_offer(player, direction, price, quantity)
+            return result
+        
+        # 修改自己的掛單（取代取消後重新掛單），只產生一次更新
+        elif data.get('type') == 'amend_offer':
+            order_id = int(data.get('order_id', 0))
+            price = int(data.get('price', 0))
+            quantity = int(data.get('quantity', 0))
+            
+            print(f"玩家 {player.id_in_group} 修改掛單 #{order_id}: "
+                  f"價格={price}, 數量={quantity}")
+            
+            order = get_order_book(group).get(order_id)
+            result = process_amend_order(player, group, order_id, price, quantity, "碳權", 'current_permits')
+            if result['type'] != 'fail' and order is not None:
+                record_submitted_offer(player, order.direction, price, quantity)
+            return result
+        
+        # 掃單：一次吃掉限價內最佳的多筆對手掛單，只產生一則合併通知與一次更新
+        elif data.get('type') == 'sweep_order':
+            direction = data.get('direction')
+            price = int(data.get('price', 0))
+            quantity = int(data.get('quantity', 0))
+            
+            print(f"玩家 {player.id_in_group} 掃單{direction}: "
+                  f"限價={price}, 數量={quantity}")
+            
+            result = process_sweep_order(player, group, direction, price, quantity, "碳權", 'current_permits')
+            if result['type'] != 'fail':
+                record_submitted_offer(player, direction, price, quantity)
+            return result
+        
+        # 取消自己的所有掛單
+        elif data.get('type') == 'cancel_all':
+            return process_cancel_all(player, group)
         
         # 處理接受訂單
         elif data.get('type') == 'accept_offer':
@@ -477,24 +577,7 @@ class TradingMarket(Page):
                 player, group, offer_type, target_id, price, quantity,
                 "碳權", 'current_permits'  # 使用碳權相關參數
             )
-            
-            # 處理通知
-            if result.get('notifications'):
-                market_states = {}
-                for p in group.get_players():
-                    state = TradingMarket.market_state(p)
-                    if p.id_in_group in result['notifications']:
-                        state['notification'] = {
-                            'type': 'success',
-                            'message': result['notifications'][p.id_in_group]
-                        }
-                    market_states[p.id_in_group] = state
-                return market_states
-            elif result.get('update_all'):
-                return {p.id_in_group: TradingMarket.market_state(p) 
-                        for p in group.get_players()}
-            else:
-                return result
+            return result
     
         # 處理取消訂單
         elif data.get('type') == 'cancel_offer':
@@ -507,84 +590,79 @@ class TradingMarket(Page):
             
             # 取消訂單
             cancel_specific_order(group, player.id_in_group, direction, price, quantity)
-            
-            return {p.id_in_group: TradingMarket.market_state(p) 
-                    for p in group.get_players()}
+            return None
         
-        # 預設回應
-        return {p.id_in_group: TradingMarket.market_state(p) 
-                for p in group.get_players()}
+        return None
+
+    @staticmethod
+    def market_updates(
+        group: Group,
+        result: Optional[Dict[str, Any]] = None,
+        player: Optional[Player] = None,
+        snapshot: bool = False,
+        client_version: Optional[Tuple[Any, Any]] = None
+    ) -> Dict[int, Dict[str, Any]]:
+        """組內的市場更新：公開狀態只計算一次並以增量送出，有變動的玩家另附私人狀態與通知"""
+        return market_updates(
+            group, TradingMarket.public_state, TradingMarket.private_state,
+            result, player, snapshot, client_version
+        )
 
     @staticmethod
     def market_state(player: Player) -> Dict[str, Any]:
-        """獲取市場狀態"""
-        group = player.group
+        """獲取完整市場狀態（快照）"""
+        public = public_market_state(player.group, TradingMarket.public_state)
+        feed = get_market_feed(player.group)
+        return {**public, **TradingMarket.private_state(player), 'epoch': feed.epoch, 'seq': feed.seq}
+
+    @staticmethod
+    def public_state(group: Group) -> Dict[str, Any]:
+        """所有玩家相同的市場狀態：公開掛單、成交紀錄與價格歷史"""
+        book = get_order_book(group)
         
-            # 解析訂單
-        buy_orders, sell_orders = parse_orders(group)
-            
-        # 排序訂單
-        buy_sorted = sorted(buy_orders, key=lambda x: (-float(x[1]), int(x[0])))
-        sell_sorted = sorted(sell_orders, key=lambda x: (float(x[1]), int(x[0])))
+        # 每個數量級別顯示最好的3筆（訂單簿的 display_depth，公開狀態只在這些掛單變動時重建）
+        public_buy_offers = [o.to_offer() for o in book.display_orders('buy')]
+        public_sell_offers = [o.to_offer() for o in book.display_orders('sell')]
         
-        try:
-            # 提取玩家自己的買單和賣單
-            my_buy_offers = [{'player_id': int(pid), 'price': int(float(price)), 'quantity': int(qt)} 
-                          for pid, price, qt in buy_sorted if int(pid) == player.id_in_group]
-            my_sell_offers = [{'player_id': int(pid), 'price': int(float(price)), 'quantity': int(qt)} 
-                           for pid, price, qt in sell_sorted if int(pid) == player.id_in_group]
-            
-            # 修改：使用新的過濾函數，每個數量級別顯示最好的3筆
-            display_buy_orders = filter_top_buy_orders_for_display(buy_sorted, max_per_quantity=3)
-            display_sell_orders = filter_top_sell_orders_for_display(sell_sorted, max_per_quantity=3)
-            
-            # 轉換為前端格式
-            public_buy_offers = [{'player_id': int(pid), 'price': int(float(price)), 'quantity': int(qt)} 
-                               for pid, price, qt in display_buy_orders]
-            public_sell_offers = [{'player_id': int(pid), 'price': int(float(price)), 'quantity': int(qt)} 
-                                for pid, price, qt in display_sell_orders]
-            
-            # 排序（保持原有的排序邏輯）
-            public_buy_offers.sort(key=lambda x: (-x['price'], x['player_id']))
-            public_sell_offers.sort(key=lambda x: (x['price'], x['player_id']))
-            
-        except Exception as e:
-            my_buy_offers = []
-            my_sell_offers = []
-            public_buy_offers = []
-            public_sell_offers = []
+        # 排序（保持原有的排序邏輯）
+        public_buy_offers.sort(key=lambda x: (-x['price'], x['player_id']))
+        public_sell_offers.sort(key=lambda x: (x['price'], x['player_id']))
+        
+        # 最近成交（全體玩家；timestamp 已是 MM:SS 格式，買入 / 賣出由前端以 buyer_id 判斷），
+        # 較早的成交由前端以 trade_history_cursor 分頁請求
+        trade_history = trade_history_window(group.subsession)
+        
+        # 價格 K 線與成交統計（隨成交逐筆更新，不需重新計算；逐筆價格歷史不送給用戶端）
+        candles = get_market_stats(group.subsession).candle_series()
+        
+        return {
+            'buy_offers': public_buy_offers,
+            'sell_offers': public_sell_offers,
+            **trade_history,
+            'candles': candles,
+            'stats': market_statistics(group),
+            'reset_cash': C.RESET_CASH_EACH_ROUND,
+        }
+
+    @staticmethod
+    def private_state(player: Player) -> Dict[str, Any]:
+        """玩家自己的狀態：資源、成本參數與自己的掛單"""
+        book = get_order_book(player.group)
+        
+        # 提取玩家自己的買單和賣單（依價格優先排序）
+        my_buy_offers = [o.to_offer() for o in book.player_orders(player.id_in_group, 'buy', by_priority=True)]
+        my_sell_offers = [o.to_offer() for o in book.player_orders(player.id_in_group, 'sell', by_priority=True)]
         
         # 計算已鎖定資源
         # 買單邏輯改為無限制掛單，不再鎖定現金
         locked_cash = 0  # sum(o['price'] * o['quantity'] for o in my_buy_offers)
-        locked_permits = sum(o['quantity'] for o in my_sell_offers)
+        locked_permits = book.locked_quantity(player.id_in_group, 'sell')  # 訂單簿的鎖定帳，O(1)
     
         # 剩餘可用
         available_cash = int(player.current_cash)  # 保持原樣，允許負數
         available_permits = int(player.current_permits)
         
-        # 提取交易歷史
-        try:
-            trade_history = json.loads(player.subsession.executed_trades)
-            # 顯示全體玩家的交易記錄
-            my_trades = trade_history  # 修改：顯示所有交易而不是個人交易
-            # 將時間戳轉換為可讀格式
-            for trade in my_trades:
-                if 'timestamp' in trade and isinstance(trade['timestamp'], str):
-                    trade['time'] = trade['timestamp']  # 已經是 MM:SS 格式
-                elif 'timestamp' in trade:
-                    trade['time'] = time.strftime('%H:%M:%S', time.localtime(trade['timestamp']))
-                trade['is_buyer'] = (trade['buyer_id'] == player.id_in_group)
-        except:
-            my_trades = []
-            
-        # 提取價格歷史
-        try:
-            price_history = json.loads(player.subsession.price_history)
-        except:
-            price_history = []
-        
-        result = {
+        return {
             'type': 'update',
             'cash': available_cash,
             'permits': available_permits,
@@ -592,24 +670,16 @@ class TradingMarket(Page):
             'carbon_emission_per_unit': player.carbon_emission_per_unit,
             'my_buy_offers': my_buy_offers,
             'my_sell_offers': my_sell_offers,
-            'buy_offers': public_buy_offers,
-            'sell_offers': public_sell_offers,
-            'trade_history': my_trades,  # 確保這裡返回交易歷史
-            'price_history': price_history,
             #'profit_table': profit_table,
             'locked_cash': locked_cash,
             'locked_permits': locked_permits,
-            'reset_cash': C.RESET_CASH_EACH_ROUND,
         }
-        
-        return result
 
     @staticmethod
     def before_next_page(player, timeout_happened):
-        if timeout_happened and player.id_in_group == 1:
-            player.group.buy_orders = '[]'
-            player.group.sell_orders = '[]'
         if timeout_happened:
+            # 交易時間結束：第一位離開的玩家一次清除整組掛單，之後的呼叫不再寫入
+            expire_group_orders(player.group)
             player.current_cash = max(player.current_cash, 0)
             player.current_permits = max(player.current_permits, 0)
 
@@ -619,7 +689,8 @@ class TradingMarket(Page):
         return {
             'start_time': player.group.subsession.start_time,
             'player_id': player.id_in_group,
-            'timeout_seconds': C.TRADING_TIME
+            'timeout_seconds': C.TRADING_TIME,
+            'market_tick_ms': market_tick_ms(player.group),
         }
 
 
@@ -658,25 +729,10 @@ class ProductionDecision(Page):
         unit_income = int(player.market_price)
         
         # 獲取交易歷史
-        try:
-            trade_history = json.loads(player.subsession.executed_trades)
-            # 顯示全體玩家的交易記錄
-            my_trades = trade_history  # 修改：顯示所有交易而不是個人交易
-            # 將時間戳轉換為可讀格式
-            for trade in my_trades:
-                if 'timestamp' in trade and isinstance(trade['timestamp'], str):
-                    trade['time'] = trade['timestamp']  # 已經是 MM:SS 格式
-                elif 'timestamp' in trade:
-                    trade['time'] = time.strftime('%H:%M:%S', time.localtime(trade['timestamp']))
-                trade['is_buyer'] = (trade['buyer_id'] == player.id_in_group)
-        except:
-            my_trades = []
+        my_trades = _trade_history_for(player)  # 顯示所有交易而不是個人交易
             
         # 獲取價格歷史
-        try:
-            price_history = json.loads(player.subsession.price_history)
-        except:
-            price_history = []
+        price_history = get_market_stats(player.subsession).price_history
         
         return dict(
             max_production=player.max_production,
@@ -708,6 +764,12 @@ class ProductionDecision(Page):
 class ResultsWaitPage(WaitPage):
     @staticmethod
     def after_all_players_arrive(group):
+        # 成交日誌寫回 executed_trades 欄位（資料匯出用）
+        save_trade_journal(group.subsession)
+        # 清除殘留掛單並釋放本回合的常駐市場狀態
+        expire_group_orders(group)
+        release_market(group)
+        
         # 先計算一般payoff
         calculate_general_payoff(group, use_trading=True)
         
@@ -773,25 +835,10 @@ class Results(Page):
         final_cash_percentage = round((player.final_cash / initial_cash) * 100) if initial_cash > 0 else 0
         
         # 獲取交易歷史
-        try:
-            trade_history = json.loads(player.subsession.executed_trades)
-            # 顯示全體玩家的交易記錄
-            my_trades = trade_history  # 修改：顯示所有交易而不是個人交易
-            # 將時間戳轉換為可讀格式
-            for trade in my_trades:
-                if 'timestamp' in trade and isinstance(trade['timestamp'], str):
-                    trade['time'] = trade['timestamp']  # 已經是 MM:SS 格式
-                elif 'timestamp' in trade:
-                    trade['time'] = time.strftime('%H:%M:%S', time.localtime(trade['timestamp']))
-                trade['is_buyer'] = (trade['buyer_id'] == player.id_in_group)
-        except:
-            my_trades = []
+        my_trades = _trade_history_for(player)  # 顯示所有交易而不是個人交易
             
         # 獲取價格歷史
-        try:
-            price_history = json.loads(player.subsession.price_history)
-        except:
-            price_history = []
+        price_history = get_market_stats(player.subsession).price_history
             
         # 獲取統計數據
         avg_buy_price = round(player.total_spent / player.total_bought, 2) if player.total_bought > 0 else 0
@@ -1,9 +1,8 @@
 from otree.api import *
 import random
-import json
 import sys
 import os
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Optional, Tuple
 sys.path.append(os.path.dirname(os.path.dirname(__file__)))
 from utils.trading_utils import *
 from configs.config import config
@@ -25,6 +24,7 @@ class Subsession(BaseSubsession):
     start_time = models.IntegerField()
     executed_trades = models.LongStringField(initial='[]')
     price_option_set = models.StringField(initial='')
+    closed_groups = models.IntegerField(initial=0)  # 已結束交易的組別數（全部結束後釋放常駐的成交日誌）
 
 def creating_session(subsession: Subsession) -> None:
     """創建會話時的初始化"""
@@ -93,6 +93,7 @@ def _initialize_player(player: BasePlayer, price_options: List[int]) -> None:
 class Group(BaseGroup):
     buy_orders = models.LongStringField(initial='[]')
     sell_orders = models.LongStringField(initial='[]')
+    book_snapshot = models.LongStringField(initial='')  # 訂單簿精簡快照（含 order_id 與日誌序號）
 
 class Player(BasePlayer):
     # 交易相關欄位
@@ -120,8 +121,38 @@ class Player(BasePlayer):
     submitted_offers = models.LongStringField(initial='[]')
     selected_round = models.IntegerField()
 
+class Trade(ExtraModel):
+    """成交紀錄（每筆成交一列，只追加）"""
+    subsession = models.Link(Subsession)
+    seq = models.IntegerField()
+    timestamp = models.StringField()
+    buyer_id = models.IntegerField()
+    seller_id = models.IntegerField()
+    price = models.IntegerField()
+    quantity = models.IntegerField()
+
+register_trade_model(__name__, Trade)
+
+class BookEvent(ExtraModel):
+    """訂單簿預寫日誌（每次掛單變動一列，只追加；欄位見 utils.order_book.BOOK_EVENT_FIELDS）"""
+    group = models.Link(Group)
+    seq = models.IntegerField()
+    op = models.StringField()
+    order_id = models.IntegerField()
+    player_id = models.IntegerField()
+    direction = models.StringField()
+    price = models.IntegerField()
+    quantity = models.IntegerField()
+
+register_book_event_model(__name__, BookEvent)
+
 def set_payoffs(group: BaseGroup) -> None:
     """設置玩家報酬"""
+    # 成交日誌寫回 executed_trades 欄位（資料匯出用）
+    save_trade_journal(group.subsession)
+    # 清除殘留掛單並釋放本回合的常駐市場狀態
+    expire_group_orders(group)
+    release_market(group)
     for p in group.get_players():
         # 計算資產價值
         personal_value = p.field_maybe_none('personal_item_value') or p.subsession.item_market_price
@@ -175,10 +206,39 @@ class TradingMarket(Page):
     @staticmethod
     def live_method(player: Player, data: Dict[str, Any]) -> Dict[int, Dict[str, Any]]:
         """處理即時交易請求"""
-        # 初次連線或 ping
-        if data is None or data.get('type') == 'ping':
-            return {p.id_in_group: TradingMarket.market_state(p) for p in player.group.get_players()}
-            
+        group = player.group
+        
+        # 超量訊息在處理前擋下：ping 直接丟棄、交易指令立即拒絕
+        limited = check_rate_limit(group, player, data)
+        if limited is not None:
+            return limited
+        
+        is_ping = data is None or data.get('type') == 'ping'
+        
+        # 往前翻頁的成交紀錄只回給發出請求的玩家，不影響市場
+        if not is_ping and data.get('type') == 'trade_history':
+            return {player.id_in_group: trade_history_page(group.subsession, data.get('before'))}
+        
+        # 交易指令排入組別佇列，依序執行佇列中所有指令（集合競價到期時一併撮合）後只產生一次合併的市場更新
+        if not is_ping:
+            enqueue_command(group, player, data)
+        result = process_commands(group, TradingMarket.apply_command, TradingMarket.clear_auction)
+        
+        # 初次連線或 ping：發出請求的玩家收到快照；市場沒有變動時只回傳 unchanged
+        if is_ping:
+            return TradingMarket.market_updates(
+                group, result, player, snapshot=True, client_version=ping_version(data)
+            )
+        return TradingMarket.market_updates(group, result, player)
+
+    @staticmethod
+    def clear_auction(group: Group) -> Optional[Dict[str, Any]]:
+        """集合競價模式下本期結束時撮合（由 process_commands 在佇列處理完後呼叫）"""
+        return run_batch_auction(group, C.ITEM_NAME, 'current_items')
+
+    @staticmethod
+    def apply_command(player: Player, data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """執行單一交易指令（由 process_commands 依序呼叫）"""
         group = player.group
         
         # 修復：統一處理 submit_offer
@@ -192,36 +252,58 @@ class TradingMarket(Page):
             
             print(f"玩家 {player.id_in_group} 提交{direction}單: "
                   f"價格={price}, 數量={quantity}, "
-                  f"現金={player.current_cash}, {C.ITEM_NAME}={player.current_items}")
+                  f"現金={settled_value(player, 'current_cash')}, {C.ITEM_NAME}={settled_value(player, 'current_items')}")
             
             # 使用統一的 process_new_order 函數
             result = process_new_order(
                 player, group, direction, price, quantity, 
                 C.ITEM_NAME, 'current_items'
             )
+            return result
+        
+        # 一次送出多筆掛單：整批驗證，撮合後只產生一次更新
+        elif data.get('type') == 'submit_batch':
+            orders = data.get('orders') or []
+            print(f"玩家 {player.id_in_group} 批次提交 {len(orders)} 筆掛單")
+            
+            result = process_order_batch(player, group, orders, C.ITEM_NAME, 'current_items')
+            # 只記錄實際掛出或成交的訂單（略過的訂單不進入訂單簿）
+            for direction, price, quantity in result.get('placed', []):
+                record_submitted_offer(player, direction, price, quantity)
+            return result
+        
+        # 修改自己的掛單（取代取消後重新掛單），只產生一次更新
+        elif data.get('type') == 'amend_offer':
+            order_id = int(data.get('order_id', 0))
+            price = int(data.get('price', 0))
+            quantity = int(data.get('quantity', 0))
+            
+            print(f"玩家 {player.id_in_group} 修改掛單 #{order_id}: "
+                  f"價格={price}, 數量={quantity}")
             
-            # 處理通知
-            if result.get('notifications'):
-                market_states = {}
-                for p in group.get_players():
-                    state = TradingMarket.market_state(p)
-                    if p.id_in_group in result['notifications']:
-                        # 根據 result.type 決定通知類型
-                        notification_type = 'success'
-                        if result.get('type') == 'fail':
-                            notification_type = 'error'  # 前端會轉換為 danger
-                        
-                        state['notification'] = {
-                            'type': notification_type,
-                            'message': result['notifications'][p.id_in_group]
-                        }
-                    market_states[p.id_in_group] = state
-                return market_states
-            elif result.get('update_all'):
-                return {p.id_in_group: TradingMarket.market_state(p) 
-                        for p in group.get_players()}
-            else:
-                return result
+            order = get_order_book(group).get(order_id)
+            result = process_amend_order(player, group, order_id, price, quantity, C.ITEM_NAME, 'current_items')
+            if result['type'] != 'fail' and order is not None:
+                record_submitted_offer(player, order.direction, price, quantity)
+            return result
+        
+        # 掃單：一次吃掉限價內最佳的多筆對手掛單，只產生一則合併通知與一次更新
+        elif data.get('type') == 'sweep_order':
+            direction = data.get('direction')
+            price = int(data.get('price', 0))
+            quantity = int(data.get('quantity', 0))
+            
+            print(f"玩家 {player.id_in_group} 掃單{direction}: "
+                  f"限價={price}, 數量={quantity}")
+            
+            result = process_sweep_order(player, group, direction, price, quantity, C.ITEM_NAME, 'current_items')
+            if result['type'] != 'fail':
+                record_submitted_offer(player, direction, price, quantity)
+            return result
+        
+        # 取消自己的所有掛單
+        elif data.get('type') == 'cancel_all':
+            return process_cancel_all(player, group)
         
         # 修復：統一處理 accept_offer，統一使用 player_id 參數
         elif data.get('type') == 'accept_offer':
@@ -238,24 +320,7 @@ class TradingMarket(Page):
                 player, group, offer_type, target_id, price, quantity,
                 C.ITEM_NAME, 'current_items'
             )
-                    
-            # 處理通知
-            if result.get('notifications'):
-                market_states = {}
-                for p in group.get_players():
-                    state = TradingMarket.market_state(p)
-                    if p.id_in_group in result['notifications']:
-                        state['notification'] = {
-                            'type': 'success',
-                            'message': result['notifications'][p.id_in_group]
-                        }
-                    market_states[p.id_in_group] = state
-                return market_states
-            elif result.get('update_all'):
-                return {p.id_in_group: TradingMarket.market_state(p) 
-                        for p in group.get_players()}
-            else:
-                return result
+            return result
         
         # 修復：統一處理 cancel_offer
         elif data.get('type') == 'cancel_offer':
@@ -268,63 +333,66 @@ class TradingMarket(Page):
             
             # 取消訂單
             cancel_specific_order(group, player.id_in_group, direction, price, quantity)
-            
-            return {p.id_in_group: TradingMarket.market_state(p) 
-                    for p in group.get_players()}
+            return None
         
-        # 預設回應
-        return {p.id_in_group: TradingMarket.market_state(p) 
-                for p in group.get_players()}
+        return None
+
+    @staticmethod
+    def market_updates(
+        group: Group,
+        result: Optional[Dict[str, Any]] = None,
+        player: Optional[Player] = None,
+        snapshot: bool = False,
+        client_version: Optional[Tuple[Any, Any]] = None
+    ) -> Dict[int, Dict[str, Any]]:
+        """組內的市場更新：公開狀態只計算一次並以增量送出，有變動的玩家另附私人狀態與通知"""
+        return market_updates(
+            group, TradingMarket.public_state, TradingMarket.private_state,
+            result, player, snapshot, client_version
+        )
 
     @staticmethod
     def market_state(player: Player) -> Dict[str, Any]:
-        """獲取市場狀態"""
-        group = player.group
-        buy_orders, sell_orders = parse_orders(group)
+        """獲取完整市場狀態（快照）"""
+        public = public_market_state(player.group, TradingMarket.public_state)
+        feed = get_market_feed(player.group)
+        return {**public, **TradingMarket.private_state(player), 'epoch': feed.epoch, 'seq': feed.seq}
+
+    @staticmethod
+    def public_state(group: Group) -> Dict[str, Any]:
+        """所有玩家相同的市場狀態：公開掛單、最近成交與價格歷史"""
+        book = get_order_book(group)
         
-        # 排序訂單
-        buy_sorted = sorted(buy_orders, key=lambda x: (-float(x[1]), int(x[0])))
-        sell_sorted = sorted(sell_orders, key=lambda x: (float(x[1]), int(x[0])))
+        # 每個數量級別顯示最好的3筆（訂單簿的 display_depth，公開狀態只在這些掛單變動時重建）
+        public_buy_offers = [o.to_offer() for o in book.display_orders('buy')]
+        public_sell_offers = [o.to_offer() for o in book.display_orders('sell')]
         
-        try:
-            # 提取玩家自己的買單和賣單
-            my_buy_offers = [{'player_id': int(pid), 'price': int(float(price)), 'quantity': int(qt)} 
-                          for pid, price, qt in buy_sorted if int(pid) == player.id_in_group]
-            my_sell_offers = [{'player_id': int(pid), 'price': int(float(price)), 'quantity': int(qt)} 
-                           for pid, price, qt in sell_sorted if int(pid) == player.id_in_group]
-            
-            # 修改：使用新的過濾函數，每個數量級別顯示最好的3筆
-            display_buy_orders = filter_top_buy_orders_for_display(buy_sorted, max_per_quantity=3)
-            display_sell_orders = filter_top_sell_orders_for_display(sell_sorted, max_per_quantity=3)
-            
-            # 轉換為前端格式
-            public_buy_offers = [{'player_id': int(pid), 'price': int(float(price)), 'quantity': int(qt)} 
-                               for pid, price, qt in display_buy_orders]
-            public_sell_offers = [{'player_id': int(pid), 'price': int(float(price)), 'quantity': int(qt)} 
-                                for pid, price, qt in display_sell_orders]
-            
-            # 排序（保持原有的排序邏輯）
-            public_buy_offers.sort(key=lambda x: (-x['price'], x['player_id']))
-            public_sell_offers.sort(key=lambda x: (x['price'], x['player_id']))
-            
-        except Exception as e:
-            my_buy_offers = []
-            my_sell_offers = []
-            public_buy_offers = []
-            public_sell_offers = []
+        # 排序（保持原有的排序邏輯）
+        public_buy_offers.sort(key=lambda x: (-x['price'], x['player_id']))
+        public_sell_offers.sort(key=lambda x: (x['price'], x['player_id']))
         
-        # 獲取交易歷史
-        try:
-            trade_history = json.loads(player.subsession.executed_trades)
-            recent_trades = trade_history[-10:]  # 最近10筆交易
-        except (json.JSONDecodeError, AttributeError):
-            recent_trades = []
+        # 最近成交（用戶端套用增量時只保留 trade_history_limit 筆，較早的以 trade_history_cursor 分頁請求）
+        trade_history = trade_history_window(group.subsession)
+        
+        # 價格 K 線與成交統計（隨成交逐筆更新，不需重新計算；逐筆價格歷史不送給用戶端）
+        candles = get_market_stats(group.subsession).candle_series()
+        
+        return {
+            'buy_offers': public_buy_offers,
+            'sell_offers': public_sell_offers,
+            **trade_history,
+            'candles': candles,
+            'stats': market_statistics(group),
+        }
+
+    @staticmethod
+    def private_state(player: Player) -> Dict[str, Any]:
+        """玩家自己的狀態：資源、自己的掛單與交易統計"""
+        book = get_order_book(player.group)
         
-        # 獲取價格歷史
-        try:
-            price_history = json.loads(player.subsession.price_history)
-        except (json.JSONDecodeError, AttributeError):
-            price_history = []
+        # 提取玩家自己的買單和賣單（依價格優先排序）
+        my_buy_offers = [o.to_offer() for o in book.player_orders(player.id_in_group, 'buy', by_priority=True)]
+        my_sell_offers = [o.to_offer() for o in book.player_orders(player.id_in_group, 'sell', by_priority=True)]
         
         # 修復：統一返回數據格式，使用 'update' 而不是 'market_update'
         return {
@@ -333,10 +401,6 @@ class TradingMarket(Page):
             'items': player.current_items,
             'my_buy_offers': my_buy_offers,
             'my_sell_offers': my_sell_offers,
-            'buy_offers': public_buy_offers,
-            'sell_offers': public_sell_offers,
-            'trade_history': recent_trades,
-            'price_history': price_history,
             'total_bought': player.total_bought,
             'total_sold': player.total_sold,
             'total_spent': int(player.total_spent),
@@ -346,10 +410,9 @@ class TradingMarket(Page):
     @staticmethod
     def before_next_page(player: Player, timeout_happened: bool) -> None:
         """頁面結束前的處理"""
-        # 清理未成交的訂單
+        # 交易時間結束：第一位離開的玩家一次清除整組未成交的訂單，之後的呼叫不再寫入
         if timeout_happened:
-            cancel_player_orders(player.group, player.id_in_group, 'buy')
-            cancel_player_orders(player.group, player.id_in_group, 'sell')
+            expire_group_orders(player.group)
 
     @staticmethod
     def js_vars(player: Player) -> Dict[str, Any]:
@@ -358,6 +421,7 @@ class TradingMarket(Page):
             'player_id': player.id_in_group,
             'item_name': C.ITEM_NAME,
             'start_time': player.subsession.start_time,
+            'market_tick_ms': market_tick_ms(player.group),
         }
 
 
@@ -372,10 +436,7 @@ class Results(Page):
         group_items_total = sum(p.current_items for p in player.group.get_players())
         
         # 獲取交易歷史
-        try:
-            trade_history = json.loads(player.subsession.executed_trades)
-        except (json.JSONDecodeError, AttributeError):
-            trade_history = []
+        trade_history = get_trade_journal(player.subsession)
         
         # 獲取最終報酬資訊
         final_payoff_info = _calculate_final_payoff_info(player)
@@ -0,0 +1,74 @@
+/**
+ * 市場行情面板（MUDA 與碳交易共用）
+ *
+ * 讀取公開狀態中伺服器維護的 stats 與 candles（見 market_sync.js），
+ * 不從成交紀錄重新計算：
+ * - stats：最新成交價、VWAP、成交量、成交筆數、最高 / 最低價、最佳買賣價與價差
+ * - candles：固定秒數的 K 線 {t, open, high, low, close, volume}，畫成價格圖
+ *
+ * 頁面需有 data-stat="欄位名" 的元素與 id="price-chart" 的 <svg>；
+ * 收到快照或增量後呼叫 MarketPanel.render(data)。
+ */
+const MarketPanel = (function () {
+    const SVG_NS = 'http://www.w3.org/2000/svg';
+    const MAX_CANDLES = 60;  // 圖上最多顯示的 K 線根數（最近的）
+
+    function formatValue(value) {
+        return value === null || value === undefined ? '—' : value;
+    }
+
+    function renderStats(stats) {
+        document.querySelectorAll('[data-stat]').forEach(el => {
+            el.textContent = formatValue(stats[el.dataset.stat]);
+        });
+    }
+
+    function svgElement(tag, attrs) {
+        const el = document.createElementNS(SVG_NS, tag);
+        Object.keys(attrs).forEach(k => el.setAttribute(k, attrs[k]));
+        return el;
+    }
+
+    function renderCandles(candles) {
+        const svg = document.getElementById('price-chart');
+        if (!svg) return;
+        while (svg.firstChild) svg.removeChild(svg.firstChild);
+
+        const shown = candles.slice(-MAX_CANDLES);
+        if (!shown.length) {
+            const text = svgElement('text', { x: '50%', y: '50%', 'text-anchor': 'middle', fill: '#6c757d', 'font-size': 12 });
+            text.textContent = '尚無成交';
+            svg.appendChild(text);
+            return;
+        }
+
+        const width = svg.clientWidth || 300;
+        const height = svg.clientHeight || 120;
+        const pad = 4;
+        const high = Math.max(...shown.map(c => c.high));
+        const low = Math.min(...shown.map(c => c.low));
+        const range = Math.max(high - low, 1);
+        const y = price => pad + (high - price) / range * (height - 2 * pad);
+        const step = (width - 2 * pad) / MAX_CANDLES;
+        const body = Math.max(step * 0.6, 1);
+
+        shown.forEach((c, i) => {
+            const x = pad + i * step + step / 2;
+            const color = c.close >= c.open ? '#28a745' : '#dc3545';
+            svg.appendChild(svgElement('line', { x1: x, x2: x, y1: y(c.high), y2: y(c.low), stroke: color }));
+            const top = y(Math.max(c.open, c.close));
+            svg.appendChild(svgElement('rect', {
+                x: x - body / 2, y: top, width: body,
+                height: Math.max(y(Math.min(c.open, c.close)) - top, 1), fill: color,
+            }));
+        });
+    }
+
+    function render(data) {
+        if (!data) return;
+        if (data.stats) renderStats(data.stats);
+        if (data.candles) renderCandles(data.candles);
+    }
+
+    return { render };
+})();
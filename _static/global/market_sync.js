@@ -0,0 +1,152 @@
+/**
+ * 交易市場增量同步（MUDA 與碳交易共用）
+ *
+ * 伺服器送出三種市場訊息（皆帶 epoch 與 seq）：
+ * - {type: 'update', ...}：完整快照（初次連線、ping 或序號不連續時）
+ * - {type: 'delta', market?, ...私人狀態?, notification?}：增量更新
+ * - {type: 'unchanged', ...私人狀態}：ping 帶的版本仍是最新時的簡短回覆
+ *   market.buy_offers / sell_offers = {ids: 顯示順序, upsert: 新增或變動的掛單}
+ *   market.trades = 新成交，market.candles = 更新的最後一根與新增的 K 線，market.stats = 有變動時的整份市場統計
+ *
+ * applyMarketMessage 把增量套用到本地保存的快照，回傳與完整快照相同格式的資料，
+ * 既有的畫面更新函數不需修改；序號不連續時回傳 null 並要求完整快照。
+ * 定時 ping 請用 MarketSync.ping()，會附上已套用的版本。
+ * 伺服器合併廣播時，私人更新會帶 flush_in（毫秒），屆時自動 ping 一次取回合併後的公開增量。
+ *
+ * 成交紀錄只保留最近 trade_history_limit 筆；MarketSync.loadOlderTrades() 以游標
+ * （最早一筆的序號）請求更早的一頁，伺服器回覆 {type: 'trade_page'} 後併入 trade_history。
+ */
+const MarketSync = (function () {
+    let state = null;   // 最近一次的完整市場狀態
+    let seq = null;     // 已套用的公開市場序號
+    let epoch = null;   // 伺服器端序號的世代（伺服器重啟後改變）
+    let awaitingSnapshot = false;
+    let flushTimer = null;  // 合併廣播後補 ping 的計時器
+    let tradeCursor = 0;   // trade_history 第一筆的成交序號（0 表示沒有更早的成交）
+    let olderTrades = 0;   // 已往前載入的筆數（不因新成交被截掉）
+
+    function requestSnapshot() {
+        state = null;
+        seq = null;
+        epoch = null;
+        if (awaitingSnapshot) return;  // 已在等待快照，不重複要求
+        awaitingSnapshot = true;
+        liveSend({ type: 'ping' });
+    }
+
+    function ping() {
+        if (state === null) {
+            liveSend({ type: 'ping' });
+        } else {
+            liveSend({ type: 'ping', epoch: epoch, seq: seq });
+        }
+    }
+
+    function applyOffers(side, change) {
+        const byId = {};
+        (state[side] || []).forEach(o => { byId[o.order_id] = o; });
+        change.upsert.forEach(o => { byId[o.order_id] = o; });
+        state[side] = change.ids.map(id => byId[id]).filter(o => o !== undefined);
+    }
+
+    function applyMarket(market) {
+        ['buy_offers', 'sell_offers'].forEach(side => {
+            if (market[side]) applyOffers(side, market[side]);
+        });
+        if (market.trades) {
+            let history = (state.trade_history || []).concat(market.trades);
+            if (state.trade_history_limit) {
+                const limit = state.trade_history_limit + olderTrades;
+                if (history.length > limit) {
+                    tradeCursor += history.length - limit;
+                    history = history.slice(-limit);
+                }
+            }
+            state.trade_history = history;
+        }
+        if (market.candles) {
+            // 與最後一根起點相同的 K 線為更新，其餘為新增
+            const candles = state.candles || [];
+            market.candles.forEach(c => {
+                const last = candles[candles.length - 1];
+                if (last && last.t === c.t) {
+                    candles[candles.length - 1] = c;
+                } else {
+                    candles.push(c);
+                }
+            });
+            state.candles = candles;
+        }
+        if (market.stats) state.stats = market.stats;
+    }
+
+    function loadOlderTrades() {
+        if (state === null || tradeCursor <= 0) return false;
+        liveSend({ type: 'trade_history', before: tradeCursor });
+        return true;
+    }
+
+    function hasOlderTrades() {
+        return state !== null && tradeCursor > 0;
+    }
+
+    function applyTradePage(data) {
+        // 期間收到新快照（游標已改變）時捨棄這一頁
+        if (state === null || data.before !== tradeCursor) return null;
+        state.trade_history = data.trades.concat(state.trade_history || []);
+        olderTrades += data.trades.length;
+        tradeCursor = data.cursor;
+        return Object.assign({}, state, { type: 'update' });
+    }
+
+    function scheduleFlush(delay) {
+        if (flushTimer !== null) return;  // 已排定，不重複 ping
+        flushTimer = setTimeout(() => {
+            flushTimer = null;
+            ping();
+        }, delay);
+    }
+
+    function cancelFlush() {
+        if (flushTimer === null) return;
+        clearTimeout(flushTimer);
+        flushTimer = null;
+    }
+
+    function applyMarketMessage(data) {
+        if (data && data.type === 'trade_page') return applyTradePage(data);
+        if (!data || !['update', 'delta', 'unchanged'].includes(data.type)) return data;
+        // 收到公開狀態（快照或增量）即不需再補 ping；被延後的廣播則排定補 ping
+        if (data.type === 'update' || data.market) cancelFlush();
+        if (data.flush_in) scheduleFlush(data.flush_in);
+
+        if (data.type === 'update') {
+            const { notification, flush_in, ...snapshot } = data;
+            state = snapshot;
+            seq = data.seq;
+            epoch = data.epoch;
+            tradeCursor = data.trade_history_cursor || 0;
+            olderTrades = 0;
+            awaitingSnapshot = false;
+            return data;
+        }
+
+        // 增量：同一序號只含私人狀態（unchanged 亦同），下一序號才含公開增量
+        const expected = data.market ? seq + 1 : seq;
+        if (state === null || data.epoch !== epoch || data.seq !== expected) {
+            requestSnapshot();
+            return null;
+        }
+
+        const { type, epoch: _epoch, seq: nextSeq, market, notification, flush_in, ...privateState } = data;
+        if (market) applyMarket(market);
+        Object.assign(state, privateState);
+        seq = nextSeq;
+
+        const merged = Object.assign({}, state, { type: 'update' });
+        if (notification) merged.notification = notification;
+        return merged;
+    }
+
+    return { applyMarketMessage, requestSnapshot, ping, loadOlderTrades, hasOlderTrades };
+})();
@@ -343,6 +343,77 @@ class ExperimentConfig:
         """控制台輸出格式"""
         return self.get('stages.carbon_trading.output.console_output_format', 'detailed')
     
+    # ========== 交易引擎 ==========
+    
+    @property
+    def order_book_engine(self) -> str:
+        """訂單簿引擎：'heap' 或 'price_level'（預設 heap，成本不受價格範圍影響；見 experiment_config.yaml）"""
+        return self.get('trading_engine.order_book', 'heap')
+    
+    @property
+    def order_book_price_levels(self) -> int:
+        """price_level 引擎預先配置的價格格數"""
+        return self.get('trading_engine.price_levels', 201)
+    
+    @property
+    def matching_mode(self) -> str:
+        """撮合模式：'exact_quantity'（數量相同才成交）或 'partial_fill'（跨數量部分成交）"""
+        return self.get('trading_engine.matching_mode', 'exact_quantity')
+    
+    @property
+    def order_codec(self) -> str:
+        """訂單欄位編碼：'json' 或 'packed'（讀取時兩種格式皆可辨識）"""
+        return self.get('trading_engine.order_codec', 'json')
+    
+    @property
+    def market_mode(self) -> str:
+        """市場機制：'continuous'（連續撮合）或 'batch_auction'（集合競價）；session config 可覆蓋"""
+        return self.get('trading_engine.market_mode', 'continuous')
+    
+    @property
+    def batch_auction_interval(self) -> float:
+        """集合競價每期秒數；session config 可覆蓋"""
+        return self.get('trading_engine.batch_auction_interval', 2)
+    
+    @property
+    def max_batch_orders(self) -> int:
+        """submit_batch 一次最多送出的掛單筆數"""
+        return self.get('trading_engine.max_batch_orders', 10)
+    
+    @property
+    def book_snapshot_interval(self) -> int:
+        """訂單簿預寫日誌每累積幾筆事件寫入一次精簡快照"""
+        return self.get('trading_engine.book_snapshot_interval', 50)
+    
+    @property
+    def coalesce_window_ms(self) -> int:
+        """連續撮合模式合併市場廣播的時間窗（毫秒，0 = 每次變動立即廣播）；session config 可覆蓋"""
+        return self.get('trading_engine.coalesce_window_ms', 0)
+    
+    @property
+    def rate_limits(self) -> Dict[str, Tuple[float, float]]:
+        """每位玩家各類訊息的頻率限制 {類別: (每秒補充數, 最多累積數)}；未列出的類別不限制"""
+        limits = self.get('trading_engine.rate_limits', {}) or {}
+        return {
+            category: (float(limit.get('rate', 0)), float(limit.get('burst', 1)))
+            for category, limit in limits.items()
+        }
+    
+    @property
+    def trade_history_limit(self) -> int:
+        """市場狀態中最近成交的筆數，也是往前翻頁時每頁的筆數"""
+        return self.get('trading_engine.trade_history_limit', 10)
+    
+    @property
+    def price_bucket_seconds(self) -> int:
+        """價格圖表 K 線每根的秒數"""
+        return self.get('trading_engine.price_bucket_seconds', 5)
+    
+    @property
+    def reserve_sell_orders(self) -> bool:
+        """賣單是否扣除其他賣單已承諾的數量（False 時只檢查單筆不超過持有量）"""
+        return self.get('trading_engine.reserve_sell_orders', False)
+    
     # ========== 市場價格 ==========
     
     @property
@@ -73,7 +73,11 @@ SESSION_CONFIGS = [
 
 
 SESSION_CONFIG_DEFAULTS = dict(
-    real_world_currency_per_point=1.0, participation_fee=150.00, doc=""
+    real_world_currency_per_point=1.0, participation_fee=150.00, doc="",
+    # 交易市場機制（'continuous' 或 'batch_auction'），可在建立場次時調整
+    market_mode=config.market_mode,
+    batch_auction_interval=config.batch_auction_interval,
+    coalesce_window_ms=config.coalesce_window_ms,  # 連續撮合模式合併廣播的時間窗（毫秒）
 )
 
 PARTICIPANT_FIELDS = []
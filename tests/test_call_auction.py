@@ -0,0 +1,177 @@
+import unittest
+
+from utils.call_auction import AuctionClock, allocate, clearing_price, pair_fills
+from utils.order_book import ORDER_BOOK_ENGINES, OrderBook
+from utils.order_codec import decode_orders
+from utils.trading_utils import (
+    get_order_book,
+    market_updates,
+    process_accept_offer,
+    process_new_order,
+    run_batch_auction,
+)
+
+from tests.test_order_book import DummyGroup
+
+
+class ClearingPriceTests(unittest.TestCase):
+    def test_no_cross(self):
+        self.assertIsNone(clearing_price([(20, 1)], [(21, 1)]))
+        self.assertIsNone(clearing_price([], [(21, 1)]))
+
+    def test_maximizes_volume(self):
+        bids = [(25, 2), (20, 2)]
+        asks = [(18, 3), (22, 2)]
+        # 18 與 20 的成交量同為 3、供需差同為 1，取中間（偏低）的價格
+        self.assertEqual(clearing_price(bids, asks), (18, 3))
+
+    def test_prefers_smaller_imbalance(self):
+        bids = [(30, 5), (24, 1)]
+        asks = [(20, 1), (24, 5)]
+        # 24：需求 6、供給 6，成交量最大
+        self.assertEqual(clearing_price(bids, asks), (24, 6))
+
+    def test_allocate_and_pair(self):
+        class O:
+            def __init__(self, name, quantity):
+                self.name, self.quantity = name, quantity
+
+        buys = allocate([O('b1', 2), O('b2', 3)], 3)
+        sells = allocate([O('s1', 1), O('s2', 5)], 3)
+        self.assertEqual([(o.name, q) for o, q in buys], [('b1', 2), ('b2', 1)])
+        pairs = [(b.name, s.name, q) for b, s, q in pair_fills(buys, sells)]
+        self.assertEqual(pairs, [('b1', 's1', 1), ('b1', 's2', 1), ('b2', 's2', 1)])
+
+    def test_clock(self):
+        clock = AuctionClock(2, now=100)
+        self.assertFalse(clock.due(101))
+        self.assertTrue(clock.due(102))
+        clock.advance(103)
+        self.assertEqual(clock.next_clear, 105)
+        self.assertEqual(clock.auctions, 1)
+
+
+class OrderBookDepthTests(unittest.TestCase):
+    def test_depth_follows_add_reduce_remove(self):
+        for engine in ORDER_BOOK_ENGINES:
+            with self.subTest(engine=engine):
+                book = OrderBook(engine)
+                a = book.add(1, 'buy', 20, 2)
+                book.add(2, 'buy', 20, 3)
+                book.add(3, 'buy', 22, 1)
+                book.add(4, 'sell', 25, 4)
+                self.assertEqual(book.depth('buy'), [(22, 1), (20, 5)])
+                self.assertEqual(book.depth('sell'), [(25, 4)])
+
+                book.reduce(a.order_id, 1)
+                self.assertEqual(book.depth('buy'), [(22, 1), (20, 4)])
+                book.cancel_player(3, 'buy')
+                self.assertEqual(book.depth('buy'), [(20, 4)])
+                self.assertEqual([o.player_id for o in book.orders_through('buy', 20)], [1, 2])
+                self.assertEqual(list(book.orders_through('sell', 24)), [])
+                book.clear()
+                self.assertEqual(book.depth('buy'), [])
+
+
+class BatchAuctionTests(unittest.TestCase):
+    def setUp(self):
+        self.group = DummyGroup(num_players=4)
+        self.group.session.config.update(market_mode='batch_auction', batch_auction_interval=2)
+
+    def test_orders_rest_until_auction(self):
+        group = self.group
+        p1, p2, p3, p4 = group.players
+        process_new_order(p1, group, 'sell', 18, 3)
+        process_new_order(p2, group, 'sell', 22, 2)
+        result = process_new_order(p3, group, 'buy', 25, 2)
+        self.assertEqual(result['type'], 'order_added')
+        self.assertEqual(p3.current_items, 10)
+
+        # 接受掛單轉為對向訂單，同樣等待撮合
+        result = process_accept_offer(p4, group, 'sell', 1, 20, 2)
+        self.assertEqual(result['type'], 'order_added')
+        self.assertEqual(get_order_book(group).depth('buy'), [(25, 2), (20, 2)])
+
+        self.assertIsNone(run_batch_auction(group, now=0))
+        self.assertIsNone(run_batch_auction(group, now=1))
+        result = run_batch_auction(group, now=2)
+
+        self.assertEqual(result['auction'], {'price': 18, 'volume': 3})
+        self.assertEqual(set(result['notifications']), {1, 3, 4})
+        self.assertEqual(p1.current_items, 7)
+        self.assertEqual(p1.current_cash, 1000 + 3 * 18)
+        self.assertEqual(p3.current_cash, 1000 - 2 * 18)
+        self.assertEqual(p4.current_items, 11)
+        # 邊際買單部分成交，剩餘數量保留
+        self.assertEqual(decode_orders(group.buy_orders), [[4, 20, 1]])
+        self.assertEqual(decode_orders(group.sell_orders), [[2, 22, 2]])
+        self.assertIsNone(run_batch_auction(group, now=3))
+
+    def test_overcommitted_seller_is_dropped(self):
+        group = self.group
+        p1, p2, p3, _ = group.players
+        p1.current_items = 7
+        process_new_order(p1, group, 'sell', 10, 6)
+        process_new_order(p1, group, 'sell', 11, 6)
+        process_new_order(p2, group, 'sell', 12, 2)
+        process_new_order(p3, group, 'buy', 15, 8)
+
+        run_batch_auction(group, now=0)
+        result = run_batch_auction(group, now=2)
+
+        # 玩家1只有 7 個，分配到第二筆賣單時超出持有量而失效；清算價由剩餘掛單決定
+        self.assertEqual(result['auction'], {'price': 12, 'volume': 8})
+        self.assertEqual(p1.current_items, 1)
+        self.assertEqual(p2.current_items, 8)
+        self.assertEqual(p3.current_items, 18)
+
+    def test_orders_crossing_own_opposite_orders_are_rejected(self):
+        group = self.group
+        p1, p2, _, _ = group.players
+        process_new_order(p1, group, 'buy', 50, 1)
+        result = process_new_order(p1, group, 'sell', 40, 1)
+        self.assertEqual(result['type'], 'fail')
+        self.assertEqual(process_new_order(p1, group, 'sell', 60, 1)['type'], 'order_added')
+        process_new_order(p2, group, 'sell', 45, 1)
+
+        run_batch_auction(group, now=0)
+        result = run_batch_auction(group, now=2)
+
+        # 自己的買賣單不會互相配對而被扣減；玩家2的賣單與玩家1的買單成交
+        self.assertEqual(result['auction'], {'price': 45, 'volume': 1})
+        self.assertEqual((p1.current_items, p2.current_items), (11, 9))
+        self.assertEqual(decode_orders(group.buy_orders), [])
+        self.assertEqual(decode_orders(group.sell_orders), [[1, 60, 1]])
+
+    def test_market_updates_hide_orders_until_auction(self):
+        group = self.group
+        p1, p2, p3, _ = group.players
+
+        def build_public(g):
+            book = get_order_book(g)
+            return {
+                'buy_offers': [o.to_offer() for o in book.display_orders('buy')],
+                'sell_offers': [o.to_offer() for o in book.display_orders('sell')],
+            }
+
+        def build_private(p):
+            return {'cash': int(p.current_cash)}
+
+        market_updates(group, build_public, build_private, player=p1, snapshot=True)
+        process_new_order(p1, group, 'sell', 18, 1)
+        updates = market_updates(group, build_public, build_private, player=p1)
+        self.assertEqual(list(updates), [1])
+        self.assertNotIn('market', updates[1])
+        snapshot = market_updates(group, build_public, build_private, player=p2, snapshot=True)
+        self.assertEqual(snapshot[2]['sell_offers'], [])
+
+        run_batch_auction(group, now=0)
+        result = run_batch_auction(group, now=2)
+        self.assertIsNone(result['auction'])
+        updates = market_updates(group, build_public, build_private, result)
+        self.assertEqual(set(updates), {1, 2, 3, 4})
+        self.assertEqual(updates[2]['market']['sell_offers']['ids'], [1])
+
+
+if __name__ == "__main__":
+    unittest.main()
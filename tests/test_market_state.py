@@ -0,0 +1,284 @@
+import json
+import unittest
+
+from Stage_MUDA import TradingMarket as MudaTradingMarket
+from utils.market_feed import MarketFeed
+from utils.trade_journal import TradeJournal
+from utils.trading_utils import (
+    enqueue_command,
+    get_market_feed,
+    get_order_book,
+    market_updates,
+    ping_version,
+    process_accept_offer,
+    process_commands,
+    process_new_order,
+)
+
+from tests.test_order_book import DummyGroup
+
+
+def offer(order_id, price, quantity=1, player_id=1):
+    return {'order_id': order_id, 'player_id': player_id, 'price': price, 'quantity': quantity}
+
+
+class MarketFeedTests(unittest.TestCase):
+    def test_delta_contains_only_changes(self):
+        feed = MarketFeed()
+        journal = TradeJournal()
+        self.assertIsNone(feed.publish({'buy_offers': [], 'sell_offers': []}, journal))
+        self.assertEqual(feed.seq, 0)
+
+        delta = feed.publish({'buy_offers': [offer(1, 20)], 'sell_offers': []}, journal)
+        self.assertEqual(delta, {'buy_offers': {'ids': [1], 'upsert': [offer(1, 20)]}})
+        self.assertEqual(feed.seq, 1)
+
+        # 部分成交後數量變動也要送出
+        journal.append({'buyer_id': 2, 'seller_id': 1, 'price': 20, 'quantity': 1})
+        delta = feed.publish({'buy_offers': [offer(2, 21), offer(1, 20, 2)], 'sell_offers': []}, journal)
+        self.assertEqual(delta['buy_offers']['ids'], [2, 1])
+        self.assertEqual(len(delta['buy_offers']['upsert']), 2)
+        self.assertEqual(len(delta['trades']), 1)
+        self.assertNotIn('sell_offers', delta)
+        self.assertEqual(feed.seq, 2)
+
+        delta = feed.publish({'buy_offers': [offer(1, 20, 2)], 'sell_offers': []}, journal)
+        self.assertEqual(delta, {'buy_offers': {'ids': [1], 'upsert': []}})
+
+
+class MarketUpdatesTests(unittest.TestCase):
+    def setUp(self):
+        self.public_builds = 0
+
+    def build_public(self, group):
+        self.public_builds += 1
+        return {
+            'buy_offers': [o.to_offer() for o in get_order_book(group).display_orders('buy')],
+            'sell_offers': [o.to_offer() for o in get_order_book(group).display_orders('sell')],
+        }
+
+    @staticmethod
+    def build_private(player):
+        return {'type': 'update', 'cash': int(player.current_cash)}
+
+    def updates(self, group, result=None, player=None, snapshot=False, client_version=None, now=None):
+        return market_updates(
+            group, self.build_public, self.build_private, result, player, snapshot, client_version, now
+        )
+
+    def test_snapshot_only_for_requester(self):
+        group = DummyGroup()
+        updates = self.updates(group, player=group.players[0], snapshot=True)
+        self.assertEqual(list(updates), [1])
+        self.assertEqual(updates[1]['type'], 'update')
+        self.assertEqual(updates[1]['seq'], 0)
+        self.assertEqual(updates[1]['cash'], 1000)
+
+        self.updates(group, player=group.players[1], snapshot=True)
+        self.assertEqual(self.public_builds, 1)
+
+    def test_ping_with_current_version_is_unchanged(self):
+        group = DummyGroup()
+        requester = group.players[0]
+        snapshot = self.updates(group, player=requester, snapshot=True)[1]
+        version = ping_version({'type': 'ping', 'epoch': snapshot['epoch'], 'seq': snapshot['seq']})
+
+        updates = self.updates(group, player=requester, snapshot=True, client_version=version)
+        self.assertEqual(list(updates), [1])
+        self.assertEqual(updates[1]['type'], 'unchanged')
+        self.assertNotIn('buy_offers', updates[1])
+
+        # 市場變動或 epoch 不同時回傳完整快照
+        process_new_order(group.players[1], group, 'buy', 20, 1)
+        self.updates(group, player=group.players[1])
+        updates = self.updates(group, player=requester, snapshot=True, client_version=version)
+        self.assertEqual(updates[1]['type'], 'update')
+        updates = self.updates(group, player=requester, snapshot=True, client_version=('other', 1))
+        self.assertEqual(updates[1]['type'], 'update')
+        self.assertIsNone(ping_version({'type': 'ping'}))
+        self.assertIsNone(ping_version(None))
+
+    def test_order_sends_delta_to_all_and_private_state_to_owner(self):
+        group = DummyGroup()
+        owner = group.players[0]
+        process_new_order(owner, group, 'buy', 20, 1)
+        updates = self.updates(group, player=owner)
+
+        self.assertEqual(set(updates), {1, 2, 3})
+        self.assertEqual(updates[1]['type'], 'delta')
+        self.assertEqual(updates[1]['seq'], 1)
+        self.assertEqual(updates[1]['cash'], 1000)
+        self.assertNotIn('cash', updates[2])
+        self.assertIs(updates[2]['market'], updates[3]['market'])
+        self.assertEqual(updates[2]['market']['buy_offers']['ids'], [1])
+
+    def test_invisible_change_only_updates_affected_players(self):
+        group = DummyGroup()
+        for price in (30, 31, 32):
+            process_new_order(group.players[0], group, 'buy', price, 1)
+        self.updates(group, player=group.players[0])
+
+        builds = self.public_builds
+        fanout = dict(get_market_feed(group).fanout)
+
+        # 同數量第四筆較差的買單不會出現在公開顯示：公開狀態不重建，只更新掛單者
+        process_new_order(group.players[1], group, 'buy', 10, 1)
+        updates = self.updates(group, player=group.players[1])
+        self.assertEqual(list(updates), [2])
+        self.assertNotIn('market', updates[2])
+        self.assertEqual(updates[2]['seq'], 1)
+        self.assertEqual(self.public_builds, builds)
+
+        self.assertEqual(get_market_feed(group).fanout, {
+            'events': fanout['events'] + 1,
+            'broadcasts': fanout['broadcasts'],
+            'messages': fanout['messages'] + 1,
+            'coalesced': 0,
+        })
+        self.assertEqual(fanout, {'events': 1, 'broadcasts': 1, 'messages': 3, 'coalesced': 0})
+
+    def test_coalescing_window_defers_broadcast(self):
+        group = DummyGroup()
+        group.session.config['coalesce_window_ms'] = 50
+        first, second, third = group.players
+        self.updates(group, player=third, snapshot=True, now=100.0)
+
+        process_new_order(first, group, 'buy', 20, 1)
+        self.assertEqual(set(self.updates(group, player=first, now=100.0)), {1, 2, 3})
+
+        # 時間窗內的變動已生效，但只更新掛單者，公開增量延後
+        process_new_order(second, group, 'buy', 21, 1)
+        updates = self.updates(group, player=second, now=100.01)
+        self.assertEqual(list(updates), [2])
+        self.assertNotIn('market', updates[2])
+        self.assertEqual(updates[2]['seq'], 1)
+        self.assertEqual(updates[2]['flush_in'], 40)
+        self.assertEqual(len(get_order_book(group)), 2)
+
+        # 時間窗內的快照仍是上次送出的公開狀態
+        snapshot = self.updates(group, player=third, snapshot=True, now=100.02)[3]
+        self.assertEqual([o['price'] for o in snapshot['buy_offers']], [20])
+        self.assertEqual(snapshot['flush_in'], 30)
+
+        # 時間窗結束後的請求送出合併後的增量
+        version = (snapshot['epoch'], snapshot['seq'])
+        updates = self.updates(group, player=third, snapshot=True, client_version=version, now=100.06)
+        self.assertEqual(updates[1]['seq'], 2)
+        self.assertEqual(updates[1]['market']['buy_offers']['ids'], [2, 1])
+        self.assertEqual(updates[3]['type'], 'update')
+        fanout = get_market_feed(group).fanout
+        self.assertEqual((fanout['broadcasts'], fanout['coalesced']), (2, 2))
+
+    def test_trade_notifies_both_parties(self):
+        group = DummyGroup()
+        process_new_order(group.players[0], group, 'sell', 30, 1)
+        self.updates(group, player=group.players[0])
+        result = process_new_order(group.players[1], group, 'buy', 30, 1)
+        updates = self.updates(group, result, group.players[1])
+
+        self.assertEqual(updates[1]['notification']['type'], 'success')
+        self.assertEqual(updates[1]['cash'], 1030)
+        self.assertEqual(updates[2]['cash'], 1000 - 30)
+        self.assertEqual(len(updates[3]['market']['trades']), 1)
+        self.assertNotIn('notification', updates[3])
+
+        fail = process_new_order(group.players[2], group, 'buy', 0, 1)
+        updates = self.updates(group, fail, group.players[2])
+        self.assertEqual(list(updates), [3])
+        self.assertEqual(updates[3]['notification']['type'], 'error')
+
+
+class CommandQueueTests(unittest.TestCase):
+    def test_second_accept_of_same_order_fails(self):
+        group = DummyGroup()
+        seller, first, second = group.players
+        process_new_order(seller, group, 'sell', 30, 1)
+
+        ok = process_accept_offer(first, group, 'sell', 1, 30, 1)
+        late = process_accept_offer(second, group, 'sell', 1, 30, 1)
+
+        self.assertEqual(ok['type'], 'trade_executed')
+        self.assertEqual(late['type'], 'fail')
+        self.assertEqual(seller.current_items, 9)
+        self.assertEqual(second.current_cash, 1000)
+
+    def test_queued_commands_run_in_order_with_combined_result(self):
+        group = DummyGroup()
+        seller, first, second = group.players
+        applied = []
+
+        def apply(player, data):
+            applied.append(player.id_in_group)
+            if data['type'] == 'submit_offer':
+                return process_new_order(player, group, data['direction'], data['price'], data['quantity'])
+            return process_accept_offer(player, group, 'sell', 1, 30, 1)
+
+        enqueue_command(group, seller, {'type': 'submit_offer', 'direction': 'sell', 'price': 30, 'quantity': 1})
+        enqueue_command(group, first, {'type': 'accept_offer'})
+        enqueue_command(group, second, {'type': 'accept_offer'})
+        result = process_commands(group, apply)
+
+        self.assertEqual(applied, [1, 2, 3])
+        self.assertEqual(result['commands'], 3)
+        self.assertEqual(result['notification_types'], {1: 'success', 2: 'success', 3: 'error'})
+        self.assertEqual(process_commands(group, apply)['commands'], 0)
+
+        updates = market_updates(
+            group, MudaTradingMarket.public_state, MudaTradingMarket.private_state, result, first
+        )
+        self.assertEqual(updates[3]['notification']['type'], 'error')
+        self.assertEqual(updates[2]['notification']['type'], 'success')
+
+
+class LiveMethodTests(unittest.TestCase):
+    def test_ping_and_submit(self):
+        group = DummyGroup()
+        snapshot = MudaTradingMarket.live_method(group.players[1], {'type': 'ping'})
+        self.assertEqual(list(snapshot), [2])
+        self.assertEqual(snapshot[2]['trade_history_limit'], 10)
+
+        updates = MudaTradingMarket.live_method(
+            group.players[0], {'type': 'submit_offer', 'direction': 'buy', 'price': 20, 'quantity': 1}
+        )
+        self.assertEqual(set(updates), {1, 2, 3})
+        self.assertEqual(updates[1]['my_buy_offers'], [offer(1, 20)])
+        self.assertEqual(updates[2]['market']['buy_offers']['upsert'], [offer(1, 20)])
+
+    def test_submit_batch_sends_single_update(self):
+        group = DummyGroup()
+        MudaTradingMarket.live_method(group.players[1], None)
+        orders = [{'direction': 'sell', 'price': p, 'quantity': 1} for p in (30, 31, 32)]
+        updates = MudaTradingMarket.live_method(
+            group.players[0], {'type': 'submit_batch', 'orders': orders}
+        )
+        self.assertEqual(set(updates), {1, 2, 3})
+        self.assertEqual(updates[2]['seq'], 1)
+        self.assertEqual(len(updates[2]['market']['sell_offers']['ids']), 3)
+        self.assertEqual(len(updates[1]['my_sell_offers']), 3)
+        self.assertEqual(len(json.loads(group.players[0].submitted_offers)), 3)
+
+    def test_trade_history_window_and_older_pages(self):
+        group = DummyGroup()
+        seller, buyer, other = group.players
+        seller.current_items = 30
+        for price in range(20, 32):
+            process_new_order(seller, group, 'sell', price, 1)
+            process_new_order(buyer, group, 'buy', price, 1)
+
+        snapshot = MudaTradingMarket.live_method(other, {'type': 'ping'})[3]
+        self.assertEqual(len(snapshot['trade_history']), 10)
+        self.assertEqual(snapshot['trade_history_cursor'], 2)
+        self.assertNotIn('is_buyer', snapshot['trade_history'][0])
+
+        # 往前翻頁只回給發出請求的玩家，市場序號不變
+        page = MudaTradingMarket.live_method(other, {'type': 'trade_history', 'before': 2})
+        self.assertEqual(list(page), [3])
+        self.assertEqual(page[3]['type'], 'trade_page')
+        self.assertEqual([t['price'] for t in page[3]['trades']], [20, 21])
+        self.assertEqual(page[3]['cursor'], 0)
+        again = MudaTradingMarket.live_method(other, {'type': 'ping', 'epoch': snapshot['epoch'], 'seq': snapshot['seq']})
+        self.assertEqual(again[3]['type'], 'unchanged')
+
+
+if __name__ == "__main__":
+    unittest.main()
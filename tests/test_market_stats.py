@@ -0,0 +1,117 @@
+import json
+import unittest
+
+from utils.market_feed import MarketFeed
+from utils.market_stats import MarketStats
+from utils.trade_journal import TradeJournal
+from utils.trading_utils import (
+    _MARKET_STATS,
+    _trade_journal_key,
+    get_market_stats,
+    get_trade_journal,
+    market_statistics,
+    process_new_order,
+    save_trade_journal,
+)
+
+from tests.test_order_book import DummyGroup
+
+
+class MarketStatsTests(unittest.TestCase):
+    def test_running_statistics(self):
+        stats = MarketStats()
+        self.assertIsNone(stats.vwap)
+        self.assertEqual(stats.snapshot(None, 25)['spread'], None)
+
+        stats.record(20, 1)
+        stats.record(23, 2)
+        snapshot = stats.snapshot(21, 24)
+        self.assertEqual(snapshot['last_price'], 23)
+        self.assertEqual(snapshot['vwap'], 22.0)
+        self.assertEqual(snapshot['volume'], 3)
+        self.assertEqual(snapshot['trade_count'], 2)
+        self.assertEqual((snapshot['high'], snapshot['low']), (23, 20))
+        self.assertEqual(snapshot['spread'], 3)
+
+    def test_trades_update_stats_and_price_history(self):
+        group = DummyGroup()
+        seller, buyer, other = group.players
+        process_new_order(seller, group, 'sell', 20, 1)
+        process_new_order(buyer, group, 'buy', 20, 1)
+        process_new_order(other, group, 'buy', 15, 2)
+
+        stats = market_statistics(group)
+        self.assertEqual(stats['last_price'], 20)
+        self.assertEqual(stats['trade_count'], 1)
+        self.assertEqual(stats['best_bid'], 15)
+        self.assertIsNone(stats['best_ask'])
+        history = get_market_stats(group.subsession).price_history
+        self.assertEqual([(h['price'], h['event']) for h in history], [(20.0, 'trade')])
+
+        # 回合結束時寫回欄位；重啟後由欄位與成交日誌重建
+        save_trade_journal(group.subsession)
+        self.assertEqual(len(json.loads(group.subsession.price_history)), 1)
+        del _MARKET_STATS[_trade_journal_key(group.subsession)]
+        rebuilt = get_market_stats(group.subsession)
+        self.assertEqual(rebuilt.volume, 1)
+        self.assertEqual(rebuilt.price_history, history)
+
+    def test_rebuild_without_saved_history(self):
+        group = DummyGroup()
+        seller, buyer, _ = group.players
+        process_new_order(seller, group, 'sell', 20, 2)
+        process_new_order(buyer, group, 'buy', 20, 2)
+        del _MARKET_STATS[_trade_journal_key(group.subsession)]
+
+        rebuilt = get_market_stats(group.subsession)
+        self.assertEqual(rebuilt.vwap, 20.0)
+        self.assertEqual([h['price'] for h in rebuilt.price_history], [20.0])
+
+    def test_candles_bucket_trades_by_interval(self):
+        stats = MarketStats(bucket_seconds=5)
+        for price, quantity, elapsed in ((20, 1, 0), (24, 2, 3), (18, 1, 4), (21, 1, 7), (22, 1, 16)):
+            stats.record(price, quantity, elapsed)
+        self.assertEqual(stats.candles, [
+            {'t': 0, 'open': 20, 'high': 24, 'low': 18, 'close': 18, 'volume': 4},
+            {'t': 5, 'open': 21, 'high': 21, 'low': 21, 'close': 21, 'volume': 1},
+            {'t': 15, 'open': 22, 'high': 22, 'low': 22, 'close': 22, 'volume': 1},
+        ])
+        # 時鐘誤差造成較早的時間併入最後一根
+        stats.record(25, 1, 14)
+        self.assertEqual(len(stats.candles), 3)
+        self.assertEqual(stats.candles[-1]['close'], 25)
+
+    def test_rebuilt_candles_use_trade_timestamps(self):
+        group = DummyGroup()
+        journal = get_trade_journal(group.subsession)
+        for timestamp, price in (('00:01', 20), ('00:04', 22), ('01:02', 21)):
+            journal.append({'timestamp': timestamp, 'buyer_id': 2, 'seller_id': 1, 'price': price, 'quantity': 1})
+        stats = get_market_stats(group.subsession)
+        self.assertEqual([(c['t'], c['open'], c['close']) for c in stats.candles], [(0, 20, 22), (60, 21, 21)])
+
+    def test_feed_sends_last_and_new_candles(self):
+        feed = MarketFeed()
+        journal = TradeJournal()
+        stats = MarketStats(bucket_seconds=5)
+        public = {'candles': stats.candle_series(), 'stats': stats.snapshot(None, None)}
+        self.assertIsNone(feed.publish(public, journal))
+
+        stats.record(20, 1, 1)
+        public = {'candles': stats.candle_series(), 'stats': stats.snapshot(None, None)}
+        delta = feed.publish(public, journal)
+        self.assertEqual(delta['candles'], [{'t': 0, 'open': 20, 'high': 20, 'low': 20, 'close': 20, 'volume': 1}])
+        self.assertEqual(delta['stats']['last_price'], 20)
+
+        # 同一區間的成交只更新最後一根
+        stats.record(22, 1, 2)
+        delta = feed.publish({'candles': stats.candle_series(), 'stats': public['stats']}, journal)
+        self.assertEqual(delta, {'candles': [{'t': 0, 'open': 20, 'high': 22, 'low': 20, 'close': 22, 'volume': 2}]})
+
+        # 新區間只送出新的一根
+        stats.record(21, 1, 6)
+        delta = feed.publish({'candles': stats.candle_series(), 'stats': public['stats']}, journal)
+        self.assertEqual([c['t'] for c in delta['candles']], [5])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,741 @@
+import json
+import random
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+from configs.config import ExperimentConfig
+
+from utils.order_book import ORDER_BOOK_ENGINES, OrderBook
+from utils.order_book_benchmark import generate_events, run_book_engine, run_list_engine
+from utils.order_codec import decode_orders
+from utils import trading_utils
+from utils.trading_utils import (
+    expire_group_orders,
+    filter_top_buy_orders_for_display,
+    filter_top_sell_orders_for_display,
+    get_order_book,
+    process_accept_offer,
+    process_amend_order,
+    process_cancel_all,
+    process_new_order,
+    process_order_batch,
+    process_sweep_order,
+    release_market,
+    save_orders,
+)
+
+
+class DummyPlayer:
+    def __init__(self, id_in_group, cash=1000, items=10):
+        self.id_in_group = id_in_group
+        self.current_cash = cash
+        self.current_items = items
+        self.total_bought = 0
+        self.total_sold = 0
+        self.total_spent = 0
+        self.total_earned = 0
+        self.submitted_offers = '[]'
+
+
+class DummyGroup:
+    _next_id = 1
+
+    def __init__(self, num_players=3):
+        self.id = DummyGroup._next_id
+        DummyGroup._next_id += 1
+        self.session = SimpleNamespace(code=f'test{self.id}', config={})
+        self.subsession = SimpleNamespace(
+            id=self.id, session=self.session, executed_trades='[]', start_time=None,
+            round_number=1, price_history='[]'
+        )
+        self.buy_orders = '[]'
+        self.sell_orders = '[]'
+        self.players = [DummyPlayer(i) for i in range(1, num_players + 1)]
+        for player in self.players:
+            player.group = self
+            player.subsession = self.subsession
+
+    def get_player_by_id(self, player_id):
+        return self.players[player_id - 1]
+
+    def get_players(self):
+        return list(self.players)
+
+
+class OrderBookTests(unittest.TestCase):
+    def test_best_price_and_time_priority(self):
+        for engine in ORDER_BOOK_ENGINES:
+            with self.subTest(engine=engine):
+                book = OrderBook(engine)
+                book.add(1, 'sell', 30, 2)
+                first = book.add(2, 'sell', 25, 2)
+                book.add(3, 'sell', 25, 2)
+                book.add(1, 'buy', 20, 1)
+                book.add(2, 'buy', 22, 1)
+
+                self.assertIs(book.best('sell'), first)
+                self.assertEqual(book.best('buy').price, 22)
+                self.assertEqual([o.price for o in book.orders('sell')], [25, 25, 30])
+
+                book.remove(first.order_id)
+                self.assertEqual(book.best('sell').player_id, 3)
+
+    def test_find_match_requires_same_quantity_and_skips_own_orders(self):
+        for engine in ORDER_BOOK_ENGINES:
+            with self.subTest(engine=engine):
+                book = OrderBook(engine)
+                book.add(1, 'sell', 20, 3)
+                book.add(2, 'sell', 24, 5)
+                book.add(3, 'sell', 26, 5)
+
+                self.assertIsNone(book.find_match('buy', 4, 30, 4))
+                self.assertEqual(book.find_match('buy', 4, 30, 5).player_id, 2)
+                self.assertEqual(book.find_match('buy', 2, 30, 5).player_id, 3)
+                self.assertIsNone(book.find_match('buy', 4, 23, 5))
+
+    def test_player_index_tracks_cancels(self):
+        book = OrderBook()
+        book.add(1, 'buy', 20, 1)
+        keep = book.add(1, 'buy', 25, 2)
+        book.add(1, 'sell', 40, 1)
+        book.add(2, 'buy', 21, 1)
+
+        self.assertEqual([o.price for o in book.player_orders(1, 'buy', by_priority=True)], [25, 20])
+        self.assertEqual(book.cancel_player(1, 'buy', keep_order_id=keep.order_id), 1)
+        self.assertEqual(book.cancel_specific(1, 'buy', 25.0, 2), 1)
+        self.assertEqual(book.player_orders(1), [book.best('sell')])
+        self.assertEqual(book.cancel_player(3, 'buy'), 0)
+
+    def test_duplicate_index_follows_cancel_and_partial_fill(self):
+        book = OrderBook()
+        first = book.add(1, 'sell', 30, 2)
+        book.add(2, 'sell', 30, 2)
+        self.assertTrue(book.has_order_at('sell', 30, 2))
+        self.assertFalse(book.has_order_at('buy', 30, 2))
+
+        book.remove(first.order_id)
+        self.assertTrue(book.has_order_at('sell', 30, 2))
+        book.reduce(book.best('sell').order_id, 1)
+        self.assertFalse(book.has_order_at('sell', 30, 2))
+        self.assertTrue(book.has_order_at('sell', 30, 1))
+
+    def test_reduce_keeps_time_priority_in_every_engine(self):
+        for engine in ORDER_BOOK_ENGINES:
+            with self.subTest(engine=engine):
+                book = OrderBook(engine)
+                first = book.add(1, 'sell', 10, 5)
+                book.add(2, 'sell', 10, 3)
+                book.reduce(first.order_id, 2)
+                self.assertEqual(book.find_match('buy', 9, 10, 3).player_id, 1)
+                self.assertEqual([o.player_id for o in book.orders('sell')], [1, 2])
+
+    def test_engines_agree_on_priority_after_random_reduces(self):
+        rng = random.Random(7)
+        books = {engine: OrderBook(engine) for engine in ORDER_BOOK_ENGINES}
+        for _ in range(3000):
+            op = rng.random()
+            direction = rng.choice(('buy', 'sell'))
+            reference = books['heap']
+            if op < 0.5 or not len(reference):
+                args = (rng.randint(1, 6), direction, rng.randint(8, 12), rng.randint(1, 5))
+                for book in books.values():
+                    book.add(*args)
+            else:
+                order_id = rng.choice(list(reference._orders))
+                quantity = rng.randint(1, 3)
+                for book in books.values():
+                    book.reduce(order_id, quantity)
+            probe = (direction, rng.randint(1, 6), rng.randint(8, 12), rng.randint(1, 5))
+            matches = {
+                engine: getattr(book.find_match(*probe), 'order_id', None) for engine, book in books.items()
+            }
+            self.assertEqual(len(set(matches.values())), 1, matches)
+        for direction in ('buy', 'sell'):
+            expected = [o.order_id for o in books['heap'].orders(direction)]
+            for book in books.values():
+                self.assertEqual([o.order_id for o in book.orders(direction)], expected)
+
+    def test_price_level_engine_grows_beyond_configured_levels(self):
+        book = OrderBook('price_level', price_levels=10)
+        book.add(1, 'buy', 5, 1)
+        book.add(2, 'buy', 500, 1)
+        self.assertEqual(book.best('buy').price, 500)
+        book.cancel_player(2, 'buy')
+        self.assertEqual(book.best('buy').price, 5)
+
+    def test_display_orders_matches_list_filters(self):
+        for engine in ORDER_BOOK_ENGINES:
+            with self.subTest(engine=engine):
+                rng = random.Random(7)
+                book = OrderBook(engine)
+                rows = {'buy': [], 'sell': []}
+                for _ in range(200):
+                    direction = rng.choice(['buy', 'sell'])
+                    row = [rng.randint(1, 15), rng.randint(1, 60), rng.randint(1, 6)]
+                    if any(r[1:] == row[1:] for r in rows[direction]):
+                        continue
+                    rows[direction].append(row)
+                    book.add(row[0], direction, row[1], row[2])
+
+                def prices(orders):
+                    return sorted((o[1], o[2]) for o in orders)
+
+                self.assertEqual(
+                    prices(o.to_row() for o in book.display_orders('buy')),
+                    prices(filter_top_buy_orders_for_display(rows['buy'])),
+                )
+                self.assertEqual(
+                    prices(o.to_row() for o in book.display_orders('sell')),
+                    prices(filter_top_sell_orders_for_display(rows['sell'])),
+                )
+
+    def test_engines_agree_with_list_path(self):
+        events = generate_events(2000, 8, (1, 40), 4, 0.1, seed=3)
+        list_timings = {}
+        expected = run_list_engine(events, list_timings)
+        self.assertEqual(list_timings['display_builds'], len(events))
+        for engine in ORDER_BOOK_ENGINES:
+            with self.subTest(engine=engine):
+                timings = {}
+                self.assertEqual(run_book_engine(events, engine, timings=timings), expected)
+                # 與 live path 相同，只在顯示範圍變動時重新計算
+                self.assertLess(timings['display_builds'], len(events))
+
+    def test_rows_round_trip(self):
+        book = OrderBook.from_rows([[1, 20.0, 2], [2, 21, 1]], [[3, 40, 5]])
+        self.assertFalse(book.dirty)
+        self.assertEqual(book.rows('buy'), [[1, 20, 2], [2, 21, 1]])
+        self.assertEqual(book.rows('sell'), [[3, 40, 5]])
+
+
+class ProcessOrderTests(unittest.TestCase):
+    def test_matching_order_trades_and_cancels_both_sides(self):
+        group = DummyGroup()
+        seller, buyer = group.players[0], group.players[1]
+        process_new_order(seller, group, 'sell', 30, 2)
+        process_new_order(seller, group, 'sell', 35, 1)
+        process_new_order(buyer, group, 'buy', 10, 1)
+
+        result = process_new_order(buyer, group, 'buy', 32, 2)
+
+        self.assertEqual(result['type'], 'trade_executed')
+        self.assertEqual(buyer.current_cash, 1000 - 60)
+        self.assertEqual(seller.current_items, 8)
+        # 成交後雙方其他同方向掛單一併取消
+        self.assertEqual(decode_orders(group.sell_orders), [])
+        self.assertEqual(decode_orders(group.buy_orders), [])
+        self.assertEqual(len(json.loads(group.subsession.executed_trades)), 1)
+
+    def test_duplicate_order_is_rejected(self):
+        group = DummyGroup()
+        process_new_order(group.players[0], group, 'buy', 20, 1)
+        result = process_new_order(group.players[1], group, 'buy', 20, 1)
+        self.assertEqual(result['type'], 'fail')
+        self.assertEqual(len(get_order_book(group)), 1)
+
+    def test_unknown_direction_is_rejected_before_touching_the_book(self):
+        group = DummyGroup()
+        result = process_new_order(group.players[0], group, 'bid', 30, 1)
+        self.assertEqual(result['type'], 'fail')
+        book = get_order_book(group)
+        self.assertEqual(len(book), 0)
+        with self.assertRaises(ValueError):
+            book.add(1, 'bid', 30, 1)
+        self.assertEqual((len(book), book.locked_quantity(1, 'bid'), book.depth('sell')), (0, 0, []))
+        self.assertEqual(book.to_snapshot()['orders'], [])
+
+    def test_book_is_rebuilt_from_snapshot(self):
+        group = DummyGroup()
+        group.sell_orders = json.dumps([[1, 30, 2]])
+        result = process_accept_offer(group.players[1], group, 'sell', 1, 30, 2)
+        self.assertEqual(result['type'], 'trade_executed')
+        self.assertEqual(decode_orders(group.sell_orders), [])
+
+        process_new_order(group.players[2], group, 'buy', 15, 1)
+        process_cancel_all(group.players[2], group)
+        self.assertEqual(decode_orders(group.buy_orders), [])
+
+
+class PartialFillTests(unittest.TestCase):
+    def setUp(self):
+        patcher = mock.patch.object(
+            ExperimentConfig, 'matching_mode', new=property(lambda self: 'partial_fill')
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_buy_sweeps_across_quantities(self):
+        group = DummyGroup(num_players=4)
+        p1, p2, p3, buyer = group.players
+        process_new_order(p1, group, 'sell', 20, 3)
+        process_new_order(p2, group, 'sell', 22, 2)
+        process_new_order(p3, group, 'sell', 40, 1)
+
+        result = process_new_order(buyer, group, 'buy', 25, 5)
+
+        self.assertEqual(result['type'], 'trade_executed')
+        self.assertEqual(buyer.current_items, 15)
+        self.assertEqual(buyer.current_cash, 1000 - 3 * 20 - 2 * 22)
+        self.assertEqual(set(result['notifications']), {1, 2, 4})
+        self.assertEqual(decode_orders(group.sell_orders), [[3, 40, 1]])
+        self.assertEqual(decode_orders(group.buy_orders), [])
+
+    def test_remainders_keep_resting(self):
+        group = DummyGroup()
+        seller, buyer, other = group.players
+        process_new_order(seller, group, 'sell', 20, 5)
+
+        process_new_order(buyer, group, 'buy', 21, 2)
+        self.assertEqual(decode_orders(group.sell_orders), [[1, 20, 3]])
+
+        process_new_order(other, group, 'buy', 20, 4)
+        self.assertEqual(other.current_items, 13)
+        self.assertEqual(decode_orders(group.sell_orders), [])
+        self.assertEqual(decode_orders(group.buy_orders), [[3, 20, 1]])
+
+        # 剩餘掛單仍可依原規則以相同數量成交
+        book = get_order_book(group)
+        self.assertEqual(book.find_match('sell', 1, 20, 1).player_id, 3)
+
+    def test_duplicate_rule_applies_at_submission_only(self):
+        group = DummyGroup(num_players=4)
+        first, second, buyer, other = group.players
+        process_new_order(first, group, 'sell', 20, 5)
+        process_new_order(second, group, 'sell', 20, 3)
+
+        # 部分成交的剩餘數量與另一筆掛單相同時仍保留
+        process_new_order(buyer, group, 'buy', 20, 2)
+        self.assertEqual(decode_orders(group.sell_orders), [[1, 20, 3], [2, 20, 3]])
+        # 新送出的相同掛單仍被拒絕
+        self.assertEqual(process_new_order(other, group, 'sell', 20, 3)['type'], 'fail')
+
+
+
+class OrderBatchTests(unittest.TestCase):
+    @staticmethod
+    def ladder(direction, *prices, quantity=1):
+        return [{'direction': direction, 'price': p, 'quantity': quantity} for p in prices]
+
+    def test_ladder_rests_with_one_snapshot_write(self):
+        group = DummyGroup()
+        with mock.patch('utils.trading_utils.save_orders', wraps=save_orders) as save:
+            result = process_order_batch(group.players[0], group, self.ladder('buy', 20, 19, 18))
+        self.assertEqual(result['type'], 'order_added')
+        self.assertEqual(save.call_count, 1)
+        self.assertEqual(decode_orders(group.buy_orders), [[1, 20, 1], [1, 19, 1], [1, 18, 1]])
+        self.assertIn('3', result['notifications'][1])
+
+    def test_invalid_order_rejects_whole_batch(self):
+        group = DummyGroup()
+        orders = self.ladder('sell', 30, 31) + [{'direction': 'sell', 'price': 32, 'quantity': 99}]
+        result = process_order_batch(group.players[0], group, orders)
+        self.assertEqual(result['type'], 'fail')
+        self.assertIn('第 3 筆', result['notifications'][1])
+        self.assertEqual(len(get_order_book(group)), 0)
+
+        result = process_order_batch(group.players[0], group, self.ladder('sell', 30, 30))
+        self.assertEqual(result['type'], 'fail')
+        result = process_order_batch(group.players[0], group, self.ladder('sell', *range(20, 40)))
+        self.assertEqual(result['type'], 'fail')
+        result = process_order_batch(group.players[0], group, [{'direction': 'sell'}])
+        self.assertEqual(result['type'], 'fail')
+        self.assertEqual(len(get_order_book(group)), 0)
+
+    def test_batch_matches_and_combines_notifications(self):
+        group = DummyGroup()
+        seller, buyer, _ = group.players
+        process_new_order(seller, group, 'sell', 19, 1)
+
+        result = process_order_batch(buyer, group, self.ladder('buy', 18, 20))
+        self.assertEqual(result['type'], 'trade_executed')
+        self.assertEqual(buyer.current_items, 11)
+        self.assertEqual(set(result['notifications']), {1, 2})
+        self.assertIn('交易成功', result['notifications'][2])
+        # 成交後沿用原規則取消買方其他買單
+        self.assertEqual(decode_orders(group.buy_orders), [])
+
+    def test_sells_after_a_fill_are_rechecked_against_holdings(self):
+        group = DummyGroup()
+        buyer, seller, other = group.players
+        seller.current_items = 2
+        process_new_order(buyer, group, 'buy', 10, 2)
+
+        result = process_order_batch(seller, group, self.ladder('sell', 10, 12, quantity=2))
+        self.assertEqual(result['type'], 'trade_executed')
+        self.assertEqual(seller.current_items, 0)
+        self.assertIn('第 2 筆掛單未送出', result['notifications'][2])
+        self.assertEqual(result['placed'], [('sell', 10, 2)])
+        self.assertEqual(decode_orders(group.sell_orders), [])
+
+        process_new_order(other, group, 'buy', 12, 2)
+        self.assertEqual((seller.current_items, other.current_items), (0, 10))
+        self.assertEqual(decode_orders(group.buy_orders), [[3, 12, 2]])
+
+
+
+class SweepOrderTests(unittest.TestCase):
+    def test_buy_sweeps_levels_within_limit_in_one_pass(self):
+        group = DummyGroup(num_players=4)
+        p1, p2, p3, buyer = group.players
+        process_new_order(p1, group, 'sell', 20, 3)
+        process_new_order(p2, group, 'sell', 22, 2)
+        process_new_order(p3, group, 'sell', 40, 1)
+        process_new_order(buyer, group, 'buy', 10, 1)
+
+        with mock.patch('utils.trading_utils.save_orders', wraps=save_orders) as save:
+            result = process_sweep_order(buyer, group, 'buy', 25, 6)
+
+        self.assertEqual(save.call_count, 1)
+        self.assertEqual(result['type'], 'trade_executed')
+        self.assertEqual(buyer.current_items, 15)
+        self.assertEqual(buyer.current_cash, 1000 - 3 * 20 - 2 * 22)
+        self.assertEqual(set(result['notifications']), {1, 2, 4})
+        self.assertIn('共買入了 5 個', result['notifications'][4])
+        self.assertIn('其餘 1 個未成交已取消', result['notifications'][4])
+        # 限價外的賣單保留；未成交數量不掛單，且沿用原規則取消買方其他買單
+        self.assertEqual(decode_orders(group.sell_orders), [[3, 40, 1]])
+        self.assertEqual(decode_orders(group.buy_orders), [])
+
+    def test_sell_sweep_leaves_partial_level_resting(self):
+        group = DummyGroup()
+        buyer, seller, _ = group.players
+        process_new_order(buyer, group, 'buy', 30, 4)
+
+        result = process_sweep_order(seller, group, 'sell', 25, 3)
+
+        self.assertEqual(result['type'], 'trade_executed')
+        self.assertEqual((seller.current_items, seller.current_cash), (7, 1090))
+        self.assertEqual(decode_orders(group.buy_orders), [[1, 30, 1]])
+
+    def test_rejects_without_crossing_or_holdings(self):
+        group = DummyGroup()
+        seller, buyer, _ = group.players
+        process_new_order(seller, group, 'sell', 30, 1)
+
+        result = process_sweep_order(buyer, group, 'buy', 29, 1)
+        self.assertEqual(result['type'], 'fail')
+        self.assertEqual(decode_orders(group.sell_orders), [[1, 30, 1]])
+        self.assertEqual(decode_orders(group.buy_orders), [])
+
+        self.assertEqual(process_sweep_order(buyer, group, 'sell', 1, 99)['type'], 'fail')
+        self.assertEqual(process_sweep_order(buyer, group, 'hold', 30, 1)['type'], 'fail')
+        self.assertEqual(buyer.current_items, 10)
+
+    def test_batch_auction_rests_at_limit(self):
+        group = DummyGroup()
+        group.session.config.update(market_mode='batch_auction')
+        result = process_sweep_order(group.players[0], group, 'buy', 25, 2)
+        self.assertEqual(result['type'], 'order_added')
+        self.assertEqual(decode_orders(group.buy_orders), [[1, 25, 2]])
+
+
+
+class AmendOrderTests(unittest.TestCase):
+    def test_book_amend_priority(self):
+        for engine in ORDER_BOOK_ENGINES:
+            with self.subTest(engine=engine):
+                book = OrderBook(engine)
+                first = book.add(1, 'buy', 20, 3)
+                book.add(2, 'buy', 20, 3)
+
+                # 只減量：保留時間優先（含新數量的子階梯中排在較晚的同量掛單之前）
+                later = book.add(3, 'buy', 20, 2)
+                book.amend(first.order_id, 20, 2)
+                self.assertEqual(book.best('buy').player_id, 1)
+                self.assertTrue(book.has_order_at('buy', 20, 2))
+                self.assertEqual(book.depth('buy'), [(20, 7)])
+                self.assertEqual(book.find_match('sell', 4, 20, 2).player_id, 1)
+                book.remove(later.order_id)
+
+                # 加量：排到同價位最後，快照順序也一致
+                book.amend(first.order_id, 20, 4)
+                self.assertEqual(book.best('buy').player_id, 2)
+                self.assertEqual(book.rows('buy'), [[2, 20, 3], [1, 20, 4]])
+
+                # 改價：order_id 不變
+                amended = book.amend(first.order_id, 22, 4)
+                self.assertEqual(amended.order_id, first.order_id)
+                self.assertEqual(book.best('buy').order_id, first.order_id)
+                self.assertEqual(book.find_match('sell', 3, 21, 4).order_id, first.order_id)
+                self.assertIsNone(book.find_match('sell', 3, 21, 3))
+
+    @staticmethod
+    def use_engine(engine):
+        """讓 process_* 路徑建立的訂單簿使用指定引擎"""
+        return mock.patch.object(ExperimentConfig, 'order_book_engine', new=property(lambda self: engine))
+
+    def test_amend_in_place_without_cross(self):
+        for engine in ORDER_BOOK_ENGINES:
+            with self.subTest(engine=engine), self.use_engine(engine):
+                group = DummyGroup()
+                seller, buyer, _ = group.players
+                process_new_order(seller, group, 'sell', 30, 1)
+                process_new_order(buyer, group, 'buy', 20, 1)
+                order_id = get_order_book(group).player_orders(2)[0].order_id
+
+                result = process_amend_order(buyer, group, order_id, 25, 1)
+                self.assertEqual(result['type'], 'order_amended')
+                self.assertEqual(decode_orders(group.buy_orders), [[2, 25, 1]])
+                self.assertEqual(get_order_book(group).get(order_id).price, 25)
+
+    def test_amend_that_crosses_trades(self):
+        for engine in ORDER_BOOK_ENGINES:
+            with self.subTest(engine=engine), self.use_engine(engine):
+                group = DummyGroup()
+                seller, buyer, _ = group.players
+                process_new_order(seller, group, 'sell', 30, 1)
+                process_new_order(buyer, group, 'buy', 20, 1)
+                order_id = get_order_book(group).player_orders(2)[0].order_id
+
+                result = process_amend_order(buyer, group, order_id, 30, 1)
+                self.assertEqual(result['type'], 'trade_executed')
+                self.assertEqual(buyer.current_items, 11)
+                self.assertEqual(decode_orders(group.buy_orders), [])
+                self.assertEqual(decode_orders(group.sell_orders), [])
+
+    def test_amend_rejects_foreign_missing_and_invalid(self):
+        for engine in ORDER_BOOK_ENGINES:
+            with self.subTest(engine=engine), self.use_engine(engine):
+                group = DummyGroup()
+                seller, buyer, other = group.players
+                process_new_order(seller, group, 'sell', 30, 1)
+                order_id = get_order_book(group).player_orders(1)[0].order_id
+
+                self.assertEqual(process_amend_order(buyer, group, order_id, 31, 1)['type'], 'fail')
+                self.assertEqual(process_amend_order(seller, group, 999, 31, 1)['type'], 'fail')
+                self.assertEqual(process_amend_order(seller, group, order_id, 31, 50)['type'], 'fail')
+                process_new_order(other, group, 'sell', 32, 1)
+                self.assertEqual(process_amend_order(seller, group, order_id, 32, 1)['type'], 'fail')
+                self.assertEqual(decode_orders(group.sell_orders), [[1, 30, 1], [3, 32, 1]])
+
+
+
+class LockedLedgerTests(unittest.TestCase):
+    def test_ledger_follows_book_changes(self):
+        for engine in ORDER_BOOK_ENGINES:
+            with self.subTest(engine=engine):
+                book = OrderBook.from_rows([[1, 10, 2]], [[1, 30, 3], [2, 31, 1]], engine=engine)
+                self.assertEqual(book.locked_quantity(1, 'sell'), 3)
+                self.assertEqual(book.locked_quantity(1, 'buy'), 2)
+                self.assertEqual(book.locked_cash(1), 20)
+
+                sell = book.find_order(1, 'sell', 30, 3)
+                book.reduce(sell.order_id, 1)
+                self.assertEqual(book.locked_quantity(1, 'sell'), 2)
+                book.amend(sell.order_id, 29, 4)
+                self.assertEqual(book.locked_quantity(1, 'sell'), 4)
+                buy = book.find_order(1, 'buy', 10, 2)
+                book.amend(buy.order_id, 12, 3)
+                self.assertEqual(book.locked_cash(1), 36)
+
+                book.cancel_player(1, 'sell')
+                self.assertEqual(book.locked_quantity(1, 'sell'), 0)
+                self.assertEqual(book.locked_quantity(2, 'sell'), 1)
+                book.clear()
+                self.assertEqual(book.locked_cash(1), 0)
+                self.assertEqual(book.locked_quantity(2, 'sell'), 0)
+
+
+class ReservedSellTests(unittest.TestCase):
+    def setUp(self):
+        patcher = mock.patch.object(
+            ExperimentConfig, 'reserve_sell_orders', new=property(lambda self: True)
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_sells_cannot_exceed_unreserved_holdings(self):
+        group = DummyGroup()
+        seller = group.players[0]
+        self.assertEqual(process_new_order(seller, group, 'sell', 30, 6)['type'], 'order_added')
+        result = process_new_order(seller, group, 'sell', 31, 5)
+        self.assertEqual(result['type'], 'fail')
+        self.assertIn('6', result['notifications'][1])
+        self.assertEqual(process_new_order(seller, group, 'sell', 31, 4)['type'], 'order_added')
+
+        # 修改掛單時不重複計算自己的數量
+        order_id = get_order_book(group).find_order(1, 'sell', 30, 6).order_id
+        self.assertEqual(process_amend_order(seller, group, order_id, 30, 5)['type'], 'order_amended')
+        self.assertEqual(process_amend_order(seller, group, order_id, 30, 7)['type'], 'fail')
+
+    def test_batch_counts_earlier_orders(self):
+        group = DummyGroup()
+        orders = [{'direction': 'sell', 'price': p, 'quantity': 4} for p in (30, 31, 32)]
+        result = process_order_batch(group.players[0], group, orders)
+        self.assertEqual(result['type'], 'fail')
+        self.assertIn('第 3 筆', result['notifications'][1])
+        self.assertEqual(len(get_order_book(group)), 0)
+
+
+class BulkCancelTests(unittest.TestCase):
+    def test_cancel_all_removes_both_sides_with_one_write(self):
+        group = DummyGroup()
+        p1, p2, _ = group.players
+        process_new_order(p1, group, 'buy', 10, 1)
+        process_new_order(p1, group, 'sell', 40, 1)
+        process_new_order(p2, group, 'sell', 41, 1)
+
+        with mock.patch('utils.trading_utils.save_orders', wraps=save_orders) as save:
+            result = process_cancel_all(p1, group)
+        self.assertEqual(save.call_count, 1)
+        self.assertIn('2', result['notifications'][1])
+        self.assertEqual(decode_orders(group.buy_orders), [])
+        self.assertEqual(decode_orders(group.sell_orders), [[2, 41, 1]])
+
+    def test_expire_group_orders_writes_once_per_round(self):
+        group = DummyGroup()
+        for i, player in enumerate(group.players):
+            process_new_order(player, group, 'buy', 10 + i, 1)
+            process_new_order(player, group, 'sell', 40 + i, 1)
+
+        with mock.patch('utils.trading_utils.save_orders', wraps=save_orders) as save:
+            self.assertEqual(expire_group_orders(group), 6)
+            for _ in group.players:
+                self.assertEqual(expire_group_orders(group), 0)
+        self.assertEqual(save.call_count, 1)
+        self.assertEqual(group.buy_orders, '[]')
+        self.assertEqual(group.sell_orders, '[]')
+
+        book = get_order_book(group)
+        release_market(group)
+        self.assertIsNot(get_order_book(group), book)
+        self.assertEqual(len(get_order_book(group)), 0)
+
+
+class DisplayVersionTests(unittest.TestCase):
+    def test_only_visible_changes_bump_display_version(self):
+        for engine in ORDER_BOOK_ENGINES:
+            with self.subTest(engine=engine):
+                book = OrderBook(engine)
+                top = [book.add(1, 'buy', price, 1) for price in (30, 31, 32)]
+                version = book.display_version
+
+                # 同數量第四筆較差的買單不在顯示範圍內：新增、改價、取消都不改變顯示版本
+                deep = book.add(2, 'buy', 10, 1)
+                book.amend(deep.order_id, 11, 1)
+                book.remove(deep.order_id)
+                self.assertEqual(book.display_version, version)
+                self.assertEqual(book.version, 6)
+
+                def assert_visible(change):
+                    nonlocal version
+                    change()
+                    self.assertGreater(book.display_version, version)
+                    version = book.display_version
+
+                assert_visible(lambda: book.add(2, 'buy', 40, 1))  # 較好的價格
+                assert_visible(lambda: book.add(2, 'buy', 5, 2))  # 新的數量級別
+                book.remove(top[0].order_id)  # 價格 40 加入後，30 已排到第四筆
+                self.assertEqual(book.display_version, version)
+                assert_visible(lambda: book.remove(top[2].order_id))  # 顯示中的掛單被取消
+                sell = book.add(3, 'sell', 50, 3)
+                version = book.display_version
+                assert_visible(lambda: book.reduce(sell.order_id, 1))  # 部分成交
+
+
+class FakeSeqColumn:
+    """模擬 ExtraModel 的 seq 欄位：比較運算產生查詢條件"""
+
+    def __gt__(self, value):
+        return lambda row: row.seq > value
+
+
+class FakeQuery:
+    """模擬 objects_filter 回傳的查詢（只支援 order_by seq 與 all）"""
+
+    def __init__(self, rows):
+        self.rows = rows
+
+    def order_by(self, column):
+        return FakeQuery(sorted(self.rows, key=lambda r: r.seq))
+
+    def all(self):
+        return list(self.rows)
+
+
+class FakeBookEventModel:
+    """模擬 ExtraModel 的 create / objects_filter"""
+
+    seq = FakeSeqColumn()
+
+    def __init__(self):
+        self.rows = []
+        self.loaded = 0  # 查詢取出的列數
+
+    def create(self, **fields):
+        self.rows.append(SimpleNamespace(**fields))
+
+    def objects_filter(self, condition, group):
+        rows = [r for r in reversed(self.rows) if r.group is group and condition(r)]
+        self.loaded += len(rows)
+        return FakeQuery(rows)
+
+
+class WriteAheadJournalTests(unittest.TestCase):
+    def test_events_replay_to_identical_book(self):
+        for engine in ORDER_BOOK_ENGINES:
+            with self.subTest(engine=engine):
+                book = OrderBook(engine)
+                book.events = []
+                first = book.add(1, 'buy', 20, 3)
+                book.add(2, 'buy', 20, 2)
+                book.add(3, 'sell', 25, 1)
+                book.reduce(first.order_id, 1)
+                book.amend(first.order_id, 21, 2)
+                book.cancel_player(3, 'sell')
+                snapshot = book.to_snapshot()
+
+                replayed = OrderBook(engine)
+                for event in book.drain_events():
+                    replayed.apply_event(event)
+                self.assertEqual(replayed.to_snapshot(), snapshot)
+                self.assertEqual(OrderBook.from_snapshot(snapshot, engine).to_snapshot(), snapshot)
+                self.assertEqual(book.drain_events(), [])
+
+    def run_market(self, group):
+        p1, p2, p3 = group.players
+        process_new_order(p1, group, 'sell', 30, 1)
+        process_new_order(p1, group, 'sell', 31, 2)
+        process_new_order(p2, group, 'buy', 25, 1)
+        process_new_order(p3, group, 'buy', 30, 1)  # 與 p1 的 30 成交
+        order_id = get_order_book(group).player_orders(2, 'buy')[0].order_id
+        process_amend_order(p2, group, order_id, 26, 1)
+        process_new_order(p3, group, 'buy', 24, 2)
+
+    def test_restart_rebuilds_from_snapshot_and_journal(self):
+        patcher = mock.patch.object(
+            ExperimentConfig, 'book_snapshot_interval', new=property(lambda self: 4)
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        model = FakeBookEventModel()
+        group = DummyGroup()
+        with mock.patch.dict(trading_utils._BOOK_EVENT_MODELS, {type(group).__module__: model}):
+            self.run_market(group)
+            book = get_order_book(group)
+            expected = book.to_snapshot()
+            self.assertEqual([r.seq for r in model.rows], list(range(1, len(model.rows) + 1)))
+
+            # 累積 4 筆事件以上才寫快照（成交那次一起寫入兩筆移除，累積到 5 筆）；之後的事件只在日誌中
+            snapshot = json.loads(group.book_snapshot)
+            self.assertEqual(snapshot['wal_seq'], 5)
+            self.assertGreater(len(model.rows), snapshot['wal_seq'])
+
+            trading_utils._ORDER_BOOKS.pop(trading_utils._order_book_key(group))
+            rebuilt = get_order_book(group)
+            self.assertEqual(rebuilt.to_snapshot(), expected)
+            self.assertEqual(rebuilt.wal_seq, len(model.rows))
+            # 只取出快照之後的日誌
+            self.assertEqual(model.loaded, len(model.rows) - snapshot['wal_seq'])
+
+            # 重建後的變動接續日誌序號，訂單簿清空時寫入快照
+            expire_group_orders(group)
+            self.assertEqual(model.rows[-1].op, 'clear')
+            self.assertEqual(json.loads(group.book_snapshot)['wal_seq'], len(model.rows))
+            self.assertEqual(group.sell_orders, '[]')
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,64 @@
+import json
+import unittest
+
+from utils.order_book import OrderBook
+from utils.order_codec import PACKED_PREFIX, decode_orders, encode_orders, iter_orders
+from utils.trading_utils import get_order_book, save_order_book
+
+from tests.test_order_book import DummyGroup
+
+
+class OrderCodecTests(unittest.TestCase):
+    def test_packed_round_trip_is_smaller_than_json(self):
+        rows = [[pid, 20 + pid, pid % 5 + 1] for pid in range(1, 16)] * 4
+        packed = encode_orders(rows, 'packed')
+        self.assertTrue(packed.startswith(PACKED_PREFIX))
+        self.assertLess(len(packed), len(encode_orders(rows, 'json')))
+        self.assertEqual(decode_orders(packed), rows)
+
+    def test_legacy_json_and_empty_fields_are_readable(self):
+        self.assertEqual(decode_orders('[[1, 20.0, 2]]'), [[1, 20.0, 2]])
+        self.assertEqual(encode_orders([], 'packed'), '[]')
+        self.assertEqual(decode_orders('[]'), [])
+
+    def test_out_of_range_values_fall_back_to_json(self):
+        rows = [[1, 20.5, 2], [70000, 10, 1]]
+        self.assertEqual(json.loads(encode_orders(rows, 'packed')), rows)
+
+    def test_corrupt_field_raises_value_error(self):
+        for text in (PACKED_PREFIX + 'not base64!', PACKED_PREFIX + 'AAA=', '{"a": 1}'):
+            with self.subTest(text=text):
+                with self.assertRaises(ValueError):
+                    decode_orders(text)
+
+    def test_unknown_codec(self):
+        with self.assertRaises(ValueError):
+            encode_orders([], 'xml')
+
+    def test_book_rebuilds_lazily_from_packed_field(self):
+        rows = iter_orders(encode_orders([[1, 20, 2], [2, 21, 1]], 'packed'))
+        book = OrderBook.from_rows(rows, [])
+        self.assertEqual(book.rows('buy'), [[1, 20, 2], [2, 21, 1]])
+
+
+class GroupFieldTests(unittest.TestCase):
+    def test_snapshot_written_with_configured_codec_and_reread(self):
+        group = DummyGroup()
+        group.sell_orders = json.dumps([[1, 30, 2]])
+        book = get_order_book(group)
+        book.add(2, 'buy', 25, 1)
+        save_order_book(group, book)
+
+        self.assertTrue(group.buy_orders.startswith(PACKED_PREFIX))
+        self.assertEqual(decode_orders(group.buy_orders), [[2, 25, 1]])
+        self.assertEqual(decode_orders(group.sell_orders), [[1, 30, 2]])
+
+    def test_corrupt_field_is_reset(self):
+        group = DummyGroup()
+        group.buy_orders = PACKED_PREFIX + '!!'
+        self.assertEqual(len(get_order_book(group)), 0)
+        self.assertEqual(group.buy_orders, '[]')
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,58 @@
+import unittest
+
+from Stage_MUDA import TradingMarket as MudaTradingMarket
+from utils.rate_limit import RateLimiter, TokenBucket
+from utils.trading_utils import check_rate_limit, get_order_book, get_rate_limiter
+
+from tests.test_order_book import DummyGroup
+
+
+class TokenBucketTests(unittest.TestCase):
+    def test_burst_then_refill(self):
+        bucket = TokenBucket(rate=2, burst=3, now=0.0)
+        self.assertEqual([bucket.take(0.0) for _ in range(4)], [True, True, True, False])
+        self.assertFalse(bucket.take(0.4))
+        self.assertTrue(bucket.take(0.5))
+        # 補充不超過 burst
+        self.assertEqual([bucket.take(100.0) for _ in range(4)], [True, True, True, False])
+
+    def test_limiter_is_per_player_and_category(self):
+        limiter = RateLimiter({'order': (1, 1)})
+        self.assertTrue(limiter.allow(1, 'order', 0.0))
+        self.assertFalse(limiter.allow(1, 'order', 0.0))
+        self.assertTrue(limiter.allow(2, 'order', 0.0))
+        self.assertTrue(all(limiter.allow(1, 'ping', 0.0) for _ in range(10)))
+        self.assertEqual(limiter.counts, {'order': {'allowed': 2, 'limited': 1}})
+
+
+class LiveRateLimitTests(unittest.TestCase):
+    def test_flooding_orders_are_rejected_without_touching_the_book(self):
+        group = DummyGroup()
+        flooder = group.players[0]
+        burst = int(get_rate_limiter(group).limits['order'][1])
+        for _ in range(burst):
+            self.assertIsNone(check_rate_limit(group, flooder, {'type': 'submit_offer'}, now=0.0))
+
+        version = get_order_book(group).version
+        rejected = check_rate_limit(group, flooder, {'type': 'submit_offer'}, now=0.0)
+        self.assertEqual(list(rejected), [1])
+        self.assertEqual(rejected[1]['type'], 'delta')
+        self.assertEqual(rejected[1]['notification']['type'], 'error')
+        self.assertEqual(get_order_book(group).version, version)
+
+        # 其他玩家不受影響
+        self.assertIsNone(check_rate_limit(group, group.players[1], {'type': 'submit_offer'}, now=0.0))
+
+    def test_flooding_pings_are_dropped(self):
+        group = DummyGroup()
+        player = group.players[1]
+        replies = [MudaTradingMarket.live_method(player, {'type': 'ping'}) for _ in range(20)]
+        self.assertEqual(list(replies[0]), [2])
+        self.assertIn({}, replies)
+        counts = get_rate_limiter(group).counts['ping']
+        self.assertEqual(counts['allowed'] + counts['limited'], 20)
+        self.assertGreater(counts['limited'], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,87 @@
+import unittest
+
+from utils.settlement import Settlement
+from utils.trading_utils import (
+    enqueue_command,
+    get_trade_journal,
+    process_commands,
+    process_new_order,
+    settled_value,
+    settlement_pass,
+)
+
+from tests.test_order_book import DummyGroup, DummyPlayer
+
+
+class CountingPlayer(DummyPlayer):
+    """記錄欄位寫入次數"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.__dict__['writes'] = 0
+
+    def __setattr__(self, name, value):
+        if name != 'writes':
+            self.__dict__['writes'] = self.__dict__.get('writes', 0) + 1
+        super().__setattr__(name, value)
+
+
+class SettlementTests(unittest.TestCase):
+    def test_deltas_accumulate_and_apply_once(self):
+        player = DummyPlayer(1)
+        settlement = Settlement()
+        settlement.add(player, 'current_cash', -30)
+        settlement.add(player, 'current_cash', -20)
+        settlement.add(player, 'current_items', 0)
+        self.assertEqual(settlement.pending(1, 'current_cash'), -50)
+        self.assertEqual(player.current_cash, 1000)
+
+        self.assertEqual(settlement.apply(), 1)
+        self.assertEqual(player.current_cash, 950)
+        self.assertEqual(settlement.pending(1, 'current_cash'), 0)
+
+    def test_pass_settles_once_and_checks_see_pending_changes(self):
+        group = DummyGroup()
+        group.players = [CountingPlayer(i, items=2 if i == 1 else 10) for i in range(1, 4)]
+        for player in group.players:
+            player.group = group
+            player.subsession = group.subsession
+            player.writes = 0
+        seller, first, second = group.players
+
+        def apply(player, data):
+            return process_new_order(player, group, data['direction'], data['price'], 1)
+
+        journal = get_trade_journal(group.subsession)
+        for player, direction, price in (
+            (seller, 'sell', 30), (first, 'buy', 30), (seller, 'sell', 31), (second, 'buy', 31), (seller, 'sell', 32)
+        ):
+            enqueue_command(group, player, {'direction': direction, 'price': price})
+        with settlement_pass(group):
+            result = process_commands(group, apply)
+            # 仍在外層結算中：欄位尚未寫入，但檢查看得到未寫回的變動
+            self.assertEqual(seller.current_items, 2)
+            self.assertEqual(settled_value(seller, 'current_items'), 0)
+            self.assertEqual(len(journal), 0)
+
+        # 第三筆賣單依結算後的持有量（0）被拒絕
+        self.assertEqual(result['notification_types'][1], 'error')
+        self.assertEqual(seller.current_items, 0)
+        self.assertEqual(seller.current_cash, 1000 + 61)
+        self.assertEqual((seller.total_sold, seller.total_earned), (2, 61))
+        self.assertEqual((first.current_items, second.current_cash), (11, 1000 - 31))
+        self.assertEqual([t['price'] for t in journal], [30, 31])
+        # 賣方兩筆成交的現金、持有量、賣出量、收入各只寫入一次
+        self.assertEqual(seller.writes, 4)
+
+    def test_trade_outside_a_pass_settles_immediately(self):
+        group = DummyGroup()
+        seller, buyer, _ = group.players
+        process_new_order(seller, group, 'sell', 30, 1)
+        process_new_order(buyer, group, 'buy', 30, 1)
+        self.assertEqual((seller.current_items, buyer.current_cash), (9, 970))
+        self.assertEqual(len(get_trade_journal(group.subsession)), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
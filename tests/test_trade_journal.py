@@ -0,0 +1,126 @@
+import json
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+from utils import trading_utils
+from utils.trade_journal import TradeJournal
+from utils.trading_utils import (
+    get_market_stats,
+    get_trade_journal,
+    process_new_order,
+    release_market,
+    save_trade_journal,
+)
+
+from tests.test_order_book import DummyGroup
+
+
+class FakeTradeModel:
+    """模擬 ExtraModel 的 create / filter"""
+
+    def __init__(self):
+        self.rows = []
+
+    def create(self, **fields):
+        self.rows.append(SimpleNamespace(**fields))
+
+    def filter(self, subsession):
+        return [r for r in reversed(self.rows) if r.subsession is subsession]
+
+
+class TradeJournalTests(unittest.TestCase):
+    def test_append_tail_and_since(self):
+        journal = TradeJournal()
+        for i in range(5):
+            self.assertEqual(journal.append({'price': i}), i)
+        self.assertEqual([t['price'] for t in journal.tail(2)], [3, 4])
+        self.assertEqual(journal.tail(0), [])
+        self.assertEqual([t['price'] for t in journal.since(3)], [3, 4])
+        self.assertEqual(len(journal), 5)
+
+    def test_page_walks_backwards_with_cursor(self):
+        journal = TradeJournal({'price': i} for i in range(25))
+        trades, cursor = journal.page(15, 10)
+        self.assertEqual([t['price'] for t in trades], list(range(5, 15)))
+        self.assertEqual(cursor, 5)
+        trades, cursor = journal.page(cursor, 10)
+        self.assertEqual([t['price'] for t in trades], list(range(5)))
+        self.assertEqual(cursor, 0)
+        self.assertEqual(journal.page(0, 10), ([], 0))
+        self.assertEqual(len(journal.page(99, 10)[0]), 10)
+
+    def test_from_legacy_json(self):
+        self.assertEqual(list(TradeJournal.from_json('[{"price": 1}]')), [{'price': 1}])
+        self.assertEqual(len(TradeJournal.from_json('not json')), 0)
+        self.assertEqual(len(TradeJournal.from_json(None)), 0)
+
+
+class TradeRecordingTests(unittest.TestCase):
+    def trade(self, group):
+        seller, buyer = group.players[0], group.players[1]
+        process_new_order(seller, group, 'sell', 30, 1)
+        process_new_order(buyer, group, 'buy', 30, 1)
+
+    def test_registered_model_gets_one_row_per_trade(self):
+        model = FakeTradeModel()
+        group = DummyGroup()
+        app = type(group.subsession).__module__
+        with mock.patch.dict(trading_utils._TRADE_MODELS, {app: model}):
+            self.trade(group)
+            self.trade(group)
+            self.assertEqual([r.seq for r in model.rows], [0, 1])
+            # 有登記 model 時每筆成交不再改寫 executed_trades
+            self.assertEqual(group.subsession.executed_trades, '[]')
+
+            # 伺服器重啟後由 model 依 seq 重建
+            trading_utils._TRADE_JOURNALS.pop(trading_utils._trade_journal_key(group.subsession))
+            journal = get_trade_journal(group.subsession)
+            self.assertEqual(len(journal), 2)
+            self.assertEqual(journal.tail(1)[0]['buyer_id'], 2)
+
+            save_trade_journal(group.subsession)
+            self.assertEqual(len(json.loads(group.subsession.executed_trades)), 2)
+
+    def test_legacy_field_is_read_when_no_rows(self):
+        group = DummyGroup()
+        group.subsession.executed_trades = json.dumps([
+            {'timestamp': '00:05', 'buyer_id': 1, 'seller_id': 2, 'price': 10, 'quantity': 1}
+        ])
+        self.trade(group)
+        journal = get_trade_journal(group.subsession)
+        self.assertEqual([t['price'] for t in journal], [10, 30])
+        self.assertEqual(len(json.loads(group.subsession.executed_trades)), 2)
+
+    def test_journal_and_stats_are_released_after_last_group(self):
+        first, second = DummyGroup(), DummyGroup()
+        subsession = second.subsession = first.subsession
+        for player in second.players:
+            player.subsession = subsession
+        subsession.closed_groups = 0
+        subsession.get_groups = lambda: [first, second]
+        key = trading_utils._trade_journal_key(subsession)
+
+        self.trade(first)
+        save_trade_journal(subsession)
+        release_market(first)
+        # 另一個組別仍在交易：日誌與統計保持常駐
+        self.assertIn(key, trading_utils._TRADE_JOURNALS)
+        self.assertIn(key, trading_utils._MARKET_STATS)
+
+        self.trade(second)
+        save_trade_journal(subsession)
+        release_market(second)
+        self.assertNotIn(key, trading_utils._TRADE_JOURNALS)
+        self.assertNotIn(key, trading_utils._MARKET_STATS)
+
+        # 結果頁的讀取由 executed_trades / price_history 重建，且不再常駐
+        self.assertEqual(len(get_trade_journal(subsession)), 2)
+        self.assertEqual(get_market_stats(subsession).volume, 2)
+        self.assertEqual(len(get_market_stats(subsession).price_history), 2)
+        self.assertNotIn(key, trading_utils._TRADE_JOURNALS)
+        self.assertNotIn(key, trading_utils._MARKET_STATS)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,137 @@
+"""
+集合競價（frequent batch auction）：定時以單一清算價撮合累積的掛單
+
+每期結束時，以價格階梯的各價位總量計算清算價：
+- 需求 D(p) = 出價 >= p 的買單總量，供給 S(p) = 要價 <= p 的賣單總量
+- 成交量 V(p) = min(D(p), S(p))，取成交量最大的價格
+- 成交量相同時取供需差 |D(p) - S(p)| 最小者，仍相同時取中間的價格
+
+只需考慮有掛單的價位，計算量與價位數成正比，與掛單筆數無關。
+成交分配依價格優先、時間優先，邊際掛單可部分成交。
+"""
+from typing import Any, List, Optional, Sequence, Tuple
+
+Level = Tuple[int, int]  # (價格, 該價位總量)
+
+
+def clearing_price(bids: Sequence[Level], asks: Sequence[Level]) -> Optional[Tuple[int, int]]:
+    """
+    計算使成交量最大的單一清算價
+
+    Args:
+        bids: 買方各價位 [(價格, 總量), ...]，價格由高到低
+        asks: 賣方各價位 [(價格, 總量), ...]，價格由低到高
+
+    Returns:
+        (清算價, 成交量)；買賣價格沒有交叉時為 None
+    """
+    if not bids or not asks or bids[0][0] < asks[0][0]:
+        return None
+
+    # 成交量只在有掛單的價位改變，候選價格限於交叉區間內的價位
+    low, high = asks[0][0], bids[0][0]
+    prices = sorted({p for p, _ in bids if p >= low} | {p for p, _ in asks if p <= high})
+
+    # 供給：由低到高累加賣方總量
+    supply = []
+    total, i = 0, 0
+    for price in prices:
+        while i < len(asks) and asks[i][0] <= price:
+            total += asks[i][1]
+            i += 1
+        supply.append(total)
+
+    # 需求：由高到低累加買方總量
+    demand = [0] * len(prices)
+    total, i = 0, 0
+    for k in range(len(prices) - 1, -1, -1):
+        while i < len(bids) and bids[i][0] >= prices[k]:
+            total += bids[i][1]
+            i += 1
+        demand[k] = total
+
+    best_key = None
+    candidates: List[int] = []
+    for k, price in enumerate(prices):
+        volume = min(demand[k], supply[k])
+        key = (volume, -abs(demand[k] - supply[k]))
+        if best_key is None or key > best_key:
+            best_key, candidates = key, [price]
+        elif key == best_key:
+            candidates.append(price)
+
+    if best_key[0] <= 0:
+        return None
+    return candidates[(len(candidates) - 1) // 2], best_key[0]
+
+
+def allocate(orders: Sequence[Any], volume: int) -> List[Tuple[Any, int]]:
+    """
+    依優先順序分配成交量
+
+    Args:
+        orders: 可成交的掛單（依價格優先、時間優先排序，需有 quantity 屬性）
+        volume: 本方總成交量
+
+    Returns:
+        [(掛單, 成交數量), ...]；最後一筆可能只部分成交
+    """
+    fills = []
+    for order in orders:
+        if volume <= 0:
+            break
+        quantity = min(order.quantity, volume)
+        fills.append((order, quantity))
+        volume -= quantity
+    return fills
+
+
+def pair_fills(
+    buy_fills: Sequence[Tuple[Any, int]],
+    sell_fills: Sequence[Tuple[Any, int]]
+) -> List[Tuple[Any, Any, int]]:
+    """
+    將買賣雙方的分配依序配對為逐筆成交
+
+    Returns:
+        [(買單, 賣單, 數量), ...]
+    """
+    pairs = []
+    buys, sells = list(buy_fills), list(sell_fills)
+    i = j = 0
+    buy_left = buys[0][1] if buys else 0
+    sell_left = sells[0][1] if sells else 0
+    while i < len(buys) and j < len(sells):
+        quantity = min(buy_left, sell_left)
+        pairs.append((buys[i][0], sells[j][0], quantity))
+        buy_left -= quantity
+        sell_left -= quantity
+        if buy_left == 0:
+            i += 1
+            buy_left = buys[i][1] if i < len(buys) else 0
+        if sell_left == 0:
+            j += 1
+            sell_left = sells[j][1] if j < len(sells) else 0
+    return pairs
+
+
+class AuctionClock:
+    """
+    單一組別的集合競價時鐘
+
+    oTree 沒有伺服器端計時器，由 live_method（含用戶端定時 ping）呼叫 due() 檢查是否到期。
+    """
+
+    def __init__(self, interval: float, now: float):
+        self.interval = interval
+        self.next_clear = now + interval
+        self.auctions = 0
+
+    def due(self, now: float) -> bool:
+        """本期是否已結束"""
+        return now >= self.next_clear
+
+    def advance(self, now: float) -> None:
+        """完成一次撮合，下一期從現在起算"""
+        self.auctions += 1
+        self.next_clear = now + self.interval
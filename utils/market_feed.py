@@ -0,0 +1,130 @@
+"""
+市場增量更新：每個組別的公開市場序號與增量（delta）計算
+
+公開狀態（公開掛單、成交紀錄、價格 K 線、市場統計）每變動一次，序號加一，
+並只送出與上一版的差異；用戶端依序套用，序號不連續時再要求完整快照。
+每個 MarketFeed 另有隨機的 epoch，伺服器重啟後序號從 0 開始，舊的 (epoch, seq) 不會被誤認。
+"""
+import uuid
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from .trade_journal import TradeJournal
+
+OFFER_SIDES = ('buy_offers', 'sell_offers')
+
+
+class MarketFeed:
+    """
+    單一組別的公開市場增量
+
+    增量格式：
+        {
+            'buy_offers': {'ids': [顯示順序的 order_id], 'upsert': [新增或數量變動的掛單]},
+            'sell_offers': {...},
+            'trades': [新成交],
+            'candles': [最後一根（若有變動）起的 K 線],
+            'stats': {...},  # 市場統計有變動時送出整份
+        }
+    沒有變動的部分省略。
+    """
+
+    def __init__(self, epoch: Optional[str] = None):
+        self.epoch = epoch or uuid.uuid4().hex[:8]
+        self.seq = 0
+        self._public: Optional[Dict[str, Any]] = None
+        self._ids: Dict[str, List[int]] = {side: [] for side in OFFER_SIDES}
+        self._offers: Dict[str, Dict[int, Tuple[int, int]]] = {side: {} for side in OFFER_SIDES}
+        self._trade_count = 0
+        self._candle_count = 0
+        self._last_candle: Optional[Dict[str, Any]] = None
+        self._stats: Optional[Dict[str, Any]] = None
+        # 扇出計數：market_updates 呼叫次數、其中有公開增量（送給全組）的次數、送出的訊息總數、
+        # 因合併時間窗延後（併入下一次廣播而省下）的廣播次數
+        self.fanout = {'events': 0, 'broadcasts': 0, 'messages': 0, 'coalesced': 0}
+        self.last_broadcast = 0.0  # 上次送出公開增量的時間（秒）
+
+    @property
+    def published(self) -> Optional[Dict[str, Any]]:
+        """上次送出的公開狀態（尚未送出過時為 None）"""
+        return self._public
+
+    def record_fanout(self, recipients: int, broadcast: bool) -> None:
+        """記錄一次市場更新送出的訊息數"""
+        self.fanout['events'] += 1
+        self.fanout['messages'] += recipients
+        if broadcast:
+            self.fanout['broadcasts'] += 1
+
+    def has_changes(self, public: Dict[str, Any], journal: TradeJournal) -> bool:
+        """公開狀態或成交紀錄是否可能與上次送出的不同（不計算增量）"""
+        return public is not self._public or len(journal) != self._trade_count
+
+    def is_current(self, epoch: Any, seq: Any) -> bool:
+        """用戶端回報的 (epoch, seq) 是否就是目前已送出的版本"""
+        return epoch == self.epoch and seq == self.seq
+
+    def mark_published(self, public: Dict[str, Any], journal: TradeJournal) -> None:
+        """將目前的公開狀態記為已送出（不產生增量）"""
+        self._public = public
+        for side in OFFER_SIDES:
+            offers = public.get(side, [])
+            self._ids[side] = [o['order_id'] for o in offers]
+            self._offers[side] = {o['order_id']: (o['price'], o['quantity']) for o in offers}
+        self._trade_count = len(journal)
+        candles = public.get('candles', [])
+        self._candle_count = len(candles)
+        self._last_candle = dict(candles[-1]) if candles else None
+        self._stats = public.get('stats')
+
+    def publish(self, public: Dict[str, Any], journal: TradeJournal) -> Optional[Dict[str, Any]]:
+        """
+        與上次送出的公開狀態比較，有變動時序號加一並回傳增量
+
+        Args:
+            public: 目前的公開狀態（public_market_state 的快取物件）
+            journal: 成交日誌
+
+        Returns:
+            增量 dict；沒有變動時為 None
+        """
+        if not self.has_changes(public, journal):
+            return None
+
+        delta: Dict[str, Any] = {}
+        for side in OFFER_SIDES:
+            offers = public.get(side, [])
+            previous = self._offers[side]
+            ids = [o['order_id'] for o in offers]
+            upsert = [o for o in offers if previous.get(o['order_id']) != (o['price'], o['quantity'])]
+            if upsert or ids != self._ids[side]:
+                delta[side] = {'ids': ids, 'upsert': upsert}
+
+        trades = journal.since(self._trade_count)
+        if trades:
+            delta['trades'] = trades
+
+        # K 線只有最後一根會更新，其餘只會追加：送出更新的最後一根與新增的 K 線
+        candles = public.get('candles', [])
+        start = self._candle_count
+        if 0 < start <= len(candles) and candles[start - 1] != self._last_candle:
+            start -= 1
+        if candles[start:]:
+            delta['candles'] = candles[start:]
+
+        # 首次送出時只有統計不同（基準為空）不算變動，避免每個組別一開始就多一次增量
+        stats = public.get('stats')
+        if stats != self._stats and (self._public is not None or delta):
+            delta['stats'] = stats
+
+        self.mark_published(public, journal)
+        if not delta:
+            return None
+        self.seq += 1
+        return delta
+
+
+def trade_parties(delta: Optional[Dict[str, Any]]) -> Iterable[int]:
+    """增量中新成交的買賣雙方"""
+    for trade in (delta or {}).get('trades', []):
+        yield trade['buyer_id']
+        yield trade['seller_id']
@@ -0,0 +1,92 @@
+"""
+市場統計：每回合的成交統計與價格歷史，每筆成交 O(1) 更新
+
+最新成交價、成交量加權平均價（VWAP）、累計成交量、成交筆數、最高 / 最低價
+直接隨成交累加；最佳買賣價與價差由訂單簿的堆頂取得。
+交易頁面的市場行情面板（_static/global/market_panel.js）直接讀取公開快照中的 stats，
+不需再從整段成交紀錄重新計算。
+
+價格圖表使用固定秒數的 K 線（開高低收與成交量），用戶端只接收 K 線並由同一面板畫成價格圖，
+逐筆價格歷史只保留在伺服器並於回合結束寫回資料庫。
+"""
+from typing import Any, Dict, List, Optional
+
+
+class MarketStats:
+    """單一 subsession 的成交統計"""
+
+    def __init__(self, bucket_seconds: int = 5):
+        self.last_price: Optional[int] = None
+        self.high: Optional[int] = None
+        self.low: Optional[int] = None
+        self.volume = 0
+        self.notional = 0  # 成交金額（價格 × 數量）累計
+        self.trade_count = 0
+        self.price_history: List[Dict[str, Any]] = []  # Subsession.price_history 的常駐版本
+        self.bucket_seconds = max(int(bucket_seconds), 1)
+        # K 線：{'t': 區間起始秒數, 'open', 'high', 'low', 'close', 'volume'}，依時間排序
+        self.candles: List[Dict[str, int]] = []
+
+    def record(self, price: int, quantity: int, elapsed: int = 0) -> None:
+        """
+        記入一筆成交
+
+        Args:
+            price: 成交價
+            quantity: 成交數量
+            elapsed: 回合開始後經過的秒數（決定所屬的 K 線區間）
+        """
+        self.last_price = price
+        self.high = price if self.high is None else max(self.high, price)
+        self.low = price if self.low is None else min(self.low, price)
+        self.volume += quantity
+        self.notional += price * quantity
+        self.trade_count += 1
+        self._record_candle(price, quantity, elapsed)
+
+    def _record_candle(self, price: int, quantity: int, elapsed: int) -> None:
+        """更新所屬區間的 K 線；只有最後一根會變動，其餘皆已收盤"""
+        start = max(int(elapsed), 0) // self.bucket_seconds * self.bucket_seconds
+        last = self.candles[-1] if self.candles else None
+        # 時間不早於最後一根的起點都併入最後一根（時鐘誤差不會產生倒序的 K 線）
+        if last is not None and start <= last['t']:
+            last['high'] = max(last['high'], price)
+            last['low'] = min(last['low'], price)
+            last['close'] = price
+            last['volume'] += quantity
+            return
+        self.candles.append({
+            't': start, 'open': price, 'high': price, 'low': price, 'close': price, 'volume': quantity,
+        })
+
+    def candle_series(self) -> List[Dict[str, int]]:
+        """輸出為公開狀態中的 candles（複本，之後的成交不會改到已送出的資料）"""
+        return [dict(candle) for candle in self.candles]
+
+    @property
+    def vwap(self) -> Optional[float]:
+        """成交量加權平均價（尚無成交時為 None）"""
+        if not self.volume:
+            return None
+        return round(self.notional / self.volume, 2)
+
+    def snapshot(self, best_bid: Optional[int], best_ask: Optional[int]) -> Dict[str, Any]:
+        """
+        輸出為公開狀態中的 stats
+
+        Args:
+            best_bid: 目前最高買價（沒有買單時為 None）
+            best_ask: 目前最低賣價（沒有賣單時為 None）
+        """
+        spread = best_ask - best_bid if best_bid is not None and best_ask is not None else None
+        return {
+            'last_price': self.last_price,
+            'vwap': self.vwap,
+            'volume': self.volume,
+            'trade_count': self.trade_count,
+            'high': self.high,
+            'low': self.low,
+            'best_bid': best_bid,
+            'best_ask': best_ask,
+            'spread': spread,
+        }
@@ -0,0 +1,739 @@
+"""
+訂單簿引擎：常駐記憶體、價格優先 / 時間優先的買賣雙邊訂單簿
+
+資料庫中的 Group.buy_orders / sell_orders 只是這裡的快照；
+撮合、取消與顯示都直接在記憶體中的 OrderBook 上完成。
+
+開啟 events 時，每次變動記錄一筆基本事件（新增、移除、扣減、修改、清空），
+由 trading_utils 寫入預寫日誌；to_snapshot / from_snapshot 的精簡快照保留 order_id 與時間順序，
+伺服器重啟後以「快照 + 重播之後的事件」還原出完全相同的訂單簿。
+"""
+import heapq
+import itertools
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set, Tuple, Union
+
+BUY = 'buy'
+SELL = 'sell'
+
+
+def opposite_side(direction: str) -> str:
+    """取得對手方向"""
+    return SELL if direction == BUY else BUY
+
+
+def crosses(direction: str, price: int, resting_price: int) -> bool:
+    """
+    判斷新進訂單的價格是否可與對手掛單成交
+
+    Args:
+        direction: 新進訂單方向 ('buy' 或 'sell')
+        price: 新進訂單價格
+        resting_price: 對手掛單價格
+    """
+    if direction == BUY:
+        return resting_price <= price
+    return resting_price >= price
+
+
+def _priority_key(order: 'Order') -> Tuple[int, int]:
+    """價格優先（買單高價、賣單低價在前）、時間優先的排序鍵"""
+    return (-order.price if order.direction == BUY else order.price, order.seq)
+
+
+class Order:
+    """單筆掛單"""
+    __slots__ = ('order_id', 'player_id', 'direction', 'price', 'quantity', 'seq')
+
+    def __init__(
+        self,
+        order_id: int,
+        player_id: int,
+        direction: str,
+        price: int,
+        quantity: int,
+        seq: int
+    ):
+        self.order_id = order_id
+        self.player_id = player_id
+        self.direction = direction
+        self.price = price
+        self.quantity = quantity
+        self.seq = seq  # 時間優先順序
+
+    def to_row(self) -> List[int]:
+        """轉為資料庫快照格式 [player_id, price, quantity]"""
+        return [self.player_id, self.price, self.quantity]
+
+    def to_offer(self) -> Dict[str, int]:
+        """轉為前端顯示格式"""
+        return {
+            'order_id': self.order_id,
+            'player_id': self.player_id,
+            'price': self.price,
+            'quantity': self.quantity,
+        }
+
+    def __repr__(self) -> str:
+        return (f"Order(#{self.order_id} {self.direction} 玩家{self.player_id} "
+                f"價格{self.price} 數量{self.quantity})")
+
+
+class HeapLadder:
+    """
+    以二元堆積維護的單邊價格階梯
+
+    採用 heapq 文件建議的惰性刪除：移除時只將 entry 標記為失效，
+    等它浮到堆頂時才真正彈出；失效 entry 過多時整體重建。
+    最佳價查詢 O(1)，插入與移除 O(log n)。
+    """
+
+    def __init__(self, descending: bool):
+        self._sign = -1 if descending else 1
+        self._heap: List[list] = []
+        self._entries: Dict[int, list] = {}
+        self._counter = itertools.count()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def push(self, order: Order) -> None:
+        entry = [self._sign * order.price, order.seq, next(self._counter), order]
+        self._entries[order.order_id] = entry
+        heapq.heappush(self._heap, entry)
+
+    def discard(self, order: Order) -> None:
+        entry = self._entries.pop(order.order_id, None)
+        if entry is None:
+            return
+        entry[-1] = None
+
+        heap = self._heap
+        while heap and heap[0][-1] is None:
+            heapq.heappop(heap)
+
+        if len(heap) > 2 * len(self._entries) + 32:
+            self._heap = [e for e in heap if e[-1] is not None]
+            heapq.heapify(self._heap)
+
+    def best(self) -> Optional[Order]:
+        """最佳價格的掛單（堆頂永遠是有效 entry）"""
+        return self._heap[0][-1] if self._heap else None
+
+    def __iter__(self) -> Iterator[Order]:
+        """
+        依價格優先、時間優先的順序走訪，不修改堆積
+
+        以堆積本身的子節點關係做 best-first 走訪，取前 k 筆只需 O(k log k)。
+        走訪期間不可新增或移除掛單。
+        """
+        heap = self._heap
+        if not heap:
+            return
+        frontier = [(heap[0], 0)]
+        while frontier:
+            entry, i = heapq.heappop(frontier)
+            if entry[-1] is not None:
+                yield entry[-1]
+            for child in (2 * i + 1, 2 * i + 2):
+                if child < len(heap):
+                    heapq.heappush(frontier, (heap[child], child))
+
+
+class PriceLevelLadder:
+    """
+    以固定價格格陣列維護的單邊價格階梯
+
+    利用價格皆為小範圍整數的特性，每個價格格是一個以 order_id 為鍵、
+    依插入順序走訪的 dict（即 FIFO 佇列）。另以一個整數位元遮罩記錄
+    哪些價格格非空，最佳價與下一個非空價格格都用位元運算取得，
+    不必逐格掃描空的價格格。插入、移除與最佳價查詢皆為 O(1)
+    （位元運算的成本與價格格數 / 64 成正比）；較早的掛單重新加入時依 seq 插回，
+    成本與該價格格的掛單數成正比。超出陣列範圍的價格會自動擴充。
+    """
+
+    def __init__(self, descending: bool, num_levels: int = 201):
+        self._descending = descending
+        self._levels: List[Dict[int, Order]] = [{} for _ in range(num_levels)]
+        self._occupied = 0  # 第 p 個位元為 1 表示價格 p 有掛單
+        self._count = 0
+
+    def __len__(self) -> int:
+        return self._count
+
+    def push(self, order: Order) -> None:
+        price = order.price
+        if price < 0:
+            raise ValueError(f"價格不可為負數: {price}")
+        if price >= len(self._levels):
+            self._levels.extend({} for _ in range(price + 1 - len(self._levels)))
+
+        level = self._levels[price]
+        if level and next(reversed(level.values())).seq > order.seq:
+            # 較早的掛單重新加入（部分成交後移到新數量的子階梯）：依 seq 插回原本的時間順序
+            ordered = sorted([*level.values(), order], key=lambda o: o.seq)
+            level.clear()
+            level.update((o.order_id, o) for o in ordered)
+        else:
+            level[order.order_id] = order
+        self._occupied |= 1 << price
+        self._count += 1
+
+    def discard(self, order: Order) -> None:
+        price = order.price
+        if price >= len(self._levels):
+            return
+        level = self._levels[price]
+        if level.pop(order.order_id, None) is None:
+            return
+        self._count -= 1
+        if not level:
+            self._occupied &= ~(1 << price)
+
+    def _next_level(self, mask: int) -> int:
+        """遮罩中最好的價格格（遮罩不可為 0）"""
+        if self._descending:
+            return mask.bit_length() - 1
+        return (mask & -mask).bit_length() - 1
+
+    def best(self) -> Optional[Order]:
+        """最佳價格格中最早的掛單"""
+        if not self._occupied:
+            return None
+        return next(iter(self._levels[self._next_level(self._occupied)].values()))
+
+    def __iter__(self) -> Iterator[Order]:
+        """
+        依價格優先、時間優先的順序走訪，只經過非空的價格格
+
+        走訪期間不可新增或移除掛單。
+        """
+        mask = self._occupied
+        levels = self._levels
+        while mask:
+            price = self._next_level(mask)
+            yield from levels[price].values()
+            mask &= ~(1 << price)
+
+
+# 訂單簿事件的欄位（op, order_id, player_id, direction, price, quantity），同時也是預寫日誌 ExtraModel 的欄位；
+# 事件用不到的欄位為 0 或空字串
+BOOK_EVENT_FIELDS = ('op', 'order_id', 'player_id', 'direction', 'price', 'quantity')
+BookEvent = Tuple[str, int, int, str, int, int]
+
+# 可於 experiment_config.yaml 選擇的訂單簿引擎
+ORDER_BOOK_ENGINES = ('heap', 'price_level')
+Ladder = Union[HeapLadder, PriceLevelLadder]
+
+
+class OrderBook:
+    """
+    單一組別的常駐訂單簿
+
+    - 買賣雙邊各一條價格階梯，最佳買價 / 賣價查詢 O(log n)
+    - 另依 (方向, 數量) 建立子階梯，「數量相同才成交」的撮合規則
+      只需從同數量掛單的最佳價開始找
+    - 以 order_id 為鍵保存所有掛單，插入順序即寫回資料庫快照的順序
+    - 玩家索引 player_id → {order_id: Order}，取消玩家的掛單只需 O(k)
+    - (方向, 價格, 數量) → 筆數的多重集合，重複掛單檢查 O(1)
+    - (方向, 價格) → 總量，集合競價計算清算價只需走訪各價位
+    - 玩家鎖定帳：(玩家, 方向) → 掛單總量、玩家 → 買單總金額，查詢 O(1)
+
+    價格階梯可選 'heap'（HeapLadder）或 'price_level'（PriceLevelLadder）。
+
+    version 在每次掛單變動時加一；display_version 只在公開顯示的掛單
+    （每個數量級別最好的 display_depth 筆）有變動時加一，較深的掛單變動不影響其他玩家。
+    """
+
+    def __init__(self, engine: str = 'heap', price_levels: int = 201, display_depth: int = 3):
+        if engine not in ORDER_BOOK_ENGINES:
+            raise ValueError(f"未知的訂單簿引擎: {engine}")
+        self.engine = engine
+        self.price_levels = price_levels
+        self._orders: Dict[int, Order] = {}
+        self._by_player: Dict[int, Dict[int, Order]] = {}
+        self._keys: Dict[Tuple[str, int, int], int] = {}
+        self._depth: Dict[Tuple[str, int], int] = {}
+        self._locked: Dict[Tuple[int, str], int] = {}
+        self._locked_cash: Dict[int, int] = {}
+        self._sides = {BUY: self._new_ladder(BUY), SELL: self._new_ladder(SELL)}
+        self._by_quantity: Dict[Tuple[str, int], Ladder] = {}
+        self._next_id = 1  # 下一個 order_id / 時間順序
+        self.events: Optional[List[BookEvent]] = None  # 不為 None 時記錄每次變動的事件
+        self.wal_seq = 0  # 已寫入預寫日誌的最後序號（由 trading_utils 維護）
+        self.snapshot_seq = 0  # 最近一次快照涵蓋到的日誌序號
+        self.display_depth = display_depth
+        self.version = 0
+        self.display_version = 0
+        self.dirty = False
+        self.touched_players: Set[int] = set()  # 上次 drain 之後掛單有變動的玩家
+
+    @classmethod
+    def from_rows(
+        cls,
+        buy_rows: Iterable[List],
+        sell_rows: Iterable[List],
+        engine: str = 'heap',
+        price_levels: int = 201
+    ) -> 'OrderBook':
+        """
+        由資料庫快照重建訂單簿
+
+        Args:
+            buy_rows: 買單列表 [[player_id, price, quantity], ...]
+            sell_rows: 賣單列表
+            engine: 價格階梯引擎
+            price_levels: 'price_level' 引擎預先配置的價格格數
+        """
+        book = cls(engine, price_levels)
+        for direction, rows in ((BUY, buy_rows), (SELL, sell_rows)):
+            for row in rows:
+                book.add(int(row[0]), direction, int(float(row[1])), int(row[2]))
+        book.dirty = False
+        book.touched_players.clear()
+        return book
+
+    def to_snapshot(self) -> Dict[str, Any]:
+        """
+        精簡快照：保留 order_id 與時間順序，可由 from_snapshot 還原出相同的訂單簿
+
+        Returns:
+            {'next_id': 下一個編號, 'orders': [[order_id, player_id, 方向(1 = 買), price, quantity, seq], ...]}
+        """
+        return {
+            'next_id': self._next_id,
+            'orders': [
+                [o.order_id, o.player_id, int(o.direction == BUY), o.price, o.quantity, o.seq]
+                for o in self._orders.values()
+            ],
+        }
+
+    @classmethod
+    def from_snapshot(
+        cls,
+        snapshot: Dict[str, Any],
+        engine: str = 'heap',
+        price_levels: int = 201
+    ) -> 'OrderBook':
+        """由 to_snapshot 的精簡快照還原訂單簿"""
+        book = cls(engine, price_levels)
+        # 依時間順序插入，price_level 引擎同價位的先後順序也相同
+        for order_id, player_id, is_buy, price, quantity, seq in sorted(snapshot['orders'], key=lambda r: r[5]):
+            book._insert(Order(order_id, player_id, BUY if is_buy else SELL, price, quantity, seq))
+        book._next_id = snapshot['next_id']
+        return book
+
+    def _new_ladder(self, direction: str) -> Ladder:
+        if self.engine == 'price_level':
+            return PriceLevelLadder(descending=(direction == BUY), num_levels=self.price_levels)
+        return HeapLadder(descending=(direction == BUY))
+
+    def _quantity_ladder(self, direction: str, quantity: int) -> Ladder:
+        key = (direction, quantity)
+        ladder = self._by_quantity.get(key)
+        if ladder is None:
+            ladder = self._by_quantity[key] = self._new_ladder(direction)
+        return ladder
+
+    def _count_key(self, order: Order, delta: int) -> None:
+        """更新 (方向, 價格, 數量) 多重集合"""
+        key = (order.direction, order.price, order.quantity)
+        count = self._keys.get(key, 0) + delta
+        if count > 0:
+            self._keys[key] = count
+        else:
+            self._keys.pop(key, None)
+
+    @staticmethod
+    def _adjust(totals: Dict, key, delta: int) -> None:
+        total = totals.get(key, 0) + delta
+        if total > 0:
+            totals[key] = total
+        else:
+            totals.pop(key, None)
+
+    def _adjust_totals(self, order: Order, quantity: int) -> None:
+        """掛單數量增減 quantity 時，更新 (方向, 價格) 總量與玩家鎖定帳"""
+        self._adjust(self._depth, (order.direction, order.price), quantity)
+        self._adjust(self._locked, (order.player_id, order.direction), quantity)
+        if order.direction == BUY:
+            self._adjust(self._locked_cash, order.player_id, order.price * quantity)
+
+    def _is_displayed(self, order: Order) -> bool:
+        """掛單是否在其數量級別最好的 display_depth 筆之內（只走訪前 display_depth 筆）"""
+        ladder = self._by_quantity.get((order.direction, order.quantity))
+        if not ladder:
+            return False
+        return any(o is order for o in itertools.islice(ladder, self.display_depth))
+
+    def _new_id(self) -> int:
+        new_id = self._next_id
+        self._next_id += 1
+        return new_id
+
+    def _log(self, op: str, order_id: int = 0, player_id: int = 0,
+             direction: str = '', price: int = 0, quantity: int = 0) -> None:
+        if self.events is not None:
+            self.events.append((op, order_id, player_id, direction, price, quantity))
+
+    def drain_events(self) -> List[BookEvent]:
+        """取出並清空尚未寫入日誌的事件"""
+        if not self.events:
+            return []
+        events, self.events = self.events, []
+        return events
+
+    def apply_event(self, event: BookEvent) -> None:
+        """重播一筆事件；新增與修改依序取號，與原本的 order_id / 時間順序相同"""
+        op, order_id, player_id, direction, price, quantity = event
+        if op == 'add':
+            self.add(player_id, direction, price, quantity)
+        elif op == 'remove':
+            self.remove(order_id)
+        elif op == 'reduce':
+            self.reduce(order_id, quantity)
+        elif op == 'amend':
+            self.amend(order_id, price, quantity)
+        elif op == 'clear':
+            self.clear()
+        else:
+            raise ValueError(f"未知的訂單簿事件: {op}")
+
+    def _touch(self, *player_ids: int) -> None:
+        self.version += 1
+        self.dirty = True
+        self.touched_players.update(player_ids)
+
+    def drain_touched_players(self) -> Set[int]:
+        """取出並清空掛單有變動的玩家集合"""
+        touched, self.touched_players = self.touched_players, set()
+        return touched
+
+    def __len__(self) -> int:
+        return len(self._orders)
+
+    def get(self, order_id: int) -> Optional[Order]:
+        return self._orders.get(order_id)
+
+    # ========== 新增 / 移除 ==========
+
+    def add(self, player_id: int, direction: str, price: int, quantity: int) -> Order:
+        """新增一筆掛單（不做撮合）；方向不是 buy / sell 時在修改任何索引之前就拒絕"""
+        if direction not in self._sides:
+            raise ValueError(f"未知的掛單方向: {direction}")
+        order_id = self._new_id()
+        order = Order(order_id, player_id, direction, price, quantity, seq=order_id)
+        self._insert(order)
+        self._log('add', player_id=player_id, direction=direction, price=price, quantity=quantity)
+        self._touch(player_id)
+        return order
+
+    def _insert(self, order: Order) -> None:
+        """將掛單加入所有索引與價格階梯"""
+        order_id, direction, quantity = order.order_id, order.direction, order.quantity
+        self._orders[order_id] = order
+        self._by_player.setdefault(order.player_id, {})[order_id] = order
+        self._count_key(order, 1)
+        self._adjust_totals(order, quantity)
+        self._sides[direction].push(order)
+        self._quantity_ladder(direction, quantity).push(order)
+        if self._is_displayed(order):
+            self.display_version += 1
+
+    def remove(self, order_id: int) -> Optional[Order]:
+        """移除指定掛單，不存在時回傳 None"""
+        order = self._orders.pop(order_id, None)
+        if order is None:
+            return None
+        if self._is_displayed(order):
+            self.display_version += 1
+        player_orders = self._by_player[order.player_id]
+        del player_orders[order_id]
+        if not player_orders:
+            del self._by_player[order.player_id]
+        self._count_key(order, -1)
+        self._adjust_totals(order, -order.quantity)
+        self._sides[order.direction].discard(order)
+        # 數量級別有限，清空的子階梯保留下來重複使用
+        self._by_quantity[(order.direction, order.quantity)].discard(order)
+        self._log('remove', order_id)
+        self._touch(order.player_id)
+        return order
+
+    def reduce(self, order_id: int, quantity: int) -> Optional[Order]:
+        """
+        部分成交：扣減掛單數量，扣完即移除
+
+        掛單保留原本的時間優先順序，只從原數量的子階梯移到新數量的子階梯。
+        扣減後可能與其他掛單的 (方向, 價格, 數量) 相同；重複掛單規則只在送出時檢查，此處不處理。
+
+        Returns:
+            扣減後仍掛著的掛單；已完全成交或不存在時為 None
+        """
+        order = self._orders.get(order_id)
+        if order is None:
+            return None
+        if quantity >= order.quantity:
+            self.remove(order_id)
+            return None
+        displayed = self._is_displayed(order)
+        self._by_quantity[(order.direction, order.quantity)].discard(order)
+        self._count_key(order, -1)
+        order.quantity -= quantity
+        self._adjust_totals(order, -quantity)
+        self._quantity_ladder(order.direction, order.quantity).push(order)
+        self._count_key(order, 1)
+        if displayed or self._is_displayed(order):
+            self.display_version += 1
+        self._log('reduce', order_id, quantity=quantity)
+        self._touch(order.player_id)
+        return order
+
+    def amend(self, order_id: int, price: int, quantity: int) -> Optional[Order]:
+        """
+        修改掛單的價格與數量，order_id 不變
+
+        同價位只減少數量時保留原本的時間優先順序（同 reduce）；
+        改價或加量則排到新價位的最後，快照中的位置也移到最後，重建後順序一致。
+
+        Returns:
+            修改後的掛單；不存在時為 None
+        """
+        order = self._orders.get(order_id)
+        if order is None:
+            return None
+        if price == order.price and quantity <= order.quantity:
+            if quantity < order.quantity:
+                self.reduce(order_id, order.quantity - quantity)
+            return order
+
+        displayed = self._is_displayed(order)
+        self._count_key(order, -1)
+        self._adjust_totals(order, -order.quantity)
+        self._sides[order.direction].discard(order)
+        self._by_quantity[(order.direction, order.quantity)].discard(order)
+
+        order.price = price
+        order.quantity = quantity
+        order.seq = self._new_id()
+        for index in (self._orders, self._by_player[order.player_id]):
+            del index[order_id]
+            index[order_id] = order
+
+        self._count_key(order, 1)
+        self._adjust_totals(order, quantity)
+        self._sides[order.direction].push(order)
+        self._quantity_ladder(order.direction, quantity).push(order)
+        if displayed or self._is_displayed(order):
+            self.display_version += 1
+        self._log('amend', order_id, price=price, quantity=quantity)
+        self._touch(order.player_id)
+        return order
+
+    def clear(self) -> None:
+        """清空整本訂單簿"""
+        if not self._orders:
+            return
+        players = list(self._by_player)
+        self._orders.clear()
+        self._by_player.clear()
+        self._keys.clear()
+        self._depth.clear()
+        self._locked.clear()
+        self._locked_cash.clear()
+        self._sides = {BUY: self._new_ladder(BUY), SELL: self._new_ladder(SELL)}
+        self._by_quantity.clear()
+        self.display_version += 1
+        self._log('clear')
+        self._touch(*players)
+
+    # ========== 查詢 ==========
+
+    def best(self, direction: str) -> Optional[Order]:
+        """指定方向的最佳掛單（最高買價 / 最低賣價）"""
+        return self._sides[direction].best()
+
+    def find_match(
+        self,
+        direction: str,
+        player_id: int,
+        price: int,
+        quantity: int
+    ) -> Optional[Order]:
+        """
+        為新進訂單尋找最佳的對手掛單
+
+        規則與原本的 find_matching_orders 相同：數量必須相同、
+        價格可成交且不是自己的掛單；同價位時先掛先成交。
+
+        Args:
+            direction: 新進訂單方向
+            player_id: 新進訂單的玩家ID
+            price: 新進訂單價格
+            quantity: 新進訂單數量
+
+        Returns:
+            可成交的對手掛單，沒有則為 None
+        """
+        ladder = self._by_quantity.get((opposite_side(direction), quantity))
+        if ladder is None:
+            return None
+        for order in ladder:
+            if not crosses(direction, price, order.price):
+                break
+            if order.player_id != player_id:
+                return order
+        return None
+
+    def best_crossing(self, direction: str, player_id: int, price: int) -> Optional[Order]:
+        """
+        跨數量撮合用：新進訂單可成交的最佳對手掛單（不限數量、非本人）
+
+        Args:
+            direction: 新進訂單方向
+            player_id: 新進訂單的玩家ID
+            price: 新進訂單的限價
+        """
+        for order in self._sides[opposite_side(direction)]:
+            if not crosses(direction, price, order.price):
+                break
+            if order.player_id != player_id:
+                return order
+        return None
+
+    def crosses_own(self, direction: str, player_id: int, price: int) -> bool:
+        """新進訂單是否與同一玩家自己的對向掛單價格交叉（集合競價中會與自己配對）"""
+        return any(
+            crosses(direction, price, order.price)
+            for order in self.player_orders(player_id, opposite_side(direction))
+        )
+
+    def find_order(
+        self,
+        player_id: int,
+        direction: str,
+        price: float,
+        quantity: int
+    ) -> Optional[Order]:
+        """尋找指定玩家在指定價格與數量的掛單"""
+        for order in self._by_player.get(player_id, {}).values():
+            if (order.direction == direction
+                    and order.price == price and order.quantity == quantity):
+                return order
+        return None
+
+    def has_order_at(self, direction: str, price: int, quantity: int) -> bool:
+        """市場上（任何玩家）是否已有相同方向、價格與數量的掛單"""
+        return (direction, price, quantity) in self._keys
+
+    def depth(self, direction: str) -> List[Tuple[int, int]]:
+        """
+        指定方向各價位的總量 [(價格, 總量), ...]
+
+        買方價格由高到低、賣方由低到高，只走訪有掛單的價位。
+        """
+        levels = [(price, total) for (side, price), total in self._depth.items() if side == direction]
+        levels.sort(reverse=(direction == BUY))
+        return levels
+
+    def locked_quantity(self, player_id: int, direction: str) -> int:
+        """玩家指定方向掛單的總數量（賣方向即已承諾賣出的物品 / 碳權）"""
+        return self._locked.get((player_id, direction), 0)
+
+    def locked_cash(self, player_id: int) -> int:
+        """玩家買單的總金額（價格 × 數量）"""
+        return self._locked_cash.get(player_id, 0)
+
+    def player_orders(
+        self,
+        player_id: int,
+        direction: Optional[str] = None,
+        by_priority: bool = False
+    ) -> List[Order]:
+        """
+        指定玩家的掛單，只走訪該玩家自己的 k 筆掛單
+
+        Args:
+            player_id: 玩家ID
+            direction: 只取指定方向，None 表示兩邊都取
+            by_priority: True 時依價格優先、時間優先排序，否則依掛單先後順序
+        """
+        orders = [
+            order for order in self._by_player.get(player_id, {}).values()
+            if direction is None or order.direction == direction
+        ]
+        if by_priority:
+            orders.sort(key=_priority_key)
+        return orders
+
+    def orders(self, direction: str) -> List[Order]:
+        """指定方向的所有掛單，依價格優先、時間優先排序"""
+        return list(self._sides[direction])
+
+    def orders_through(self, direction: str, price: int) -> Iterator[Order]:
+        """
+        指定方向中價格不差於 price 的掛單（買單 >= price、賣單 <= price），依優先順序走訪
+
+        走訪期間不可新增或移除掛單。
+        """
+        incoming = opposite_side(direction)
+        return itertools.takewhile(lambda order: crosses(incoming, price, order.price), self._sides[direction])
+
+    def display_orders(self, direction: str, max_per_quantity: Optional[int] = None) -> List[Order]:
+        """
+        為顯示挑選掛單：每個數量級別保留價格最好的幾筆（預設 display_depth 筆）
+
+        與 filter_top_buy_orders_for_display / filter_top_sell_orders_for_display
+        的結果相同，但每個數量級別只走訪前 max_per_quantity 筆。
+        """
+        if max_per_quantity is None:
+            max_per_quantity = self.display_depth
+        picked: List[Order] = []
+        for (side, _), ladder in self._by_quantity.items():
+            if side == direction and ladder:
+                picked.extend(itertools.islice(ladder, max_per_quantity))
+        picked.sort(key=_priority_key)
+        return picked
+
+    def rows(self, direction: str) -> List[List[int]]:
+        """指定方向的資料庫快照列表（依掛單先後順序）"""
+        return [order.to_row() for order in self._orders.values() if order.direction == direction]
+
+    # ========== 批次取消 ==========
+
+    def cancel_player(
+        self,
+        player_id: int,
+        direction: str,
+        keep_order_id: Optional[int] = None
+    ) -> int:
+        """
+        取消玩家指定方向的所有掛單，回傳取消筆數
+
+        Args:
+            player_id: 玩家ID
+            direction: 'buy' 或 'sell'
+            keep_order_id: 不取消的掛單（部分成交後仍保留的剩餘掛單）
+        """
+        targets = [
+            order for order in self.player_orders(player_id, direction)
+            if order.order_id != keep_order_id
+        ]
+        for order in targets:
+            self.remove(order.order_id)
+        return len(targets)
+
+    def cancel_specific(
+        self,
+        player_id: int,
+        direction: str,
+        price: float,
+        quantity: int
+    ) -> int:
+        """取消玩家在指定價格與數量的掛單，回傳取消筆數"""
+        targets = [
+            order for order in self.player_orders(player_id, direction)
+            if order.price == price and order.quantity == quantity
+        ]
+        for order in targets:
+            self.remove(order.order_id)
+        return len(targets)
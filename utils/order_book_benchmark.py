@@ -0,0 +1,230 @@
+"""
+訂單簿引擎效能比較腳本
+
+以同一組隨機掛單 / 取消事件，比較：
+- list：原本的 JSON 列表撮合路徑（每個事件 json.loads → 線性掃描 → json.dumps）
+- heap：OrderBook + HeapLadder
+- price_level：OrderBook + PriceLevelLadder
+
+OrderBook 引擎的快照編碼可用 --codec 切換 json / packed。
+
+每個事件都與 live_method 相同：處理訂單後寫回一次快照，並在需要時重新計算公開顯示的掛單。
+list 路徑沒有快取，每個事件都重新計算；OrderBook 路徑與 public_market_state 相同，
+只在 display_version 改變（顯示範圍內的掛單有變動）時重新計算。
+結果分別列出事件處理（撮合與寫回快照）與顯示計算的耗時。
+
+使用方法:
+python -m utils.order_book_benchmark --players 15 --events 20000
+"""
+import argparse
+import json
+import random
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from .order_book import BUY, SELL, OrderBook
+from .order_codec import encode_orders
+from .trading_utils import (
+    check_duplicate_order,
+    filter_top_buy_orders_for_display,
+    filter_top_sell_orders_for_display,
+    find_matching_orders,
+)
+
+Event = Tuple[str, int, str, int, int]
+
+
+def generate_events(
+    num_events: int,
+    num_players: int,
+    price_range: Tuple[int, int],
+    max_quantity: int,
+    cancel_ratio: float,
+    seed: int
+) -> List[Event]:
+    """
+    產生隨機事件序列
+
+    Returns:
+        [(事件類型 'submit' / 'cancel', 玩家ID, 方向, 價格, 數量), ...]
+    """
+    rng = random.Random(seed)
+    low, high = price_range
+    events: List[Event] = []
+    for _ in range(num_events):
+        kind = 'cancel' if rng.random() < cancel_ratio else 'submit'
+        events.append((
+            kind,
+            rng.randint(1, num_players),
+            rng.choice((BUY, SELL)),
+            rng.randint(low, high),
+            rng.randint(1, max_quantity),
+        ))
+    return events
+
+
+def _add_timing(timings: Optional[Dict[str, float]], key: str, value: float) -> None:
+    """累加分項耗時 / 次數（timings 為 None 時不記錄）"""
+    if timings is not None:
+        timings[key] = timings.get(key, 0) + value
+
+
+def run_list_engine(events: List[Event], timings: Optional[Dict[str, float]] = None) -> int:
+    """
+    原本的列表路徑，回傳成交筆數
+
+    Args:
+        events: 事件序列
+        timings: 傳入時累加 'display'（顯示計算秒數）與 'display_builds'（計算次數）
+    """
+    fields = {BUY: '[]', SELL: '[]'}
+    trades = 0
+    for kind, player_id, direction, price, quantity in events:
+        buy_orders, sell_orders = json.loads(fields[BUY]), json.loads(fields[SELL])
+        orders = {BUY: buy_orders, SELL: sell_orders}
+
+        if kind == 'cancel':
+            orders[direction] = [o for o in orders[direction] if int(o[0]) != player_id]
+        elif not check_duplicate_order(orders[direction], price, quantity):
+            opposite = SELL if direction == BUY else BUY
+            matches = find_matching_orders(
+                orders[opposite], player_id, price, quantity, direction == BUY
+            )
+            if matches:
+                pick = min if direction == BUY else max
+                _, best = pick(matches, key=lambda x: float(x[1][1]))
+                buyer_id, seller_id = (player_id, int(best[0])) if direction == BUY else (int(best[0]), player_id)
+                orders[BUY] = [o for o in orders[BUY] if int(o[0]) != buyer_id]
+                orders[SELL] = [o for o in orders[SELL] if int(o[0]) != seller_id]
+                trades += 1
+            else:
+                orders[direction].append([player_id, price, quantity])
+
+        fields[BUY], fields[SELL] = json.dumps(orders[BUY]), json.dumps(orders[SELL])
+        start = time.perf_counter()
+        filter_top_buy_orders_for_display(sorted(orders[BUY], key=lambda x: -float(x[1])))
+        filter_top_sell_orders_for_display(sorted(orders[SELL], key=lambda x: float(x[1])))
+        _add_timing(timings, 'display', time.perf_counter() - start)
+        _add_timing(timings, 'display_builds', 1)
+    return trades
+
+
+def run_book_engine(
+    events: List[Event],
+    engine: str,
+    codec: str = 'json',
+    timings: Optional[Dict[str, float]] = None
+) -> int:
+    """
+    OrderBook 路徑（快照以 codec 編碼寫回），回傳成交筆數
+
+    Args:
+        events: 事件序列
+        engine: 價格階梯引擎
+        codec: 快照編碼
+        timings: 傳入時累加 'display'（顯示計算秒數）與 'display_builds'（計算次數）
+    """
+    book = OrderBook(engine=engine)
+    trades = 0
+    displayed_version = None
+    for kind, player_id, direction, price, quantity in events:
+        if kind == 'cancel':
+            book.cancel_player(player_id, direction)
+        elif not book.has_order_at(direction, price, quantity):
+            best = book.find_match(direction, player_id, price, quantity)
+            if best is not None:
+                buyer_id, seller_id = (player_id, best.player_id) if direction == BUY else (best.player_id, player_id)
+                book.cancel_player(buyer_id, BUY)
+                book.cancel_player(seller_id, SELL)
+                trades += 1
+            else:
+                book.add(player_id, direction, price, quantity)
+
+        if book.dirty:
+            encode_orders(book.rows(BUY), codec)
+            encode_orders(book.rows(SELL), codec)
+            book.dirty = False
+        # 與 public_market_state 的快取相同：顯示範圍沒有變動時沿用上次的結果
+        if book.display_version != displayed_version:
+            start = time.perf_counter()
+            book.display_orders(BUY)
+            book.display_orders(SELL)
+            displayed_version = book.display_version
+            _add_timing(timings, 'display', time.perf_counter() - start)
+            _add_timing(timings, 'display_builds', 1)
+    return trades
+
+
+def benchmark(events: List[Event], repeat: int = 3, codec: str = 'json') -> Dict[str, Dict[str, Any]]:
+    """
+    執行三種引擎並回傳最佳耗時
+
+    Returns:
+        {引擎: {'seconds', 'us_per_event', 'event_us', 'display_us', 'display_builds', 'trades'}}；
+        event_us / display_us 為每事件的事件處理與顯示計算耗時（取總耗時最佳的一次）
+    """
+    runners: Dict[str, Callable[[Dict[str, float]], int]] = {
+        'list': lambda timings: run_list_engine(events, timings),
+        'heap': lambda timings: run_book_engine(events, 'heap', codec, timings),
+        'price_level': lambda timings: run_book_engine(events, 'price_level', codec, timings),
+    }
+    results: Dict[str, Dict[str, Any]] = {}
+    for name, runner in runners.items():
+        best_seconds = float('inf')
+        best_timings: Dict[str, float] = {}
+        trades = 0
+        for _ in range(repeat):
+            timings: Dict[str, float] = {}
+            start = time.perf_counter()
+            trades = runner(timings)
+            seconds = time.perf_counter() - start
+            if seconds < best_seconds:
+                best_seconds, best_timings = seconds, timings
+        display_seconds = best_timings.get('display', 0.0)
+        results[name] = {
+            'seconds': best_seconds,
+            'us_per_event': best_seconds / len(events) * 1e6,
+            'event_us': (best_seconds - display_seconds) / len(events) * 1e6,
+            'display_us': display_seconds / len(events) * 1e6,
+            'display_builds': int(best_timings.get('display_builds', 0)),
+            'trades': trades,
+        }
+    return results
+
+
+def main():
+    """主函數"""
+    parser = argparse.ArgumentParser(description='訂單簿引擎效能比較')
+    parser.add_argument('--players', type=int, default=15, help='每組玩家數 (默認: 15)')
+    parser.add_argument('--events', type=int, default=20000, help='事件數 (默認: 20000)')
+    parser.add_argument('--min-price', type=int, default=1, help='最低價格 (默認: 1)')
+    parser.add_argument('--max-price', type=int, default=200, help='最高價格 (默認: 200)')
+    parser.add_argument('--max-quantity', type=int, default=10, help='最大數量 (默認: 10)')
+    parser.add_argument('--cancel-ratio', type=float, default=0.1, help='取消事件比例 (默認: 0.1)')
+    parser.add_argument('--repeat', type=int, default=3, help='重複次數，取最佳值 (默認: 3)')
+    parser.add_argument('--codec', choices=['json', 'packed'], default='json',
+                        help='OrderBook 引擎寫回快照的欄位編碼 (默認: json)')
+    parser.add_argument('--seed', type=int, default=42, help='隨機種子 (默認: 42)')
+    args = parser.parse_args()
+
+    events = generate_events(
+        args.events, args.players, (args.min_price, args.max_price),
+        args.max_quantity, args.cancel_ratio, args.seed
+    )
+    results = benchmark(events, args.repeat, args.codec)
+
+    print(f"玩家數={args.players}, 事件數={args.events}, 價格範圍={args.min_price}~{args.max_price}, "
+          f"快照編碼={args.codec}")
+    print(f"{'引擎':<12}{'總耗時(秒)':>12}{'每事件(µs)':>14}{'事件處理(µs)':>14}"
+          f"{'顯示計算(µs)':>14}{'顯示計算次數':>14}{'成交筆數':>10}")
+    for name, r in results.items():
+        print(f"{name:<12}{r['seconds']:>12.3f}{r['us_per_event']:>14.1f}{r['event_us']:>14.1f}"
+              f"{r['display_us']:>14.1f}{r['display_builds']:>14}{r['trades']:>10}")
+
+    trade_counts = {r['trades'] for r in results.values()}
+    if len(trade_counts) != 1:
+        print("警告：各引擎成交筆數不一致！")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""
+訂單欄位編碼：Group.buy_orders / sell_orders 快照的序列化格式
+
+- 'json'：原本的 [[player_id, price, quantity], ...] JSON 字串
+- 'packed'：每筆掛單打包為固定寬度紀錄（玩家 uint16、價格 uint32、數量 uint16，
+  共 8 bytes），整段 base64 後加上 'pk1:' 前綴寫入欄位
+
+解碼時依前綴自動判斷格式，因此舊場次的 JSON 欄位仍可讀取；
+打包解碼以 struct.iter_unpack 逐筆產生，重建訂單簿時不需先建出整個列表。
+"""
+import base64
+import binascii
+import json
+import struct
+from typing import Iterable, Iterator, List, Sequence
+
+PACKED_PREFIX = 'pk1:'
+_RECORD = struct.Struct('<HIH')
+
+
+class JsonOrderCodec:
+    """JSON 列表格式（原格式）"""
+    name = 'json'
+
+    def encode(self, rows: Sequence[Sequence]) -> str:
+        return json.dumps(rows)
+
+
+class PackedOrderCodec:
+    """固定寬度二進位紀錄 + base64"""
+    name = 'packed'
+
+    def encode(self, rows: Sequence[Sequence]) -> str:
+        """
+        打包訂單列表；空列表仍寫成 '[]'，
+        數值超出紀錄寬度（或非整數價格）時退回 JSON，解碼端會自動辨識
+        """
+        if not rows:
+            return '[]'
+        try:
+            payload = b''.join(_RECORD.pack(*row) for row in rows)
+        except struct.error:
+            return json.dumps(rows)
+        return PACKED_PREFIX + base64.b64encode(payload).decode('ascii')
+
+
+# 可於 experiment_config.yaml 選擇的訂單欄位編碼
+ORDER_CODECS = {codec.name: codec for codec in (JsonOrderCodec(), PackedOrderCodec())}
+
+
+def get_order_codec(name: str):
+    """依名稱取得編碼器"""
+    try:
+        return ORDER_CODECS[name]
+    except KeyError:
+        raise ValueError(f"未知的訂單欄位編碼: {name}") from None
+
+
+def iter_orders(text: str) -> Iterator[List]:
+    """
+    逐筆解碼訂單欄位，自動辨識 JSON 與打包格式
+
+    Args:
+        text: 欄位內容
+
+    Returns:
+        [player_id, price, quantity] 的疊代器
+
+    Raises:
+        ValueError: 欄位內容無法解析
+    """
+    if text.startswith(PACKED_PREFIX):
+        try:
+            payload = base64.b64decode(text[len(PACKED_PREFIX):], validate=True)
+        except binascii.Error as e:
+            raise ValueError(f"訂單欄位 base64 格式錯誤: {e}") from None
+        if len(payload) % _RECORD.size:
+            raise ValueError(f"訂單欄位長度錯誤: {len(payload)} bytes")
+        return (list(record) for record in _RECORD.iter_unpack(payload))
+    orders = json.loads(text)
+    if not isinstance(orders, list):
+        raise ValueError("訂單欄位不是列表")
+    return iter(orders)
+
+
+def decode_orders(text: str) -> List[List]:
+    """解碼整個訂單欄位為列表"""
+    return list(iter_orders(text))
+
+
+def encode_orders(rows: Iterable[Sequence], codec: str = 'json') -> str:
+    """以指定編碼寫出訂單列表"""
+    return get_order_codec(codec).encode(list(rows))
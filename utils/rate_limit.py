@@ -0,0 +1,68 @@
+"""
+訊息頻率限制：每位玩家、每類訊息一個 token bucket
+
+每個桶以固定速率補充 token、最多累積 burst 個，每則訊息消耗一個；
+沒有 token 時該訊息超量。單一用戶端重試迴圈只會耗盡自己的桶，不影響組內其他玩家。
+檢查只需幾次算術運算，超量訊息在碰觸訂單簿與市場狀態之前就被擋下。
+"""
+from typing import Dict, Mapping, Optional, Tuple
+
+
+class TokenBucket:
+    """單一 token bucket"""
+    __slots__ = ('rate', 'burst', 'tokens', 'updated')
+
+    def __init__(self, rate: float, burst: float, now: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst  # 一開始是滿的，頁面載入時的連續請求不會被擋
+        self.updated = now
+
+    def take(self, now: float) -> bool:
+        """補充經過時間的 token 後取用一個；沒有 token 時回傳 False"""
+        elapsed = now - self.updated
+        if elapsed > 0:
+            self.tokens = min(self.burst, self.tokens + elapsed * self.rate)
+            self.updated = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+class RateLimiter:
+    """
+    單一組別的訊息頻率限制
+
+    limits 為 {訊息類別: (每秒補充數, 最多累積數)}；未列出的類別不限制。
+    counts 記錄各類別通過與超量的訊息數：{類別: {'allowed': n, 'limited': n}}。
+    """
+
+    def __init__(self, limits: Mapping[str, Tuple[float, float]]):
+        self.limits = dict(limits)
+        self._buckets: Dict[Tuple[int, str], TokenBucket] = {}
+        self.counts: Dict[str, Dict[str, int]] = {}
+
+    def allow(self, player_id: int, category: str, now: float) -> bool:
+        """
+        檢查玩家的一則訊息是否在限制內
+
+        Args:
+            player_id: 玩家 id_in_group
+            category: 訊息類別（見 experiment_config.yaml 的 rate_limits）
+            now: 目前時間（秒）
+
+        Returns:
+            True 表示可處理；False 表示超量
+        """
+        limit: Optional[Tuple[float, float]] = self.limits.get(category)
+        if limit is None:
+            return True
+        key = (player_id, category)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(limit[0], limit[1], now)
+        allowed = bucket.take(now)
+        counts = self.counts.setdefault(category, {'allowed': 0, 'limited': 0})
+        counts['allowed' if allowed else 'limited'] += 1
+        return allowed
@@ -0,0 +1,50 @@
+"""
+成交結算：一次處理中累積所有成交的餘額與統計變動，結束時一次寫回
+
+一次 process_commands 可能撮合多筆成交，逐筆寫入買賣雙方的現金、持有量與四個統計欄位
+會讓同一個 ORM 欄位被反覆讀寫。Settlement 只在記憶體中累加各玩家各欄位的變動量，
+成交紀錄也先暫存，處理結束時每位玩家每個欄位只寫入一次，成交紀錄依序寫入成交日誌。
+處理期間需要讀取餘額的檢查透過 trading_utils.settled_value 取得「資料庫值 + 未寫回的變動」。
+"""
+from typing import Any, Dict, List, Tuple
+
+
+class Settlement:
+    """單一組別一次處理中的待結算變動"""
+
+    def __init__(self):
+        self._players: Dict[int, Any] = {}  # id_in_group → 玩家物件（寫回時使用）
+        self._deltas: Dict[Tuple[int, str], Any] = {}  # (id_in_group, 欄位) → 累計變動量
+        self.trades: List[Dict[str, Any]] = []  # 依成交順序暫存的成交紀錄
+
+    def __len__(self) -> int:
+        return len(self.trades)
+
+    def add(self, player: Any, field: str, delta: Any) -> None:
+        """累加玩家欄位的變動量"""
+        pid = player.id_in_group
+        self._players.setdefault(pid, player)
+        key = (pid, field)
+        self._deltas[key] = self._deltas.get(key, 0) + delta
+
+    def pending(self, player_id: int, field: str) -> Any:
+        """玩家欄位尚未寫回的變動量"""
+        return self._deltas.get((player_id, field), 0)
+
+    def apply(self) -> int:
+        """
+        將累計的變動寫回玩家欄位（每位玩家每個欄位寫入一次）並清空
+
+        Returns:
+            寫入的欄位數
+        """
+        writes = 0
+        for (pid, field), delta in self._deltas.items():
+            if not delta:
+                continue
+            player = self._players[pid]
+            setattr(player, field, getattr(player, field) + delta)
+            writes += 1
+        self._deltas.clear()
+        self._players.clear()
+        return writes
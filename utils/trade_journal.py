@@ -0,0 +1,75 @@
+"""
+成交紀錄日誌：只追加、常駐記憶體的成交紀錄
+
+每筆成交以 O(1) 追加；讀取端（市場狀態、生產決策、結果頁）
+直接疊代或取最後 n 筆，不需每次解析整個 executed_trades JSON。
+持久化由 trading_utils 負責（每筆成交一列 ExtraModel）。
+"""
+import json
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+Trade = Dict[str, Any]
+
+# 每筆成交紀錄的欄位，同時也是 ExtraModel 的欄位
+TRADE_FIELDS = ('timestamp', 'buyer_id', 'seller_id', 'price', 'quantity')
+
+
+class TradeJournal:
+    """
+    單一 subsession 的成交紀錄
+
+    紀錄依成交順序排列；回傳的 dict 為共用物件，呼叫端不應修改。
+    """
+
+    def __init__(self, trades: Optional[Iterable[Trade]] = None):
+        self._trades: List[Trade] = list(trades or [])
+
+    @classmethod
+    def from_json(cls, text: Optional[str]) -> 'TradeJournal':
+        """由舊格式的 executed_trades JSON 欄位建立（內容損壞時為空）"""
+        try:
+            trades = json.loads(text) if text else []
+        except (json.JSONDecodeError, TypeError):
+            trades = []
+        return cls(trades if isinstance(trades, list) else [])
+
+    def __len__(self) -> int:
+        return len(self._trades)
+
+    def __iter__(self) -> Iterator[Trade]:
+        return iter(self._trades)
+
+    def append(self, trade: Trade) -> int:
+        """
+        追加一筆成交
+
+        Returns:
+            該筆成交的序號（從 0 起算）
+        """
+        self._trades.append(trade)
+        return len(self._trades) - 1
+
+    def tail(self, n: int) -> List[Trade]:
+        """最近 n 筆成交（舊到新）"""
+        if n <= 0:
+            return []
+        return self._trades[-n:]
+
+    def page(self, before: int, limit: int) -> Tuple[List[Trade], int]:
+        """
+        序號 before（不含）之前最多 limit 筆成交（舊到新）
+
+        Returns:
+            (成交列表, 這一頁第一筆的序號)；序號為 0 表示已沒有更早的成交
+        """
+        before = min(max(before, 0), len(self._trades))
+        start = max(before - max(limit, 0), 0)
+        return self._trades[start:before], start
+
+    def since(self, seq: int) -> List[Trade]:
+        """序號 seq（含）之後的成交"""
+        return self._trades[max(seq, 0):]
+
+    def to_json(self) -> str:
+        """輸出為 executed_trades 欄位格式"""
+        return json.dumps(self._trades)
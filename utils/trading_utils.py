@@ -4,7 +4,21 @@
 from otree.api import *
 import json
 import time
-from typing import Dict, List, Any, Tuple, Optional
+import sys
+import os
+from collections import deque
+from contextlib import contextmanager
+from typing import Callable, Deque, Dict, Iterable, Iterator, List, Any, Tuple, Optional
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+from configs.config import config
+from .order_book import BOOK_EVENT_FIELDS, BUY, SELL, Order, OrderBook, opposite_side
+from .order_codec import encode_orders, iter_orders
+from .trade_journal import TRADE_FIELDS, TradeJournal
+from .market_feed import MarketFeed, trade_parties
+from .market_stats import MarketStats
+from .call_auction import AuctionClock, allocate, clearing_price, pair_fills
+from .rate_limit import RateLimiter
+from .settlement import Settlement
 
 class TradingError(Exception):
     """交易錯誤的基礎類別"""
@@ -30,6 +44,8 @@ def update_price_history(
     """
     更新價格歷史記錄
     
+    記錄追加到常駐記憶體的價格歷史（O(1)），回合結束時由 save_trade_journal 寫回 price_history 欄位。
+    
     Args:
         subsession: 子會話物件
         trade_price: 交易價格
@@ -38,39 +54,46 @@ def update_price_history(
     Returns:
         更新後的價格歷史列表
     """
-    try:
-        price_history = json.loads(subsession.price_history)
-    except json.JSONDecodeError:
-        price_history = []
-    
-    # 計算時間戳
-    timestamp = _calculate_timestamp(subsession)
-    
-    # 獲取市場價格
-    market_price = _get_market_price(subsession)
-    
-    # 創建價格記錄
-    price_record = {
+    price_history = get_market_stats(subsession).price_history
+    price_history.append(_price_record(subsession, trade_price, event, _calculate_timestamp(subsession)))
+    return price_history
+
+def _price_record(
+    subsession: BaseSubsession,
+    price: float,
+    event: str,
+    timestamp: str
+) -> Dict[str, Any]:
+    """建立一筆價格歷史記錄"""
+    return {
         'timestamp': timestamp,
-        'price': float(trade_price),
+        'price': float(price),
         'event': event,
-        'market_price': float(market_price),
+        'market_price': float(_get_market_price(subsession)),
         'round': subsession.round_number
     }
-    
-    price_history.append(price_record)
-    subsession.price_history = json.dumps(price_history)
-    
-    return price_history
+
+def _elapsed_seconds(subsession: BaseSubsession) -> int:
+    """回合開始（start_time）後經過的秒數；尚未開始時為 0"""
+    if hasattr(subsession, 'field_maybe_none'):
+        start_time = subsession.field_maybe_none('start_time')
+    else:
+        start_time = getattr(subsession, 'start_time', None)
+    if start_time:
+        return int(time.time()) - start_time
+    return 0
+
+def _timestamp_seconds(timestamp: Any) -> int:
+    """將 MM:SS 時間戳轉回秒數（無法解析時為 0）"""
+    try:
+        minutes, seconds = str(timestamp).split(':')
+        return int(minutes) * 60 + int(seconds)
+    except ValueError:
+        return 0
 
 def _calculate_timestamp(subsession: BaseSubsession) -> str:
     """計算時間戳（格式：MM:SS）"""
-    current_time = int(time.time())
-    if hasattr(subsession, 'start_time') and subsession.start_time:
-        elapsed_seconds = current_time - subsession.start_time
-    else:
-        elapsed_seconds = 0
-    
+    elapsed_seconds = _elapsed_seconds(subsession)
     minutes = elapsed_seconds // 60
     seconds = elapsed_seconds % 60
     return f"{minutes:02d}:{seconds:02d}"
@@ -79,107 +102,800 @@ def _get_market_price(subsession: BaseSubsession) -> Currency:
     """獲取市場價格"""
     return getattr(subsession, 'market_price', None) or getattr(subsession, 'item_market_price', 0)
 
-def record_trade(
-    group: BaseGroup, 
-    buyer_id: int, 
-    seller_id: int, 
-    price: float, 
-    quantity: int
-) -> List[Dict[str, Any]]:
+def process_cancel_all(player: BasePlayer, group: BaseGroup) -> Dict[str, Any]:
     """
-    記錄交易
+    取消玩家自己的所有買賣掛單（cancel_all 訊息），只寫回一次訂單快照
     
-    Args:
-        group: 組別物件
-        buyer_id: 買方ID
-        seller_id: 賣方ID
-        price: 交易價格
-        quantity: 交易數量
-        
     Returns:
-        更新後的交易歷史列表
+        process_new_order 格式的結果
     """
-    try:
-        trade_history = json.loads(group.trade_history)
-    except json.JSONDecodeError:
-        trade_history = []
-    
-    # 創建交易記錄
-    trade_record = {
-        'timestamp': _calculate_timestamp(group.subsession),
-        'buyer_id': int(buyer_id),
-        'seller_id': int(seller_id),
-        'price': float(price),
-        'quantity': int(quantity)
+    player_id = player.id_in_group
+    book = get_order_book(group)
+    cancelled = book.cancel_player(player_id, BUY) + book.cancel_player(player_id, SELL)
+    save_order_book(group, book)
+    
+    print(f"玩家 {player_id} 取消所有掛單: {cancelled} 筆")
+    return {
+        'type': 'orders_cancelled',
+        'update_all': True,
+        'notifications': {
+            player_id: f'已取消 {cancelled} 筆掛單' if cancelled else '目前沒有掛單'
+        }
     }
+
+def expire_group_orders(group: BaseGroup) -> int:
+    """
+    交易時間結束時一次清除組別的所有掛單
     
-    trade_history.append(trade_record)
-    group.trade_history = json.dumps(trade_history)
+    清空常駐訂單簿並寫入一次空的訂單快照，成本與訂單簿深度無關；
+    訂單簿已經是空的時候不寫入，因此可由每位玩家的 before_next_page 重複呼叫。
+    
+    Returns:
+        清除的掛單筆數
+    """
+    book = get_order_book(group)
+    expired = len(book)
+    if expired:
+        book.clear()
+        save_order_book(group, book)
+        print(f"組別 {group.id} 交易結束，清除 {expired} 筆掛單")
+    return expired
+
+def _field_orders(group: BaseGroup, field: str) -> Iterable[List]:
+    """逐筆讀取訂單欄位（JSON 或打包格式）；內容損壞時重設為空列表"""
+    try:
+        return iter_orders(getattr(group, field))
+    except (ValueError, AttributeError):
+        setattr(group, field, '[]')
+        return []
+
+def save_orders(group: BaseGroup, buy_orders: List[List], sell_orders: List[List]) -> None:
+    """儲存買賣訂單（編碼依 trading_engine.order_codec 設定）"""
+    codec = config.order_codec
+    group.buy_orders = encode_orders(buy_orders, codec)
+    group.sell_orders = encode_orders(sell_orders, codec)
+
+# 常駐記憶體的訂單簿。oTree 在單一行程內依序執行所有 live_method，
+# 因此以記憶體中的 OrderBook 為準，資料庫欄位只是每次事件後寫回的快照。
+_ORDER_BOOKS: Dict[Tuple[str, int, str], OrderBook] = {}
+
+def _order_book_key(group: BaseGroup) -> Tuple[str, int, str]:
+    """訂單簿的鍵：(app 模組, 組別主鍵, session code)"""
+    return (type(group).__module__, group.id, group.session.code)
+
+# 訂單簿預寫日誌：各 app 以 register_book_event_model 登記一個 ExtraModel，訂單簿每次變動寫入一列（O(1)），
+# 每 book_snapshot_interval 筆事件（或訂單簿清空時）才將精簡快照寫入 Group.book_snapshot 與 buy_orders / sell_orders。
+# 伺服器重啟後由最近的快照加上之後的日誌重建。未登記 model 的 app 沿用每次變動寫回完整快照。
+_BOOK_EVENT_MODELS: Dict[str, Any] = {}
+
+def register_book_event_model(app_module: str, model: Any) -> None:
+    """
+    登記 app 的訂單簿預寫日誌 ExtraModel
     
-    print(f"記錄交易: 買方{buyer_id} <- 賣方{seller_id}, 價格{price}, 數量{quantity}")
-    return trade_history
+    Args:
+        app_module: app 模組名稱（在 app 中傳入 __name__）
+        model: 連結 group、含 seq 與 BOOK_EVENT_FIELDS 欄位的 ExtraModel
+    """
+    _BOOK_EVENT_MODELS[app_module] = model
 
-def cancel_player_orders(group: BaseGroup, player_id: int, order_type: str) -> None:
+def _book_snapshot(group: BaseGroup) -> Optional[Dict[str, Any]]:
+    """讀取 Group.book_snapshot 精簡快照；沒有或內容損壞時為 None"""
+    try:
+        snapshot = json.loads(getattr(group, 'book_snapshot', None) or 'null')
+    except (json.JSONDecodeError, TypeError):
+        return None
+    return snapshot if isinstance(snapshot, dict) else None
+
+def get_order_book(group: BaseGroup) -> OrderBook:
     """
-    取消玩家的所有指定類型訂單
+    取得組別的常駐訂單簿，首次存取（或伺服器重啟後）由資料庫重建
+    
+    有預寫日誌時：最近的精簡快照（沒有時為 buy_orders / sell_orders 欄位）加上之後的日誌事件，
+    order_id 與時間順序都與重啟前相同。
     
     Args:
         group: 組別物件
-        player_id: 玩家ID
-        order_type: 訂單類型 ('buy' 或 'sell')
+        
+    Returns:
+        該組別的 OrderBook
+    """
+    key = _order_book_key(group)
+    book = _ORDER_BOOKS.get(key)
+    if book is None:
+        engine, price_levels = config.order_book_engine, config.order_book_price_levels
+        model = _BOOK_EVENT_MODELS.get(type(group).__module__)
+        snapshot = _book_snapshot(group) if model is not None else None
+        if snapshot is not None:
+            book = OrderBook.from_snapshot(snapshot, engine, price_levels)
+            book.wal_seq = book.snapshot_seq = snapshot.get('wal_seq', 0)
+        else:
+            # from_rows 依欄位順序取號，重播時的 order_id 與寫日誌時相同
+            book = OrderBook.from_rows(
+                _field_orders(group, 'buy_orders'),
+                _field_orders(group, 'sell_orders'),
+                engine=engine,
+                price_levels=price_levels,
+            )
+        if model is not None:
+            # 只在資料庫端取出快照之後的日誌，快照已涵蓋的事件不載入
+            rows = model.objects_filter(model.seq > book.snapshot_seq, group=group).order_by(model.seq).all()
+            for row in rows:
+                book.apply_event(tuple(getattr(row, f) for f in BOOK_EVENT_FIELDS))
+                book.wal_seq = row.seq
+            if rows:
+                print(f"組別 {group.id} 由快照與 {len(rows)} 筆日誌重建訂單簿（{len(book)} 筆掛單）")
+            book.events = []
+            book.dirty = False
+            book.touched_players.clear()
+        _ORDER_BOOKS[key] = book
+    return book
+
+def save_order_book(group: BaseGroup, book: OrderBook) -> None:
+    """
+    保存訂單簿的變動（沒有變動時不寫入）
+    
+    有預寫日誌時每筆事件寫入一列，累積 book_snapshot_interval 筆或訂單簿清空時才寫入快照；
+    否則寫回完整快照。
     """
-    if order_type not in ['buy', 'sell']:
-        print(f"無效的訂單類型: {order_type}")
+    if not book.dirty:
         return
+    model = _BOOK_EVENT_MODELS.get(type(group).__module__)
+    if model is None or book.events is None:
+        save_orders(group, book.rows(BUY), book.rows(SELL))
+    else:
+        for event in book.drain_events():
+            book.wal_seq += 1
+            model.create(group=group, seq=book.wal_seq, **dict(zip(BOOK_EVENT_FIELDS, event)))
+        if book.wal_seq > book.snapshot_seq and (
+                not len(book) or book.wal_seq - book.snapshot_seq >= config.book_snapshot_interval):
+            compact_order_book(group, book)
+    book.dirty = False
+
+def compact_order_book(group: BaseGroup, book: OrderBook) -> None:
+    """寫入精簡快照（含已寫入的日誌序號）與 buy_orders / sell_orders 欄位，重啟時只需重播之後的日誌"""
+    save_orders(group, book.rows(BUY), book.rows(SELL))
+    snapshot = book.to_snapshot()
+    snapshot['wal_seq'] = book.wal_seq
+    group.book_snapshot = json.dumps(snapshot, separators=(',', ':'))
+    book.snapshot_seq = book.wal_seq
+
+def release_market(group: BaseGroup) -> None:
+    """
+    回合結束時釋放組別所有常駐的市場狀態（訂單簿、公開狀態快取、增量序號、指令佇列、集合競價時鐘、頻率限制）
     
-    try:
-        # 獲取訂單列表
-        orders_field = f"{order_type}_orders"
-        orders = json.loads(getattr(group, orders_field))
+    掛單請先以 expire_group_orders 清除、成交日誌請先以 save_trade_journal 寫回。
+    成交日誌與市場統計屬於 subsession，subsession 有 closed_groups 欄位時計入一個已結束的組別，
+    所有組別都結束後一併釋放（見 release_trade_journal）。
+    """
+    key = _order_book_key(group)
+    feed = _MARKET_FEEDS.get(key)
+    if feed is not None and feed.fanout['events']:
+        fanout = feed.fanout
+        print(f"組別 {group.id} 市場更新 {fanout['events']} 次（廣播 {fanout['broadcasts']} 次，"
+              f"合併省下 {fanout['coalesced']} 次），共送出 {fanout['messages']} 則訊息，"
+              f"平均每次 {fanout['messages'] / fanout['events']:.1f} 則")
+    limiter = _RATE_LIMITERS.get(key)
+    if limiter is not None and limiter.counts:
+        summary = '，'.join(
+            f"{category} 通過 {c['allowed']} 則、超量 {c['limited']} 則" for category, c in limiter.counts.items()
+        )
+        print(f"組別 {group.id} 訊息頻率限制：{summary}")
+    for registry in (_ORDER_BOOKS, _PUBLIC_STATES, _MARKET_FEEDS, _COMMAND_QUEUES, _AUCTION_CLOCKS, _RATE_LIMITERS):
+        registry.pop(key, None)
+    
+    subsession = group.subsession
+    if hasattr(subsession, 'closed_groups'):
+        subsession.closed_groups += 1
+        if _round_closed(subsession):
+            release_trade_journal(subsession)
+
+# 成交紀錄：各 app 以 register_trade_model 登記一個 ExtraModel，每筆成交寫入一列（O(1)）；
+# 讀取則使用常駐記憶體的 TradeJournal。未登記 model 時退回改寫 executed_trades 欄位。
+_TRADE_MODELS: Dict[str, Any] = {}
+_TRADE_JOURNALS: Dict[Tuple[str, int, str], TradeJournal] = {}
+
+def register_trade_model(app_module: str, model: Any) -> None:
+    """
+    登記 app 的成交紀錄 ExtraModel
+    
+    Args:
+        app_module: app 模組名稱（在 app 中傳入 __name__）
+        model: 連結 subsession、含 seq 與 TRADE_FIELDS 欄位的 ExtraModel
+    """
+    _TRADE_MODELS[app_module] = model
+
+def _trade_journal_key(subsession: BaseSubsession) -> Tuple[str, int, str]:
+    """成交日誌的鍵：(app 模組, subsession 主鍵, session code)"""
+    return (type(subsession).__module__, subsession.id, subsession.session.code)
+
+def get_trade_journal(subsession: BaseSubsession) -> TradeJournal:
+    """
+    取得 subsession 的成交日誌，首次存取（或伺服器重啟後）由資料庫重建
+    
+    Args:
+        subsession: 子會話物件
         
-        # 過濾掉該玩家的訂單
-        old_count = len([o for o in orders if int(o[0]) == player_id])
-        orders = [o for o in orders if int(o[0]) != player_id]
+    Returns:
+        該 subsession 的 TradeJournal
+    """
+    key = _trade_journal_key(subsession)
+    journal = _TRADE_JOURNALS.get(key)
+    if journal is None:
+        model = _TRADE_MODELS.get(type(subsession).__module__)
+        rows = sorted(model.filter(subsession=subsession), key=lambda r: r.seq) if model else []
+        if rows:
+            journal = TradeJournal({f: getattr(r, f) for f in TRADE_FIELDS} for r in rows)
+        else:
+            # 舊場次（或未登記 model 的 app）的成交紀錄存在 executed_trades 欄位
+            journal = TradeJournal.from_json(getattr(subsession, 'executed_trades', None))
+        if not _round_closed(subsession):
+            _TRADE_JOURNALS[key] = journal
+    return journal
+
+def append_trade(subsession: BaseSubsession, trade: Dict[str, Any]) -> None:
+    """追加一筆成交紀錄並寫入資料庫，同時更新市場統計與價格歷史"""
+    # 先取得統計（必要時由既有成交重建），再記入這筆成交，避免重複計算
+    stats = get_market_stats(subsession)
+    journal = get_trade_journal(subsession)
+    seq = journal.append(trade)
+    model = _TRADE_MODELS.get(type(subsession).__module__)
+    if model is not None:
+        model.create(subsession=subsession, seq=seq, **trade)
+    else:
+        subsession.executed_trades = journal.to_json()
+    stats.record(trade['price'], trade['quantity'], _elapsed_seconds(subsession))
+    update_price_history(subsession, trade['price'])
+
+def _round_closed(subsession: BaseSubsession) -> bool:
+    """
+    subsession 的所有組別是否都已結束交易（release_market 計入 closed_groups）
+    
+    結束後成交日誌與市場統計只在讀取時由資料庫重建、不再常駐，結果頁等之後的讀取不會重新佔用記憶體。
+    """
+    closed = getattr(subsession, 'closed_groups', 0)
+    return closed > 0 and closed >= len(subsession.get_groups())
+
+def release_trade_journal(subsession: BaseSubsession) -> None:
+    """釋放 subsession 常駐的成交日誌與市場統計（之後的讀取由成交紀錄與 price_history 重建）"""
+    key = _trade_journal_key(subsession)
+    _TRADE_JOURNALS.pop(key, None)
+    _MARKET_STATS.pop(key, None)
+
+def save_trade_journal(subsession: BaseSubsession) -> None:
+    """回合結束時將成交日誌與價格歷史寫回 executed_trades / price_history 欄位一次，保留原有的資料匯出格式"""
+    subsession.executed_trades = get_trade_journal(subsession).to_json()
+    if hasattr(subsession, 'price_history'):
+        subsession.price_history = json.dumps(get_market_stats(subsession).price_history)
+
+# 每回合的成交統計與價格歷史，與成交日誌同樣以 subsession 為鍵
+_MARKET_STATS: Dict[Tuple[str, int, str], MarketStats] = {}
+
+def get_market_stats(subsession: BaseSubsession) -> MarketStats:
+    """
+    取得 subsession 的市場統計，首次存取（或伺服器重啟後）由成交日誌重建
+    
+    價格歷史優先讀取 price_history 欄位（回合結束後已寫回），否則由成交紀錄重建。
+    
+    Args:
+        subsession: 子會話物件
         
-        # 更新訂單列表
-        setattr(group, orders_field, json.dumps(orders))
+    Returns:
+        該 subsession 的 MarketStats
+    """
+    key = _trade_journal_key(subsession)
+    stats = _MARKET_STATS.get(key)
+    if stats is None:
+        stats = MarketStats(config.price_bucket_seconds)
+        journal = get_trade_journal(subsession)
+        for trade in journal:
+            stats.record(
+                int(trade['price']), int(trade['quantity']),
+                _timestamp_seconds(trade.get('timestamp', '00:00'))
+            )
+        try:
+            price_history = json.loads(getattr(subsession, 'price_history', None) or '[]')
+        except json.JSONDecodeError:
+            price_history = []
+        if not price_history:
+            price_history = [
+                _price_record(subsession, trade['price'], 'trade', trade.get('timestamp', '00:00'))
+                for trade in journal
+            ]
+        stats.price_history = price_history
+        if not _round_closed(subsession):
+            _MARKET_STATS[key] = stats
+    return stats
+
+def market_statistics(group: BaseGroup) -> Dict[str, Any]:
+    """組別公開狀態中的 stats：成交統計加上訂單簿目前的最佳買賣價與價差"""
+    book = get_order_book(group)
+    best_bid, best_ask = book.best(BUY), book.best(SELL)
+    return get_market_stats(group.subsession).snapshot(
+        best_bid.price if best_bid is not None else None,
+        best_ask.price if best_ask is not None else None,
+    )
+
+def trade_history_window(subsession: BaseSubsession) -> Dict[str, Any]:
+    """
+    公開狀態中的成交紀錄：最近 trade_history_limit 筆與往前翻頁的游標
+    
+    買入 / 賣出由用戶端以自己的 id 比對 buyer_id / seller_id，伺服器不逐玩家標記。
+    
+    Returns:
+        {'trade_history': 最近成交, 'trade_history_limit': 筆數上限,
+         'trade_history_cursor': 第一筆的序號（0 表示沒有更早的成交）}
+    """
+    journal = get_trade_journal(subsession)
+    limit = config.trade_history_limit
+    trades = journal.tail(limit)
+    return {
+        'trade_history': trades,
+        'trade_history_limit': limit,
+        'trade_history_cursor': len(journal) - len(trades),
+    }
+
+def trade_history_page(subsession: BaseSubsession, before: Any) -> Dict[str, Any]:
+    """
+    回應用戶端的 trade_history 請求：游標之前的一頁成交
+    
+    Args:
+        subsession: 子會話物件
+        before: 用戶端目前最早一筆成交的序號（無效時從最新一筆往前）
         
-        if old_count > 0:
-            print(f"已自動取消玩家 {player_id} 的 {old_count} 筆{order_type}單")
-    except json.JSONDecodeError:
-        print(f"解析{order_type}單列表時發生錯誤")
-    except Exception as e:
-        print(f"取消訂單時發生錯誤: {e}")
+    Returns:
+        {'type': 'trade_page', 'before': 游標, 'trades': 成交（舊到新）, 'cursor': 這一頁第一筆的序號}
+    """
+    journal = get_trade_journal(subsession)
+    try:
+        before = int(before)
+    except (TypeError, ValueError):
+        before = len(journal)
+    trades, cursor = journal.page(before, config.trade_history_limit)
+    return {'type': 'trade_page', 'before': before, 'trades': trades, 'cursor': cursor}
+
+# 市場狀態：公開部分（掛單簿、成交紀錄、價格歷史）對所有玩家相同，
+# 每個組別依訂單簿的顯示版本、成交筆數與價格歷史長度快取一份；每位玩家只另外計算私人部分。
+# 只影響較深掛單的變動不會改變顯示版本，公開狀態不重建，也不會廣播給其他玩家。
+_PUBLIC_STATES: Dict[Tuple[str, int, str], Tuple[Tuple, Dict[str, Any]]] = {}
 
+def public_market_state(
+    group: BaseGroup,
+    build: Callable[[BaseGroup], Dict[str, Any]]
+) -> Dict[str, Any]:
+    """
+    取得組別的公開市場狀態，市場沒有變動時直接回傳快取
+    
+    Args:
+        group: 組別物件
+        build: 由組別建立公開狀態的函數（各 app 的 TradingMarket.public_state）
+        
+    Returns:
+        公開狀態 dict（共用物件，呼叫端不應修改）
+    """
+    key = _order_book_key(group)
+    book = get_order_book(group)
+    subsession = group.subsession
+    version = (
+        id(book), book.display_version,
+        len(get_trade_journal(subsession)),
+        len(get_market_stats(subsession).price_history),
+    )
+    cached = _PUBLIC_STATES.get(key)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+    state = build(group)
+    _PUBLIC_STATES[key] = (version, state)
+    return state
+
+# 每個組別的公開市場序號與增量
+_MARKET_FEEDS: Dict[Tuple[str, int, str], MarketFeed] = {}
+
+def get_market_feed(group: BaseGroup) -> MarketFeed:
+    """取得組別的市場增量序號（伺服器重啟後從 0 開始，用戶端會因序號不連續而要求快照）"""
+    key = _order_book_key(group)
+    feed = _MARKET_FEEDS.get(key)
+    if feed is None:
+        feed = _MARKET_FEEDS[key] = MarketFeed()
+    return feed
+
+def ping_version(data: Optional[Dict[str, Any]]) -> Optional[Tuple[Any, Any]]:
+    """取出 ping 訊息中用戶端已套用的 (epoch, seq)；沒有時回傳 None（需要完整快照）"""
+    if not data or data.get('epoch') is None or data.get('seq') is None:
+        return None
+    return (data['epoch'], data['seq'])
 
-def parse_orders(group: BaseGroup) -> Tuple[List[List], List[List]]:
+def market_updates(
+    group: BaseGroup,
+    build_public: Callable[[BaseGroup], Dict[str, Any]],
+    build_private: Callable[[BasePlayer], Dict[str, Any]],
+    result: Optional[Dict[str, Any]] = None,
+    player: Optional[BasePlayer] = None,
+    snapshot: bool = False,
+    client_version: Optional[Tuple[Any, Any]] = None,
+    now: Optional[float] = None
+) -> Dict[int, Dict[str, Any]]:
     """
-    解析買賣訂單
+    組合 live_method 回傳的市場更新
+    
+    - 公開狀態有變動時，所有玩家收到帶序號的增量 {'type': 'delta', 'epoch', 'seq', 'market'}
+    - 掛單、現金或持有量有變動的玩家（與發出請求的玩家）另外附上私人狀態
+    - snapshot=True 時，發出請求的玩家收到完整快照 {'type': 'update', 'epoch', 'seq', ...}；
+      若 client_version 與目前版本相同，只回傳私人狀態 {'type': 'unchanged', 'epoch', 'seq', ...}
+    - 沒有任何變動的玩家不會收到訊息
+    - 集合競價模式只在每期撮合後（result 含 'auction'）公開市場增量，期間只更新私人狀態
+    - 設定合併時間窗時，上次廣播後時間窗內的公開變動先不送出（變動已生效，只延後廣播），
+      收到私人狀態的玩家附上 flush_in（毫秒），用戶端屆時 ping 一次，由該次請求送出合併後的增量
     
     Args:
         group: 組別物件
+        build_public: 建立公開狀態的函數
+        build_private: 建立玩家私人狀態的函數
+        result: process_new_order / process_accept_offer / process_commands 的回傳結果
+        player: 發出請求的玩家
+        snapshot: 是否回傳完整快照給發出請求的玩家
+        client_version: 用戶端回報已套用的 (epoch, seq)，見 ping_version
+        now: 目前時間（秒），預設為 time.time()
         
     Returns:
-        (買單列表, 賣單列表)
+        {id_in_group: 訊息}
     """
-    try:
-        buy_orders = json.loads(group.buy_orders)
-    except (json.JSONDecodeError, AttributeError):
-        buy_orders = []
-        group.buy_orders = json.dumps(buy_orders)
+    public = public_market_state(group, build_public)
+    feed = get_market_feed(group)
+    journal = get_trade_journal(group.subsession)
+    now = time.time() if now is None else now
+    window = coalesce_window(group)
+    flush_in = None
+    if is_batch_auction(group) and 'auction' not in (result or {}):
+        # 集合競價期間掛單不公開：所有玩家看到的是上一期結束時的公開狀態
+        delta = None
+        if feed.published is None:
+            feed.mark_published(public, journal)
+        public = feed.published
+    elif (window and feed.published is not None and now - feed.last_broadcast < window
+            and feed.has_changes(public, journal)):
+        # 時間窗內延後廣播：快照也使用上次送出的公開狀態，之後的增量才能接續套用
+        delta = None
+        feed.fanout['coalesced'] += 1
+        flush_in = max(round((feed.last_broadcast + window - now) * 1000), 1)
+        public = feed.published
+    else:
+        delta = feed.publish(public, journal)
+        if delta is not None:
+            feed.last_broadcast = now
+    
+    notifications = (result or {}).get('notifications') or {}
+    notification_types = (result or {}).get('notification_types') or {}
+    default_type = 'error' if (result or {}).get('type') == 'fail' else 'success'
+    requester_id = player.id_in_group if player is not None else None
+    
+    affected = get_order_book(group).drain_touched_players()
+    affected.update(trade_parties(delta))
+    affected.update(notifications)
+    if requester_id is not None:
+        affected.add(requester_id)
+    
+    version = {'epoch': feed.epoch, 'seq': feed.seq}
+    unchanged = snapshot and client_version is not None and feed.is_current(*client_version)
     
+    updates = {}
+    for p in group.get_players():
+        pid = p.id_in_group
+        if snapshot and pid == requester_id:
+            if unchanged:
+                state = {**build_private(p), 'type': 'unchanged', **version}
+            else:
+                state = {**public, **build_private(p), **version}
+        elif pid in affected:
+            state = {**build_private(p), 'type': 'delta', **version}
+            if delta:
+                state['market'] = delta
+        elif delta:
+            state = {'type': 'delta', **version, 'market': delta}
+        else:
+            continue
+        if flush_in is not None:
+            state['flush_in'] = flush_in
+        if pid in notifications:
+            state['notification'] = {
+                'type': notification_types.get(pid, default_type),  # 前端會將 error 轉換為 danger
+                'message': notifications[pid]
+            }
+        updates[pid] = state
+    feed.record_fanout(len(updates), broadcast=delta is not None)
+    return updates
+
+# 指令佇列：每個組別的下單 / 接受 / 取消指令依到達順序排入佇列，
+# 每次處理時依序執行佇列中所有指令，最後只產生一次合併的市場更新。
+_COMMAND_QUEUES: Dict[Tuple[str, int, str], Deque[Tuple[int, Dict[str, Any]]]] = {}
+
+def enqueue_command(group: BaseGroup, player: BasePlayer, data: Dict[str, Any]) -> None:
+    """將玩家的交易指令排入組別的指令佇列"""
+    queue = _COMMAND_QUEUES.setdefault(_order_book_key(group), deque())
+    queue.append((player.id_in_group, data))
+
+def _merge_result(combined: Dict[str, Any], result: Dict[str, Any]) -> None:
+    """將單一結果的通知併入合併結果；同一次處理中收到多則通知時依序串接"""
+    notification_type = 'error' if result.get('type') == 'fail' else 'success'
+    for pid, message in (result.get('notifications') or {}).items():
+        previous = combined['notifications'].get(pid)
+        combined['notifications'][pid] = f"{previous}；{message}" if previous else message
+        combined['notification_types'][pid] = notification_type
+
+def process_commands(
+    group: BaseGroup,
+    apply: Callable[[BasePlayer, Dict[str, Any]], Optional[Dict[str, Any]]],
+    clear_auction: Optional[Callable[[BaseGroup], Optional[Dict[str, Any]]]] = None
+) -> Dict[str, Any]:
+    """
+    依序執行組別佇列中的所有指令並合併結果
+    
+    Args:
+        group: 組別物件
+        apply: 執行單一指令的函數（各 app 的 TradingMarket.apply_command），
+               回傳 process_new_order 格式的結果或 None
+        clear_auction: 集合競價到期時撮合的函數（見 run_batch_auction），在佇列處理完後呼叫
+        
+    Returns:
+        {'type', 'commands', 'notifications': {玩家: 訊息}, 'notification_types': {玩家: 'success' / 'error'}}；
+        本次有集合競價撮合時另含 'auction'
+    """
+    queue = _COMMAND_QUEUES.get(_order_book_key(group))
+    combined: Dict[str, Any] = {
+        'type': 'batch', 'commands': 0, 'notifications': {}, 'notification_types': {}
+    }
+    # 整個處理過程的成交在結束時一次結算
+    with settlement_pass(group):
+        while queue:
+            player_id, data = queue.popleft()
+            result = apply(group.get_player_by_id(player_id), data) or {}
+            combined['commands'] += 1
+            _merge_result(combined, result)
+        
+        auction = clear_auction(group) if clear_auction is not None else None
+    if auction is not None:
+        _merge_result(combined, auction)
+        combined['auction'] = auction['auction']
+    return combined
+
+# 成交結算：每個組別目前進行中的結算（只在 settlement_pass 期間存在）
+_SETTLEMENTS: Dict[Tuple[str, int, str], Settlement] = {}
+
+@contextmanager
+def settlement_pass(group: BaseGroup) -> Iterator[Settlement]:
+    """
+    在一次處理期間累積成交的餘額、統計與成交紀錄，結束時一次寫回
+    
+    巢狀呼叫沿用外層的結算；最外層結束（包含發生例外）時寫回，訂單簿與餘額保持一致。
+    """
+    key = _order_book_key(group)
+    settlement = _SETTLEMENTS.get(key)
+    if settlement is not None:
+        yield settlement
+        return
+    settlement = _SETTLEMENTS[key] = Settlement()
     try:
-        sell_orders = json.loads(group.sell_orders)
-    except (json.JSONDecodeError, AttributeError):
-        sell_orders = []
-        group.sell_orders = json.dumps(sell_orders)
+        yield settlement
+    finally:
+        del _SETTLEMENTS[key]
+        settlement.apply()
+        for trade in settlement.trades:
+            append_trade(group.subsession, trade)
+
+def settled_value(player: BasePlayer, field: str) -> Any:
+    """玩家欄位目前的值，包含進行中結算尚未寫回的變動"""
+    value = getattr(player, field)
+    if _SETTLEMENTS:
+        settlement = _SETTLEMENTS.get(_order_book_key(player.group))
+        if settlement is not None:
+            value += settlement.pending(player.id_in_group, field)
+    return value
+
+# ========== 集合競價 ==========
+
+def market_mode(group: BaseGroup) -> str:
+    """組別的市場機制（session config 優先於 experiment_config.yaml）"""
+    return group.session.config.get('market_mode', config.market_mode)
+
+def is_batch_auction(group: BaseGroup) -> bool:
+    """組別是否採集合競價"""
+    return market_mode(group) == 'batch_auction'
+
+def market_tick_ms(group: BaseGroup) -> int:
+    """用戶端定時 ping 的間隔（毫秒）；集合競價模式需每期 ping 一次以觸發撮合"""
+    if is_batch_auction(group):
+        interval = group.session.config.get('batch_auction_interval', config.batch_auction_interval)
+        return int(float(interval) * 1000)
+    return 15000
+
+def coalesce_window(group: BaseGroup) -> float:
+    """組別合併市場廣播的時間窗（秒）；集合競價模式每期只廣播一次，不需合併"""
+    if is_batch_auction(group):
+        return 0.0
+    return float(group.session.config.get('coalesce_window_ms', config.coalesce_window_ms)) / 1000
+
+# 每個組別的訊息頻率限制
+_RATE_LIMITERS: Dict[Tuple[str, int, str], RateLimiter] = {}
+
+# 唯讀查詢歸入 ping 類，其餘（下單、接受、修改、取消）歸入 order 類
+_READ_ONLY_MESSAGES = ('ping', 'trade_history')
+
+def get_rate_limiter(group: BaseGroup) -> RateLimiter:
+    """取得組別的訊息頻率限制（集合競價模式放寬 ping 至每期至少兩次）"""
+    key = _order_book_key(group)
+    limiter = _RATE_LIMITERS.get(key)
+    if limiter is None:
+        limits = config.rate_limits
+        if is_batch_auction(group) and 'ping' in limits:
+            rate, burst = limits['ping']
+            limits['ping'] = (max(rate, 2000 / market_tick_ms(group)), burst)
+        limiter = _RATE_LIMITERS[key] = RateLimiter(limits)
+    return limiter
+
+def check_rate_limit(
+    group: BaseGroup,
+    player: BasePlayer,
+    data: Optional[Dict[str, Any]],
+    now: Optional[float] = None
+) -> Optional[Dict[int, Dict[str, Any]]]:
+    """
+    在 live_method 處理訊息前檢查頻率限制
+    
+    Args:
+        group: 組別物件
+        player: 發出訊息的玩家
+        data: live 訊息（None 視為 ping）
+        now: 目前時間（秒），預設為 time.time()
+        
+    Returns:
+        None 表示可處理；超量時回傳 live_method 應直接回傳的結果：
+        ping 為 {}（丟棄），交易指令為只給該玩家的拒絕通知
+    """
+    message_type = (data or {}).get('type', 'ping')
+    category = 'ping' if message_type in _READ_ONLY_MESSAGES else 'order'
+    now = time.time() if now is None else now
+    if get_rate_limiter(group).allow(player.id_in_group, category, now):
+        return None
+    if category == 'ping':
+        return {}
+    # 沿用目前的序號，用戶端當作只含通知的私人更新套用
+    feed = get_market_feed(group)
+    return {player.id_in_group: {
+        'type': 'delta', 'epoch': feed.epoch, 'seq': feed.seq,
+        'notification': {'type': 'error', 'message': '操作過於頻繁，請稍後再試'},
+    }}
+
+# 每個組別的集合競價時鐘
+_AUCTION_CLOCKS: Dict[Tuple[str, int, str], AuctionClock] = {}
+
+def run_batch_auction(
+    group: BaseGroup,
+    item_name: str = "物品",
+    item_field: str = 'current_items',
+    now: Optional[float] = None
+) -> Optional[Dict[str, Any]]:
+    """
+    集合競價模式下，本期結束時撮合累積的掛單
     
-    return buy_orders, sell_orders
+    Args:
+        group: 組別物件
+        item_name: 物品名稱
+        item_field: 物品欄位名稱
+        now: 目前時間（秒），預設為 time.time()
+        
+    Returns:
+        clear_batch_auction 的結果；非集合競價模式或本期尚未結束時為 None
+    """
+    if not is_batch_auction(group):
+        return None
+    now = time.time() if now is None else now
+    key = _order_book_key(group)
+    clock = _AUCTION_CLOCKS.get(key)
+    if clock is None:
+        interval = group.session.config.get('batch_auction_interval', config.batch_auction_interval)
+        clock = _AUCTION_CLOCKS[key] = AuctionClock(float(interval), now)
+    if not clock.due(now):
+        return None
+    result = clear_batch_auction(group, item_name, item_field)
+    clock.advance(now)
+    return result
 
-def save_orders(group: BaseGroup, buy_orders: List[List], sell_orders: List[List]) -> None:
-    """儲存買賣訂單"""
-    group.buy_orders = json.dumps(buy_orders)
-    group.sell_orders = json.dumps(sell_orders)
+def _overcommitted_sells(
+    group: BaseGroup,
+    fills: List[Tuple[Order, int]],
+    item_field: str
+) -> List[Order]:
+    """分配到的賣出總量超過持有量的賣單（依優先順序，超出後的掛單皆列入）"""
+    allotted: Dict[int, int] = {}
+    stale = []
+    for order, quantity in fills:
+        total = allotted.get(order.player_id, 0) + quantity
+        if total > settled_value(group.get_player_by_id(order.player_id), item_field):
+            stale.append(order)
+        else:
+            allotted[order.player_id] = total
+    return stale
+
+def clear_batch_auction(
+    group: BaseGroup,
+    item_name: str = "物品",
+    item_field: str = 'current_items'
+) -> Dict[str, Any]:
+    """
+    以單一清算價撮合訂單簿中所有可成交的掛單
+    
+    清算價使成交量最大（見 utils.call_auction.clearing_price），所有成交都以清算價結算，
+    依價格優先、時間優先分配，邊際掛單部分成交、剩餘數量繼續掛單。
+    賣方持有量已不足的賣單視為失效並移除後重新計算。
+    成交後沿用「取消雙方其他同方向訂單」的規則（部分成交的剩餘掛單保留）。
+    掛單時已拒絕與自己對向掛單交叉的訂單（見 _order_error）；掛單只扣減實際成交的數量。
+    
+    Args:
+        group: 組別物件
+        item_name: 物品名稱
+        item_field: 物品欄位名稱
+        
+    Returns:
+        {'type': 'auction_cleared', 'auction': {'price', 'volume'} 或 None, 'notifications'}
+    """
+    book = get_order_book(group)
+    
+    while True:
+        cleared = clearing_price(book.depth(BUY), book.depth(SELL))
+        if cleared is None:
+            save_order_book(group, book)
+            print("集合競價：買賣價格沒有交叉，本期無成交")
+            return {'type': 'auction_cleared', 'update_all': True, 'auction': None, 'notifications': {}}
+        price, volume = cleared
+        sell_fills = allocate(book.orders_through(SELL, price), volume)
+        stale = _overcommitted_sells(group, sell_fills, item_field)
+        if not stale:
+            break
+        for order in stale:
+            book.remove(order.order_id)
+            print(f"移除失效賣單: 玩家{order.player_id} 持有量不足 {order.quantity}")
+    
+    buy_fills = allocate(book.orders_through(BUY, price), volume)
+    bought: Dict[int, int] = {}
+    sold: Dict[int, int] = {}
+    filled: Dict[int, int] = {}  # order_id → 實際成交數量
+    # 同一期的所有成交一次結算
+    with settlement_pass(group):
+        for buy_order, sell_order, quantity in pair_fills(buy_fills, sell_fills):
+            if buy_order.player_id == sell_order.player_id:
+                continue  # 不會發生（掛單時已拒絕），不成交也不扣減掛單
+            buyer = group.get_player_by_id(buy_order.player_id)
+            seller = group.get_player_by_id(sell_order.player_id)
+            execute_trade(group, buyer, seller, price, quantity, item_field)
+            bought[buyer.id_in_group] = bought.get(buyer.id_in_group, 0) + quantity
+            sold[seller.id_in_group] = sold.get(seller.id_in_group, 0) + quantity
+            for order in (buy_order, sell_order):
+                filled[order.order_id] = filled.get(order.order_id, 0) + quantity
+    
+    for order_id, quantity in filled.items():
+        book.reduce(order_id, quantity)
+    
+    # 邊際掛單可能只部分成交，剩餘數量保留
+    for direction, fills, traders in ((BUY, buy_fills, bought), (SELL, sell_fills, sold)):
+        keep_order_id = fills[-1][0].order_id
+        for pid in traders:
+            book.cancel_player(pid, direction, keep_order_id=keep_order_id)
+    save_order_book(group, book)
+    
+    notifications: Dict[int, str] = {}
+    for traders, action in ((bought, '買入'), (sold, '賣出')):
+        for pid, quantity in traders.items():
+            message = f'集合競價成交：您以價格 {price} {action}了 {quantity} 個{item_name}'
+            previous = notifications.get(pid)
+            notifications[pid] = f"{previous}；{message}" if previous else message
+    
+    traded = sum(bought.values())
+    print(f"集合競價：清算價 {price}，成交量 {traded}")
+    return {
+        'type': 'auction_cleared',
+        'update_all': True,
+        'auction': {'price': price, 'volume': traded},
+        'notifications': notifications
+    }
 
 def check_duplicate_order(
     orders: List[List],
@@ -208,7 +924,8 @@ def validate_order(
     direction: str, 
     price: int, 
     quantity: int,
-    item_name: str = "物品"
+    item_name: str = "物品",
+    reserved: int = 0
 ) -> None:
     """
     驗證訂單有效性
@@ -219,25 +936,34 @@ def validate_order(
         price: 價格
         quantity: 數量
         item_name: 物品名稱
+        reserved: 賣單時，其他賣單已承諾賣出的數量（不可再用於這筆賣單）
         
     Raises:
-        InvalidOrderError: 訂單無效
+        InvalidOrderError: 訂單無效（含方向不是 buy / sell）
         InsufficientResourcesError: 資源不足
     """
+    if direction not in ('buy', 'sell'):
+        raise InvalidOrderError('掛單方向錯誤')
     if price <= 0 or quantity <= 0:
         raise InvalidOrderError("價格和數量必須大於0")
     
     if direction == 'sell':
-        # 檢查賣單數量不超過持有量
-        if hasattr(player, 'current_items') and quantity > player.current_items:
+        # 檢查賣單數量不超過持有量（扣除其他賣單已承諾的數量）
+        if hasattr(player, 'current_items'):
+            holdings = settled_value(player, 'current_items')
+        elif hasattr(player, 'current_permits'):
+            holdings = settled_value(player, 'current_permits')
+        else:
+            return
+        if reserved and quantity > holdings - reserved:
             raise InsufficientResourcesError(
-                f'單次賣單數量不能超過持有的{item_name}！'
-                f'您要賣出 {quantity} 個{item_name}，但您只有 {player.current_items} 個{item_name}'
+                f'賣單數量不能超過可用的{item_name}！'
+                f'您要賣出 {quantity} 個{item_name}，但您持有的 {holdings} 個中已有 {reserved} 個在其他賣單中'
             )
-        elif hasattr(player, 'current_permits') and quantity > player.current_permits:
+        if quantity > holdings:
             raise InsufficientResourcesError(
                 f'單次賣單數量不能超過持有的{item_name}！'
-                f'您要賣出 {quantity} 個{item_name}，但您只有 {player.current_permits} 個{item_name}'
+                f'您要賣出 {quantity} 個{item_name}，但您只有 {holdings} 個{item_name}'
             )
 
 def find_matching_orders(
@@ -304,55 +1030,79 @@ def execute_trade(
     """
     # 確保價格為整數
     price = int(price)
+    amount = price * quantity
     
-    # 更新現金
-    buyer.current_cash -= price * quantity
-    seller.current_cash += price * quantity
-    
-    # 更新物品數量
-    current_buyer_items = getattr(buyer, item_field)
-    current_seller_items = getattr(seller, item_field)
-    setattr(buyer, item_field, current_buyer_items + quantity)
-    setattr(seller, item_field, current_seller_items - quantity)
-    
-    # 更新統計數據
-    if hasattr(buyer, 'total_bought'):
-        buyer.total_bought += quantity
-        buyer.total_spent += price * quantity
-    if hasattr(seller, 'total_sold'):
-        seller.total_sold += quantity
-        seller.total_earned += price * quantity
-    
-    # 記錄成交訂單到 subsession
-    try:
-        executed_trades = json.loads(group.subsession.executed_trades)
-    except (json.JSONDecodeError, AttributeError):
-        executed_trades = []
-    
-    # 計算時間戳（格式：MM:SS）
-    current_time = int(time.time())
-    if hasattr(group.subsession, 'start_time') and group.subsession.start_time:
-        elapsed_seconds = current_time - group.subsession.start_time
-        minutes = elapsed_seconds // 60
-        seconds = elapsed_seconds % 60
-        timestamp = f"{minutes:02d}:{seconds:02d}"
-    else:
-        timestamp = "00:00"
+    # 現金、物品數量與統計數據先記入結算，處理結束時每個欄位只寫入一次
+    with settlement_pass(group) as settlement:
+        settlement.add(buyer, 'current_cash', -amount)
+        settlement.add(seller, 'current_cash', amount)
+        settlement.add(buyer, item_field, quantity)
+        settlement.add(seller, item_field, -quantity)
+        if hasattr(buyer, 'total_bought'):
+            settlement.add(buyer, 'total_bought', quantity)
+            settlement.add(buyer, 'total_spent', amount)
+        if hasattr(seller, 'total_sold'):
+            settlement.add(seller, 'total_sold', quantity)
+            settlement.add(seller, 'total_earned', amount)
+        
+        # 成交紀錄於結算時依序追加到 subsession 的成交日誌
+        settlement.trades.append({
+            'timestamp': _calculate_timestamp(group.subsession),  # MM:SS 格式
+            'buyer_id': buyer.id_in_group,
+            'seller_id': seller.id_in_group,
+            'price': price,  # 已經轉換為整數
+            'quantity': int(quantity)
+        })
     
-    # 創建成交記錄
-    executed_trade = {
-        'timestamp': timestamp,  # MM:SS 格式
-        'buyer_id': buyer.id_in_group,
-        'seller_id': seller.id_in_group,
-        'price': price,  # 已經轉換為整數
-        'quantity': int(quantity)
+    print(f"成功交易: 買方{buyer.id_in_group} <- 賣方{seller.id_in_group}, "
+          f"價格{price}, 數量{quantity}")
+
+def _trade_notifications(
+    buyer_id: int,
+    seller_id: int,
+    price: int,
+    quantity: int,
+    item_name: str
+) -> Dict[int, str]:
+    """交易成功時給買賣雙方的通知訊息"""
+    return {
+        buyer_id: f'交易成功：您以價格 {price} 買入了 {quantity} 個{item_name}',
+        seller_id: f'交易成功：您以價格 {price} 賣出了 {quantity} 個{item_name}',
     }
+
+def _order_error(
+    player: BasePlayer,
+    book: OrderBook,
+    direction: str,
+    price: int,
+    quantity: int,
+    item_name: str,
+    pending: int = 0
+) -> Optional[str]:
+    """
+    檢查新訂單（有效性與重複掛單），回傳錯誤訊息；可下單時為 None
     
-    executed_trades.append(executed_trade)
-    group.subsession.executed_trades = json.dumps(executed_trades)
+    trading_engine.reserve_sell_orders 開啟時，賣單可用數量為持有量扣除鎖定帳中已掛出的賣單數量；
+    pending 為尚未反映在鎖定帳中的調整（批次中先前的賣單、或修改中的掛單原數量的負值）。
+    重複掛單規則只在送出 / 修改時檢查：部分成交後的剩餘數量可能與其他掛單的方向、價格與數量相同，
+    仍保留原掛單（見 _sweep_book 與 OrderBook.reduce）。
+    """
+    reserved = 0
+    if direction == SELL and config.reserve_sell_orders:
+        reserved = book.locked_quantity(player.id_in_group, SELL) + pending
+    try:
+        validate_order(player, direction, price, quantity, item_name, reserved)
+    except TradingError as e:
+        return str(e)
     
-    print(f"成功交易: 買方{buyer.id_in_group} <- 賣方{seller.id_in_group}, "
-          f"價格{price}, 數量{quantity}")
+    side_name = '買單' if direction == 'buy' else '賣單'
+    if book.has_order_at(direction, price, quantity):
+        return f'市場上已有價格 {price} 且數量 {quantity} 的{side_name}！'
+    # 連續交易會跳過自己的掛單；集合競價以總量清算，與自己的對向掛單交叉時會自我配對
+    if is_batch_auction(player.group) and book.crosses_own(direction, player.id_in_group, price):
+        other_side = '賣單' if direction == 'buy' else '買單'
+        return f'集合競價中，{side_name}價格不能與您自己的{other_side}交叉'
+    return None
 
 def process_new_order(
     player: BasePlayer,
@@ -378,136 +1128,454 @@ def process_new_order(
     Returns:
         需要廣播給所有玩家的狀態更新
     """
-    # 驗證訂單
-    try:
-        validate_order(player, direction, price, quantity, item_name)
-    except TradingError as e:
+    book = get_order_book(group)
+    
+    # 驗證訂單與檢查重複訂單
+    error = _order_error(player, book, direction, price, quantity, item_name)
+    if error is not None:
         return {
             'type': 'fail',
             'notifications': {
-                player.id_in_group: str(e)
+                player.id_in_group: error
             }
         }
     
-    # 解析現有訂單
-    buy_orders, sell_orders = parse_orders(group)
+    result = _place_order(player, group, book, direction, price, quantity, item_name, item_field)
+    save_order_book(group, book)
+    return result
+
+def _place_order(
+    player: BasePlayer,
+    group: BaseGroup,
+    book: OrderBook,
+    direction: str,
+    price: int,
+    quantity: int,
+    item_name: str,
+    item_field: str
+) -> Dict[str, Any]:
+    """
+    撮合或掛出一筆已通過驗證的訂單（不寫回資料庫快照，由呼叫端統一寫入）
     
-    # 檢查重複訂單
-    if direction == 'buy':
-        if check_duplicate_order(buy_orders, price, quantity):
-            return {
-                'type': 'fail',
-                'notifications': {
-                    player.id_in_group: f'市場上已有價格 {price} 且數量 {quantity} 的買單！'
-                }
+    Returns:
+        process_new_order 格式的結果
+    """
+    # 移除：不再自動取消之前的同方向訂單，允許掛多個買單/賣單
+    
+    if is_batch_auction(group):
+        # 集合競價：只掛單，等本期結束時以清算價統一撮合
+        book.add(player.id_in_group, direction, price, quantity)
+        print(f"集合競價掛單{direction}: 玩家{player.id_in_group}, 價格{price}, 數量{quantity}")
+        return {
+            'type': 'order_added',
+            'update_all': True,
+            'notifications': {
+                player.id_in_group: '掛單已送出，將於本期集合競價結束時撮合'
             }
-    else:  # sell
-        if check_duplicate_order(sell_orders, price, quantity):
+        }
+    
+    if config.matching_mode == 'partial_fill':
+        return _process_partial_fill_order(
+            player, group, book, direction, price, quantity, item_name, item_field
+        )
+    
+    # 尋找最佳的對手掛單（買單找最低賣價，賣單找最高買價）
+    best_order = book.find_match(direction, player.id_in_group, price, quantity)
+    
+    if best_order is not None:
+        counterpart_id = best_order.player_id
+        try:
+            counterpart = group.get_player_by_id(counterpart_id)
+            trade_price = best_order.price
+            if direction == 'buy':
+                buyer, seller = player, counterpart
+            else:
+                buyer, seller = counterpart, player
+            execute_trade(group, buyer, seller, trade_price, quantity, item_field)
+            
+            # 保留：交易成功時取消雙方其他訂單（已成交的對手掛單也一併移除）
+            book.cancel_player(buyer.id_in_group, 'buy')
+            book.cancel_player(seller.id_in_group, 'sell')
+            
             return {
-                'type': 'fail',
-                'notifications': {
-                    player.id_in_group: f'市場上已有價格 {price} 且數量 {quantity} 的賣單！'
-                }
+                'type': 'trade_executed', 
+                'update_all': True,
+                'notifications': _trade_notifications(
+                    buyer.id_in_group, seller.id_in_group, trade_price, quantity, item_name
+                )
             }
+            
+        except Exception as e:
+            print(f"交易執行失敗: {e}")
+            # 繼續添加訂單
     
-    # 移除：不再自動取消之前的同方向訂單，允許掛多個買單/賣單
-    # cancel_player_orders(group, player.id_in_group, direction)
+    # 沒有匹配或執行失敗，添加新掛單
+    book.add(player.id_in_group, direction, price, quantity)
     
-    # 尋找匹配的訂單
-    if direction == 'buy':
-        matching_orders = find_matching_orders(
-            sell_orders, player.id_in_group, price, quantity, True
-        )
+    print(f"成功添加{direction}單: 玩家{player.id_in_group}, 價格{price}, 數量{quantity}")
+    return {'type': 'order_added', 'update_all': True}
+
+def _process_partial_fill_order(
+    player: BasePlayer,
+    group: BaseGroup,
+    book: OrderBook,
+    direction: str,
+    price: int,
+    quantity: int,
+    item_name: str,
+    item_field: str
+) -> Dict[str, Any]:
+    """
+    跨數量部分成交模式：依價格優先掃過可成交的對手掛單，剩餘數量繼續掛單
+    
+    每筆成交仍沿用「成交後取消雙方其他同方向訂單」的規則，
+    但正在成交的對手掛單與新訂單本身的剩餘數量會保留。
+    重複掛單規則不適用於剩餘數量：剩餘數量即使與其他掛單的方向、價格與數量相同也照常保留。
+    
+    Args:
+        player: 玩家物件
+        group: 組別物件
+        book: 組別的訂單簿
+        direction: 'buy' 或 'sell'
+        price: 限價
+        quantity: 數量
+        item_name: 物品名稱
+        item_field: 物品欄位名稱
         
-        if matching_orders:
-            # 找到最低價格的匹配賣單
-            best_idx, best_order = min(matching_orders, key=lambda x: float(x[1][1]))
-            seller_id = int(best_order[0])
-            
-            try:
-                seller = group.get_player_by_id(seller_id)
-                trade_price = int(float(best_order[1]))  # 確保交易價格為整數
-                execute_trade(group, player, seller, trade_price, quantity, item_field)
-                
-                # 保留：交易成功時取消雙方其他訂單
-                cancel_player_orders(group, player.id_in_group, 'buy')
-                cancel_player_orders(group, seller_id, 'sell')
-                
-                # 從賣單列表移除已成交的訂單
-                buy_orders, sell_orders = parse_orders(group)
-                sell_orders = [o for o in sell_orders if not (
-                    int(o[0]) == seller_id and 
-                    float(o[1]) == float(best_order[1]) and 
-                    int(o[2]) == int(best_order[2])
-                )]
-                save_orders(group, buy_orders, sell_orders)
-                
-                # 修改：添加自動交易成功通知，價格顯示為整數
-                return {
-                    'type': 'trade_executed', 
-                    'update_all': True,
-                    'notifications': {
-                        player.id_in_group: f'交易成功：您以價格 {trade_price} 買入了 {quantity} 個{item_name}',
-                        seller_id: f'交易成功：您以價格 {trade_price} 賣出了 {quantity} 個{item_name}'
-                    }
-                }
-                
-            except Exception as e:
-                print(f"交易執行失敗: {e}")
-                # 繼續添加訂單
-        
-        # 沒有匹配或執行失敗，添加新買單
-        buy_orders.append([player.id_in_group, price, quantity])
-        save_orders(group, buy_orders, sell_orders)
-        
-    else:  # sell
-        matching_orders = find_matching_orders(
-            buy_orders, player.id_in_group, price, quantity, False
+    Returns:
+        需要廣播給所有玩家的狀態更新
+    """
+    player_id = player.id_in_group
+    fills, notifications, remaining = _sweep_book(
+        player, group, book, direction, price, quantity, item_name, item_field
+    )
+    
+    if remaining > 0:
+        book.add(player_id, direction, price, remaining)
+    
+    if not fills:
+        print(f"成功添加{direction}單: 玩家{player_id}, 價格{price}, 數量{quantity}")
+        return {'type': 'order_added', 'update_all': True}
+    
+    message = _fill_report(direction, fills, item_name)
+    if remaining > 0:
+        message += f'，剩餘 {remaining} 個已掛單'
+    notifications[player_id] = message
+    
+    return {
+        'type': 'trade_executed',
+        'update_all': True,
+        'notifications': notifications
+    }
+
+def _sweep_book(
+    player: BasePlayer,
+    group: BaseGroup,
+    book: OrderBook,
+    direction: str,
+    price: int,
+    quantity: int,
+    item_name: str,
+    item_field: str
+) -> Tuple[List[Tuple[int, int]], Dict[int, str], int]:
+    """
+    依價格優先吃掉限價內的對手掛單，直到數量用完或沒有可成交的掛單（不掛出剩餘數量）
+    
+    每筆成交仍沿用「成交後取消雙方其他同方向訂單」的規則，
+    但正在成交的對手掛單會保留剩餘數量（即使與其他掛單的方向、價格與數量相同，重複規則不適用於剩餘數量）。
+    
+    Returns:
+        (成交列表 [(價格, 數量)], 對手方的成交通知, 未成交數量)
+    """
+    player_id = player.id_in_group
+    remaining = quantity
+    fills: List[Tuple[int, int]] = []
+    notifications: Dict[int, str] = {}
+    
+    while remaining > 0:
+        resting = book.best_crossing(direction, player_id, price)
+        if resting is None:
+            break
+        
+        try:
+            counterpart = group.get_player_by_id(resting.player_id)
+        except Exception as e:
+            print(f"交易執行失敗: {e}")
+            break
+        
+        if direction == 'buy':
+            buyer, seller = player, counterpart
+        else:
+            buyer, seller = counterpart, player
+        
+        fill_quantity = min(remaining, resting.quantity)
+        if direction == 'buy' and settled_value(seller, item_field) < fill_quantity:
+            # 賣方持有量已不足以履行這筆賣單，視為失效掛單
+            book.remove(resting.order_id)
+            print(f"移除失效賣單: 玩家{seller.id_in_group} 持有量不足 {fill_quantity}")
+            continue
+        
+        trade_price = resting.price
+        try:
+            execute_trade(group, buyer, seller, trade_price, fill_quantity, item_field)
+        except Exception as e:
+            print(f"交易執行失敗: {e}")
+            break
+        
+        resting_id = resting.order_id
+        book.reduce(resting_id, fill_quantity)
+        book.cancel_player(resting.player_id, resting.direction, keep_order_id=resting_id)
+        if not fills:
+            book.cancel_player(player_id, direction)
+        
+        fills.append((trade_price, fill_quantity))
+        notifications[resting.player_id] = _trade_notifications(
+            buyer.id_in_group, seller.id_in_group, trade_price, fill_quantity, item_name
+        )[resting.player_id]
+        remaining -= fill_quantity
+    
+    return fills, notifications, remaining
+
+def _fill_report(direction: str, fills: List[Tuple[int, int]], item_name: str) -> str:
+    """多筆成交合併為一則給下單者的通知"""
+    action = '買入' if direction == 'buy' else '賣出'
+    details = '、'.join(f'{q} 個 @ {p}' for p, q in fills)
+    return f'交易成功：您共{action}了 {sum(q for _, q in fills)} 個{item_name}（{details}）'
+
+def process_sweep_order(
+    player: BasePlayer,
+    group: BaseGroup,
+    direction: str,
+    price: int,
+    quantity: int,
+    item_name: str = "物品",
+    item_field: str = 'current_items'
+) -> Dict[str, Any]:
+    """
+    掃單：一次吃掉限價內最佳的對手掛單，取代逐筆接受多筆掛單
+    
+    依價格優先成交至多 quantity 個，成交價為各對手掛單的價格；未成交的數量直接取消、不掛單。
+    所有成交在同一次結算中寫回，只回傳一則合併的成交通知與一次市場更新。
+    集合競價模式沒有逐筆成交，改以限價掛出訂單參加本期撮合。
+    
+    Args:
+        player: 玩家物件
+        group: 組別物件
+        direction: 'buy' 或 'sell'
+        price: 限價（買入時願付的最高價、賣出時可接受的最低價）
+        quantity: 最多成交的數量
+        item_name: 物品名稱
+        item_field: 物品欄位名稱
+        
+    Returns:
+        process_new_order 格式的結果
+    """
+    player_id = player.id_in_group
+    if direction not in (BUY, SELL):
+        return {'type': 'fail', 'notifications': {player_id: '掃單方向錯誤'}}
+    if is_batch_auction(group):
+        return process_new_order(player, group, direction, price, quantity, item_name, item_field)
+    
+    book = get_order_book(group)
+    reserved = 0
+    if direction == SELL and config.reserve_sell_orders:
+        reserved = book.locked_quantity(player_id, SELL)
+    try:
+        validate_order(player, direction, price, quantity, item_name, reserved)
+    except TradingError as e:
+        return {'type': 'fail', 'notifications': {player_id: str(e)}}
+    
+    with settlement_pass(group):
+        fills, notifications, remaining = _sweep_book(
+            player, group, book, direction, price, quantity, item_name, item_field
         )
+    save_order_book(group, book)
+    
+    if not fills:
+        return {
+            'type': 'fail',
+            'notifications': {
+                player_id: f'目前沒有價格 {price} 以內可成交的掛單'
+            }
+        }
+    
+    message = _fill_report(direction, fills, item_name)
+    if remaining > 0:
+        message += f'，其餘 {remaining} 個未成交已取消'
+    notifications[player_id] = message
+    print(f"玩家{player_id} 掃單{direction}: 限價{price}, 成交 {quantity - remaining}/{quantity} 個，共 {len(fills)} 筆")
+    
+    return {
+        'type': 'trade_executed',
+        'update_all': True,
+        'notifications': notifications
+    }
+
+def process_order_batch(
+    player: BasePlayer,
+    group: BaseGroup,
+    orders: List[Dict[str, Any]],
+    item_name: str = "物品",
+    item_field: str = 'current_items'
+) -> Dict[str, Any]:
+    """
+    一次送出多筆掛單（例如不同價位的掛單階梯）
+    
+    先驗證全部訂單（含批次內彼此重複），任何一筆無效時整批拒絕、不掛出任何訂單；
+    通過後依序撮合或掛出，每筆掛出前依當下的持有量再檢查一次（先前的賣單成交後持有量不足的賣單會略過），
+    最後只寫回一次訂單快照並回傳合併的結果。
+    
+    Args:
+        player: 玩家物件
+        group: 組別物件
+        orders: [{'direction', 'price', 'quantity'}, ...]，最多 trading_engine.max_batch_orders 筆
+        item_name: 物品名稱
+        item_field: 物品欄位名稱
         
-        if matching_orders:
-            # 找到最高價格的匹配買單
-            best_idx, best_order = max(matching_orders, key=lambda x: float(x[1][1]))
-            buyer_id = int(best_order[0])
-            
-            try:
-                buyer = group.get_player_by_id(buyer_id)
-                trade_price = int(float(best_order[1]))  # 確保交易價格為整數
-                execute_trade(group, buyer, player, trade_price, quantity, item_field)
-                
-                # 保留：交易成功時取消雙方其他訂單
-                cancel_player_orders(group, buyer_id, 'buy')
-                cancel_player_orders(group, player.id_in_group, 'sell')
-                
-                # 從買單列表移除已成交的訂單
-                buy_orders, sell_orders = parse_orders(group)
-                buy_orders = [o for o in buy_orders if not (
-                    int(o[0]) == buyer_id and 
-                    float(o[1]) == float(best_order[1]) and 
-                    int(o[2]) == int(best_order[2])
-                )]
-                save_orders(group, buy_orders, sell_orders)
-                
-                # 修改：添加自動交易成功通知，價格顯示為整數
-                return {
-                    'type': 'trade_executed', 
-                    'update_all': True,
-                    'notifications': {
-                        player.id_in_group: f'交易成功：您以價格 {trade_price} 賣出了 {quantity} 個{item_name}',
-                        buyer_id: f'交易成功：您以價格 {trade_price} 買入了 {quantity} 個{item_name}'
-                    }
-                }
-                
-            except Exception as e:
-                print(f"交易執行失敗: {e}")
-                # 繼續添加訂單
+    Returns:
+        process_new_order 格式的結果，通知為各筆結果的合併；
+        placed 為實際掛出或成交的訂單 [(direction, price, quantity), ...]（不含略過的訂單）
+    """
+    player_id = player.id_in_group
+    
+    def fail(message: str) -> Dict[str, Any]:
+        return {'type': 'fail', 'notifications': {player_id: message}}
+    
+    limit = config.max_batch_orders
+    if not orders:
+        return fail('沒有要送出的掛單')
+    if len(orders) > limit:
+        return fail(f'一次最多送出 {limit} 筆掛單')
+    
+    book = get_order_book(group)
+    parsed: List[Tuple[str, int, int]] = []
+    for i, order in enumerate(orders, 1):
+        try:
+            direction = order['direction']
+            price = int(order['price'])
+            quantity = int(order['quantity'])
+        except (KeyError, TypeError, ValueError):
+            return fail(f'第 {i} 筆掛單格式錯誤')
+        if direction not in (BUY, SELL):
+            return fail(f'第 {i} 筆掛單方向錯誤')
+        pending = sum(q for d, _, q in parsed if d == SELL)
+        error = _order_error(player, book, direction, price, quantity, item_name, pending)
+        if error is None and (direction, price, quantity) in parsed:
+            error = '批次中有重複的掛單'
+        if error is not None:
+            return fail(f'第 {i} 筆掛單：{error}')
+        parsed.append((direction, price, quantity))
+    
+    # 掛出前依目前（含本批先前成交後）的持有量再檢查一次：
+    # 先前的賣單成交後會取消玩家其他賣單，之後的賣單不能在沒有持有量的情況下掛出
+    results: List[Dict[str, Any]] = []
+    placed: List[Tuple[str, int, int]] = []
+    skipped: List[str] = []
+    for i, (direction, price, quantity) in enumerate(parsed, 1):
+        error = _order_error(player, book, direction, price, quantity, item_name)
+        if error is not None:
+            skipped.append(f'第 {i} 筆掛單未送出：{error}')
+            continue
+        results.append(
+            _place_order(player, group, book, direction, price, quantity, item_name, item_field)
+        )
+        placed.append((direction, price, quantity))
+    save_order_book(group, book)
+    
+    if is_batch_auction(group):
+        summary = f'已送出 {len(results)} 筆掛單，將於本期集合競價結束時撮合'
+    else:
+        summary = f'已送出 {len(results)} 筆掛單'
+    if skipped:
+        summary += '（' + '；'.join(skipped) + '）'
+    combined: Dict[str, Any] = {
+        'type': 'order_added',
+        'update_all': True,
+        'notifications': {player_id: summary},
+        'notification_types': {player_id: 'success'},
+        'placed': placed,
+    }
+    for result in results:
+        if result['type'] == 'trade_executed':
+            combined['type'] = 'trade_executed'
+            _merge_result(combined, result)
+    
+    print(f"玩家{player_id} 批次送出 {len(results)} 筆掛單，略過 {len(skipped)} 筆")
+    return combined
+
+def _would_match(book: OrderBook, direction: str, player_id: int, price: int, quantity: int) -> bool:
+    """依目前的撮合模式，訂單是否可立即成交"""
+    if config.matching_mode == 'partial_fill':
+        return book.best_crossing(direction, player_id, price) is not None
+    return book.find_match(direction, player_id, price, quantity) is not None
+
+def process_amend_order(
+    player: BasePlayer,
+    group: BaseGroup,
+    order_id: int,
+    price: int,
+    quantity: int,
+    item_name: str = "物品",
+    item_field: str = 'current_items'
+) -> Dict[str, Any]:
+    """
+    修改自己的掛單價格與數量（取代「取消 + 重新掛單」）
+    
+    修改後不會成交時直接在訂單簿中修改（order_id 不變，見 OrderBook.amend）；
+    修改後可與對手掛單成交時，改以新價格與數量重新撮合。集合競價模式一律只修改掛單。
+    
+    Args:
+        player: 玩家物件
+        group: 組別物件
+        order_id: 要修改的掛單
+        price: 新價格
+        quantity: 新數量
+        item_name: 物品名稱
+        item_field: 物品欄位名稱
         
-        # 沒有匹配或執行失敗，添加新賣單
-        sell_orders.append([player.id_in_group, price, quantity])
-        save_orders(group, buy_orders, sell_orders)
+    Returns:
+        process_new_order 格式的結果
+    """
+    player_id = player.id_in_group
+    book = get_order_book(group)
+    order = book.get(order_id)
+    if order is None or order.player_id != player_id:
+        return {
+            'type': 'fail',
+            'notifications': {
+                player_id: '該掛單已成交或取消'
+            }
+        }
     
-    print(f"成功添加{direction}單: 玩家{player.id_in_group}, 價格{price}, 數量{quantity}")
-    return {'type': 'order_added', 'update_all': True}
+    direction = order.direction
+    if price == order.price and quantity == order.quantity:
+        return {'type': 'order_amended', 'update_all': True}
+    
+    pending = -order.quantity if direction == SELL else 0  # 修改中的掛單本身不計入鎖定量
+    error = _order_error(player, book, direction, price, quantity, item_name, pending)
+    if error is not None:
+        return {
+            'type': 'fail',
+            'notifications': {
+                player_id: error
+            }
+        }
+    
+    if not is_batch_auction(group) and _would_match(book, direction, player_id, price, quantity):
+        book.remove(order_id)
+        result = _place_order(player, group, book, direction, price, quantity, item_name, item_field)
+    else:
+        book.amend(order_id, price, quantity)
+        print(f"修改{direction}單 #{order_id}: 玩家{player_id}, 價格{price}, 數量{quantity}")
+        result = {
+            'type': 'order_amended',
+            'update_all': True,
+            'notifications': {
+                player_id: f'掛單已修改為價格 {price}、數量 {quantity}'
+            }
+        }
+    save_order_book(group, book)
+    return result
 
 def process_accept_offer(
     player: BasePlayer,
@@ -546,38 +1614,31 @@ def process_accept_offer(
     # 確保價格為整數
     price = int(price)
     
+    if is_batch_auction(group):
+        # 集合競價沒有逐筆成交：以該掛單的價格與數量掛出對向訂單，參加本期撮合
+        return process_new_order(
+            player, group, opposite_side(offer_type), price, quantity, item_name, item_field
+        )
+    
+    # 被接受的掛單必須仍在訂單簿中（避免兩個接受請求先後成交同一筆掛單）
+    book = get_order_book(group)
+    if book.find_order(target_id, offer_type, price, quantity) is None:
+        return {
+            'type': 'fail',
+            'notifications': {
+                player.id_in_group: '該掛單已成交或取消'
+            }
+        }
+    
     try:
         if offer_type == 'sell':
             # 接受賣單（玩家是買方）
+            buyer = player
             seller = group.get_player_by_id(target_id)
-            execute_trade(group, player, seller, price, quantity, item_field)
-            
-            # 保留：交易成功時取消雙方其他訂單
-            cancel_player_orders(group, player.id_in_group, 'buy')
-            cancel_player_orders(group, target_id, 'sell')
-            
-            # 移除已成交的訂單
-            buy_orders, sell_orders = parse_orders(group)
-            sell_orders = [o for o in sell_orders if not (
-                int(o[0]) == target_id and 
-                float(o[1]) == price and 
-                int(o[2]) == quantity
-            )]
-            save_orders(group, buy_orders, sell_orders)
-            
-            return {
-                'type': 'trade_executed',
-                'update_all': True,
-                'notifications': {
-                    player.id_in_group: f'交易成功：您以價格 {price} 買入了 {quantity} 個{item_name}',
-                    target_id: f'交易成功：您以價格 {price} 賣出了 {quantity} 個{item_name}'
-                }
-            }
-            
         else:  # offer_type == 'buy'
             # 接受買單（玩家是賣方）
             # 先驗證賣方有足夠的物品
-            current_items = getattr(player, item_field)
+            current_items = settled_value(player, item_field)
             if current_items < quantity:
                 return {
                     'type': 'fail',
@@ -585,31 +1646,23 @@ def process_accept_offer(
                         player.id_in_group: f'您的{item_name}不足'
                     }
                 }
-            
             buyer = group.get_player_by_id(target_id)
-            execute_trade(group, buyer, player, price, quantity, item_field)
-            
-            # 保留：交易成功時取消雙方其他訂單
-            cancel_player_orders(group, target_id, 'buy')
-            cancel_player_orders(group, player.id_in_group, 'sell')
-            
-            # 移除已成交的訂單
-            buy_orders, sell_orders = parse_orders(group)
-            buy_orders = [o for o in buy_orders if not (
-                int(o[0]) == target_id and 
-                float(o[1]) == price and 
-                int(o[2]) == quantity
-            )]
-            save_orders(group, buy_orders, sell_orders)
-            
-            return {
-                'type': 'trade_executed',
-                'update_all': True,
-                'notifications': {
-                    player.id_in_group: f'交易成功：您以價格 {price} 賣出了 {quantity} 個{item_name}',
-                    target_id: f'交易成功：您以價格 {price} 買入了 {quantity} 個{item_name}'
-                }
-            }
+            seller = player
+        
+        execute_trade(group, buyer, seller, price, quantity, item_field)
+        
+        # 保留：交易成功時取消雙方其他訂單（被接受的掛單也一併移除）
+        book.cancel_player(buyer.id_in_group, 'buy')
+        book.cancel_player(seller.id_in_group, 'sell')
+        save_order_book(group, book)
+        
+        return {
+            'type': 'trade_executed',
+            'update_all': True,
+            'notifications': _trade_notifications(
+                buyer.id_in_group, seller.id_in_group, price, quantity, item_name
+            )
+        }
             
     except Exception as e:
         print(f"接受訂單失敗: {e}")
@@ -620,41 +1673,6 @@ def process_accept_offer(
             }
         }
 
-def calculate_locked_resources(
-    player: BasePlayer, 
-    buy_orders: List[List], 
-    sell_orders: List[List]
-) -> Tuple[float, int]:
-    """
-    計算已鎖定的資源
-    
-    Args:
-        player: 玩家物件
-        buy_orders: 買單列表
-        sell_orders: 賣單列表
-        
-    Returns:
-        (鎖定的現金, 鎖定的物品數量)
-    """
-    player_id = player.id_in_group
-    
-    # 買單邏輯改為無限制掛單，不再鎖定現金
-    locked_cash = 0
-    # locked_cash = sum(
-    #     float(order[1]) * int(order[2])
-    #     for order in buy_orders
-    #     if int(order[0]) == player_id
-    # )
-    
-    # 計算鎖定的物品（賣單）
-    locked_items = sum(
-        int(order[2])
-        for order in sell_orders
-        if int(order[0]) == player_id
-    )
-    
-    return locked_cash, locked_items
-
 def filter_top_orders_for_display(orders: List[List], max_per_quantity: int = 3) -> List[List]:
     """
     為顯示過濾訂單，每個數量級別保留最好的幾筆
@@ -766,29 +1784,9 @@ def record_submitted_offer(player, direction, price, quantity):
 
 def cancel_specific_order(group, player_id, direction, price, quantity):
     """取消特定訂單（共用）"""
-    def _parse_orders(orders_str):
-        try:
-            return json.loads(orders_str)
-        except Exception:
-            return []
-    buy_orders = _parse_orders(group.buy_orders)
-    sell_orders = _parse_orders(group.sell_orders)
-    
-    if direction == 'buy':
-        buy_orders = [o for o in buy_orders if not (
-            int(o[0]) == player_id and
-            float(o[1]) == price and 
-            int(o[2]) == quantity
-        )]
-    else:
-        sell_orders = [o for o in sell_orders if not (
-            int(o[0]) == player_id and
-            float(o[1]) == price and 
-            int(o[2]) == quantity
-        )]
-    
-    group.buy_orders = json.dumps(buy_orders)
-    group.sell_orders = json.dumps(sell_orders)
+    book = get_order_book(group)
+    book.cancel_specific(player_id, direction, price, quantity)
+    save_order_book(group, book)
 
 
 class CommonReadyWaitPage(WaitPage):